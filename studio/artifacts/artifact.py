@@ -1,6 +1,8 @@
 import hashlib
+import io
 import os
 import re
+import tempfile
 
 import tarfile
 try:
@@ -10,13 +12,23 @@ except ImportError:
 from typing import Dict
 
 from studio.artifacts import artifacts_tracker
+from studio.artifacts.blob_cache import get_blob_cache
+from studio.artifacts.blob_peers import fetch_from_peers
+from studio.artifacts.incremental_checkpoint import IncrementalCheckpoint
+from studio.artifacts.workspace_hash import workspace_hash
 from studio.util import util, logs
 from studio.credentials import credentials
 from studio.storage import storage_setup
 from studio.storage.storage_type import StorageType
 from studio.storage.storage_handler import StorageHandler
 from studio.storage.storage_handler_factory import StorageHandlerFactory
-from studio.storage.storage_util import tar_artifact, untar_artifact
+from studio.storage.compression import choose_compression, \
+    detect_codec, open_decompressed_reader
+from studio.storage.storage_util import clone_tree, open_tar_file, \
+    stream_tar_artifact, tar_artifact, untar_artifact
+
+# Size of stored tarball head read to find headers of its first files:
+TAR_HEAD_PROBE_SIZE = 16 * 1024
 
 # The purpose of this class is to encapsulate the logic
 # of handling artifact's state and it's transition between
@@ -67,6 +79,9 @@ class Artifact:
 
         if local_path is None:
             local_path = self.local_path
+        # Artifact may also be uploaded from a snapshot
+        # of its content taken elsewhere:
+        cache: bool = local_path == self.local_path
 
         if self.in_blobstore:
             msg: str = ('Artifact with key {0} exists in blobstore, ' +
@@ -75,28 +90,45 @@ class Artifact:
             return self.key
 
         if os.path.exists(local_path):
-            tar_filename =\
-                tar_artifact(local_path, self.key,
-                             self.get_compression(), self.logger)
-            if self.key is None:
-                self.key = 'blobstore/' + util.sha256_checksum(tar_filename) \
-                      + '.tar' + util.compression_to_extension(self.get_compression())
-                time_stamp = self.storage_handler.get_file_timestamp(self.key)
-                if time_stamp is not None:
-                    self.logger.debug(
-                        'Artifact with key %s exists in blobstore, skipping the upload',
-                        self.key)
-                    os.remove(tar_filename)
-                    return self.key
-
-            self.storage_handler.upload_file(self.key, tar_filename)
-            os.remove(tar_filename)
+            compression = choose_compression(local_path,
+                                             self.get_compression())
+            threads = self.storage_handler.get_compression_threads()
+            if self.key is not None and self.is_mutable:
+                self._get_checkpoint().upload(local_path, compression,
+                                              threads=threads, cache=cache)
+                return self.key
+            if self.key is not None:
+                stream_tar_artifact(local_path, self.key, compression,
+                                    self.storage_handler, self.logger,
+                                    cache=cache, threads=threads)
+                return self.key
+
+            # Content-addressed key comes from workspace content hash,
+            # so unchanged workspace is not even tarred again.
+            extension: str = '.tar' + \
+                util.compression_to_extension(compression)
+            key: str = 'blobstore/' + \
+                workspace_hash(local_path, self.logger) + extension
+            if self.storage_handler.get_cached_file_timestamp(key) is not None:
+                self.logger.debug(
+                    'Artifact with key %s exists in blobstore, skipping the upload',
+                    key)
+            else:
+                stream_tar_artifact(local_path, key, compression,
+                                    self.storage_handler, self.logger,
+                                    cache=False, threads=threads)
+            self.key = key
             return self.key
+
         self.logger.debug(
             "Local path %s does not exist. Not uploading anything.",
             local_path)
         return None
 
+    def _get_checkpoint(self) -> IncrementalCheckpoint:
+        return IncrementalCheckpoint(self.storage_handler, self.key,
+                                     self.logger)
+
     def get_compression(self):
         if self.storage_handler is not None:
             return self.storage_handler.get_compression()
@@ -116,7 +148,10 @@ class Artifact:
         local_path = artifacts_tracker.get_blob_cache(key)
         local_path =\
             self._get_target_local_path(local_path, self.remote_path)
-        if os.path.exists(local_path):
+        blob_cache = get_blob_cache()
+        blob_name = blob_cache.get_name(local_path)
+        if blob_name is not None and blob_cache.lookup(blob_name) \
+                and os.path.exists(local_path):
             msg: str = ('Immutable artifact exists at local_path {0},' +
                         ' skipping the download').format(local_path)
             self.logger.debug(msg)
@@ -132,6 +167,8 @@ class Artifact:
 
         self.storage_handler.download_remote_path(
             self.remote_path, local_path)
+        if blob_name is not None and os.path.exists(local_path):
+            blob_cache.add(blob_name)
 
         self.logger.debug('Downloaded file %s from external source %s',
                           local_path, self.remote_path)
@@ -143,7 +180,11 @@ class Artifact:
         self.logger.debug(
             'Comparing date of the artifact %s in storage with local %s',
             self.key, local_path)
-        storage_time = self.storage_handler.get_file_timestamp(self.key)
+        if self.is_mutable:
+            storage_time = self._get_checkpoint().get_timestamp()
+        else:
+            storage_time = \
+                self.storage_handler.get_cached_file_timestamp(self.key)
         local_time = os.path.getmtime(local_path)
         if storage_time is None:
             msg: str = \
@@ -161,29 +202,49 @@ class Artifact:
 
         return True
 
+    def _get_local_stored_path(self):
+        # Tarball in local storage can be read in place:
+        if self.storage_handler.type != StorageType.storageLocal:
+            return None
+        path = self.storage_handler.get_file_url(self.key)
+        if path is not None and os.path.isfile(path):
+            return path
+        return None
+
     def _download_and_untar_artifact(self, local_path):
-        tar_filename: str = util.get_temp_filename()
-        self.logger.debug("tar_filename = %s", tar_filename)
+        stored_path = self._get_local_stored_path()
+        if stored_path is not None:
+            tar_filename: str = stored_path
+        else:
+            tar_filename: str = util.get_temp_filename()
+            self.logger.debug("tar_filename = %s", tar_filename)
 
-        # Now download our artifact from studio.storage and untar it:
-        try:
-            result: bool = \
-                self.storage_handler.download_file(self.key, tar_filename)
-            if not result:
+            # Now download our artifact from studio.storage and untar it:
+            try:
+                result: bool = \
+                    self.storage_handler.download_file(self.key, tar_filename)
+                if not result:
+                    msg: str = \
+                        "FAILED to download {0}.".format(self.key)
+                    self.logger.info(msg)
+                    return None
+            except BaseException as exc:
+                util.check_for_kb_interrupt()
                 msg: str = \
-                    "FAILED to download {0}.".format(self.key)
+                    "FAILED to download {0}: {1}.".format(self.key, exc)
                 self.logger.info(msg)
                 return None
-        except BaseException as exc:
-            util.check_for_kb_interrupt()
-            msg: str = \
-                "FAILED to download {0}: {1}.".format(self.key, exc)
-            self.logger.info(msg)
-            return None
 
         if os.path.exists(tar_filename):
-            untar_artifact(local_path, tar_filename, self.logger)
-            os.remove(tar_filename)
+            extracted = untar_artifact(local_path, tar_filename, self.logger,
+                                       key=self.key)
+            if stored_path is None:
+                os.remove(tar_filename)
+            if not extracted:
+                return None
+            if self.is_mutable and os.path.isdir(local_path) and \
+                    not self._get_checkpoint().apply_deltas(local_path):
+                return None
             self.local_path = local_path
             return local_path
         self.logger.info('file %s download failed', tar_filename)
@@ -207,14 +268,30 @@ class Artifact:
                     local_path = artifacts_tracker.get_artifact_cache(self.key)
                 else:
                     local_path = artifacts_tracker.get_blob_cache(self.key)
-                    if os.path.exists(local_path):
+                    blob_cache = get_blob_cache()
+                    blob_name = blob_cache.get_name(local_path)
+                    if blob_name is not None and blob_cache.lookup(blob_name):
                         msg: str = ('Immutable artifact exists at local_path {0},' +
                                     ' skipping the download').format(local_path)
                         self.logger.debug(msg)
                         self.local_path = local_path
                         return local_path
+                    if blob_name is not None and \
+                            fetch_from_peers(blob_name, local_path,
+                                             self.logger):
+                        self.local_path = local_path
+                        result = local_path
+                    else:
+                        result = self._download_and_untar_artifact(local_path)
+                    if result is not None and blob_name is not None:
+                        blob_cache.add(blob_name)
+                    return result
 
         local_path = re.sub(r'\/\Z', '', local_path)
+        if not self.is_mutable and not os.path.exists(local_path) and \
+                self._clone_from_blob_cache(local_path):
+            return local_path
+
         self.logger.debug("Downloading dir %s to local path %s from studio.storage...",
                           self.key, local_path)
 
@@ -225,6 +302,24 @@ class Artifact:
         # Now download our artifact from studio.storage and untar it:
         return self._download_and_untar_artifact(local_path)
 
+    def _clone_from_blob_cache(self, local_path) -> bool:
+        # Immutable artifact already in the blob cache is
+        # cloned from there instead of being downloaded;
+        # it is hardlinked (sharing data with the cache)
+        # only if storage allows linking files.
+        blob_path = artifacts_tracker.get_blob_cache(self.key)
+        blob_cache = get_blob_cache()
+        blob_name = blob_cache.get_name(blob_path)
+        if blob_name is None or blob_path == local_path or \
+                not blob_cache.lookup(blob_name):
+            return False
+        self.logger.debug('Cloning immutable artifact %s from %s to %s',
+                          self.key, blob_path, local_path)
+        clone_tree(blob_path, local_path,
+                   hardlink=getattr(self.storage_handler, 'link_files', False))
+        self.local_path = local_path
+        return True
+
     def _get_target_local_path(self, local_path: str, remote_path: str):
         result: str = local_path
         dir_name, file_name = \
@@ -238,6 +333,9 @@ class Artifact:
     def delete(self):
         if self.key is not None:
             self.logger.debug('Deleting artifact: %s', self.key)
+            if self.is_mutable:
+                self._get_checkpoint().delete_deltas()
+                self._get_checkpoint().delete_members()
             self.storage_handler.delete_file(self.key, shallow=False)
 
 
@@ -250,7 +348,7 @@ class Artifact:
             url = None
 
         if get_timestamp:
-            timestamp = self.storage_handler.get_file_timestamp(self.key)
+            timestamp = self.storage_handler.get_cached_file_timestamp(self.key)
             return url, timestamp
         return url
 
@@ -262,9 +360,69 @@ class Artifact:
         result = url.startswith(local_prefix)
         return result
 
+    def _open_downloaded(self):
+        # Storage handler has no direct url for our artifact
+        # (for example, it is stored in chunks),
+        # so fetch it into temporary file and open that one.
+        tar_filename: str = util.get_temp_filename()
+        if not self.storage_handler.download_file(self.key, tar_filename):
+            return None
+        # pylint: disable=consider-using-with
+        fileobj = open(tar_filename, 'rb')
+        # File stays readable through open handle:
+        os.remove(tar_filename)
+        return fileobj
+
+    def _open_checkpoint(self):
+        # Latest state of incrementally checkpointed artifact
+        # is base tarball plus deltas, so rebuild it locally
+        # and open it as a single tarball.
+        temp_dir = tempfile.mkdtemp()
+        try:
+            local_path = os.path.join(temp_dir, self.name)
+            tar_filename: str = util.get_temp_filename()
+            if not self.storage_handler.download_file(self.key, tar_filename):
+                return None
+            extracted = untar_artifact(local_path, tar_filename, self.logger,
+                                       key=self.key)
+            os.remove(tar_filename)
+            if not extracted or \
+                    not self._get_checkpoint().apply_deltas(local_path):
+                return None
+            tar_filename = tar_artifact(local_path, None, None, self.logger,
+                                        cache=False)
+            # pylint: disable=consider-using-with
+            fileobj = open(tar_filename, 'rb')
+            # File stays readable through open handle:
+            os.remove(tar_filename)
+            return fileobj
+        finally:
+            util.rm_rf(temp_dir)
+
     def stream(self):
         url = self.get_url()
+        if self.is_mutable and self.key is not None and \
+                self._get_checkpoint().has_deltas():
+            url = None
         if url is None:
+            if self.key is None:
+                return None
+            if self.is_mutable:
+                fileobj = self._open_checkpoint()
+            else:
+                fileobj = self._open_downloaded()
+            if fileobj is None:
+                return None
+            try:
+                return tarfile.open(
+                    fileobj=open_decompressed_reader(fileobj, self.key),
+                    mode='r|')
+            except BaseException as exc:
+                util.check_for_kb_interrupt()
+                fileobj.close()
+                msg: str = 'FAILED to stream artifact {0}: {1}'\
+                    .format(self.key, exc)
+                util.report_fatal(msg, self.logger)
             return None
 
         # pylint: disable=consider-using-with
@@ -273,13 +431,22 @@ class Artifact:
         # (can happen in local execution mode)
         # then we just open a local file:
         if self._looks_like_local_file(url):
-            fileobj = open(url, 'rb')
-        else:
-            fileobj = urlopen(url)
+            try:
+                retval, _ = open_tar_file(url, self.key)
+                return retval
+            except BaseException as exc:
+                util.check_for_kb_interrupt()
+                msg: str = 'FAILED to stream artifact {0}: {1}'.format(url, exc)
+                util.report_fatal(msg, self.logger)
+            return None
+
+        fileobj = urlopen(url)
 
         if fileobj:
             try:
-                retval = tarfile.open(fileobj=fileobj, mode='r|*')
+                retval = tarfile.open(
+                    fileobj=open_decompressed_reader(fileobj, self.key),
+                    mode='r|')
                 return retval
             except BaseException as exc:
                 util.check_for_kb_interrupt()
@@ -288,6 +455,90 @@ class Artifact:
                 util.report_fatal(msg, self.logger)
         return None
 
+    def read_range(self, start: int = 0, length: int = None,
+                   member: str = None):
+        """
+        Read length bytes (or everything up to the end) of a file
+        in stored artifact, starting at start offset; negative start
+        counts from the end of the file. member is path of the file
+        inside artifact directory, it can be omitted for single file artifact.
+        Data of uncompressed stored tarballs is fetched
+        with ranged reads, other tarballs are streamed.
+        Returns None if there is no such file.
+        """
+        location = None
+        try:
+            location = self._locate_member(member)
+        except BaseException as exc:
+            util.check_for_kb_interrupt()
+            self.logger.debug('Cannot locate %s in %s: %s',
+                              member, self.key, repr(exc))
+        if location is not None:
+            data_offset, size = location
+            start, end = _get_range(start, length, size)
+            data = self.storage_handler.read_range(
+                self.key, data_offset + start, end - start)
+            if data is not None and len(data) == end - start:
+                return data
+
+        data = self._read_streamed_member(member)
+        if data is None:
+            return None
+        start, end = _get_range(start, length, len(data))
+        return data[start:end]
+
+    def read_tail(self, size: int, member: str = None):
+        """Read last size bytes of a file in stored artifact."""
+        return self.read_range(-size, None, member)
+
+    def _locate_member(self, member: str = None):
+        """
+        Find (data offset, size) of a file in stored tarball,
+        if tarball is not compressed.
+        """
+        if self.storage_handler is None:
+            return None
+        if self.key is None and \
+                self.storage_handler.type != StorageType.storageHTTP:
+            return None
+        if self.is_mutable and self.key is not None and \
+                self._get_checkpoint().has_deltas():
+            # Latest content may be spread over deltas:
+            return None
+
+        # Headers of first files are at the start of tarball:
+        head = self.storage_handler.read_range(self.key, 0,
+                                               TAR_HEAD_PROBE_SIZE)
+        if not head or detect_codec(head, self.key).name != 'none':
+            return None
+        with tarfile.open(fileobj=io.BytesIO(head), mode='r:') as tar:
+            try:
+                for info in tar:
+                    if info.isreg() and _is_member(info.name, member):
+                        return info.offset_data, info.size
+            except tarfile.ReadError:
+                # Next header is past the head we have read.
+                pass
+
+        if member is not None and self.is_mutable and self.key is not None:
+            members = self._get_checkpoint().get_members()
+            if members:
+                for name, location in members.items():
+                    if _is_member(name, member):
+                        return tuple(location)
+        return None
+
+    def _read_streamed_member(self, member: str = None):
+        tar = self.stream()
+        if tar is None:
+            return None
+        try:
+            for info in tar:
+                if info.isreg() and _is_member(info.name, member):
+                    return tar.extractfile(info).read()
+        finally:
+            tar.close()
+        return None
 
     def get_hash(self, local_path=None):
 
@@ -297,20 +548,13 @@ class Artifact:
         if local_path is None or not os.path.exists(local_path):
             return self._generate_key()
 
-        tar_filename =\
-            tar_artifact(local_path, self.key,
-                         self.get_compression(), self.logger)
-
         try:
-            retval = util.sha256_checksum(tar_filename)
-            os.remove(tar_filename)
-            self.logger.debug('deleted local artifact file %s', tar_filename)
-            return retval
+            return workspace_hash(local_path, self.logger)
         except BaseException as exc:
             util.check_for_kb_interrupt()
             self.logger.error(
                 'error generating a hash for %s: %s',
-                    tar_filename, repr(exc))
+                    local_path, repr(exc))
         return None
 
     def _is_s3_endpoint(self) -> bool:
@@ -412,9 +656,62 @@ class Artifact:
     @property
     def in_blobstore(self) -> bool:
         if self.key is not None and self.key.startswith('blobstore/') and \
-           self.storage_handler.get_file_timestamp(self.key) is not None:
+           self.storage_handler.get_cached_file_timestamp(self.key) is not None:
             return True
         return False
 
+    def get_metadata_keys(self, for_upload=False):
+        """
+        Keys which storage timestamps will be checked by following
+        upload (or download) of this artifact.
+        """
+        if self.key is None or self.storage_handler is None:
+            return []
+        keys = [self.key]
+        if self.is_mutable:
+            keys.append(self._get_checkpoint().get_index_key())
+            keys.append(self._get_checkpoint().get_members_key())
+        if for_upload:
+            if self.is_mutable or self.key.startswith('blobstore/'):
+                return keys
+            return []
+        if self.local_path is not None and os.path.exists(self.local_path):
+            return keys
+        if self.is_mutable and \
+                os.path.exists(artifacts_tracker.get_artifact_cache(self.key)):
+            return keys
+        return []
+
     def _generate_key(self):
         return hashlib.sha256(self.remote_path.encode()).hexdigest()
+
+
+def _is_member(name: str, member: str) -> bool:
+    # Without member name, first file in artifact is taken:
+    if member is None:
+        return True
+    return os.path.normpath(name) == os.path.normpath(member)
+
+
+def _get_range(start: int, length: int, size: int):
+    if start < 0:
+        start = max(0, size + start)
+    start = min(start, size)
+    end = size if length is None else min(size, start + length)
+    return start, end
+
+
+def prefetch_metadata(artifacts, for_upload=False):
+    """
+    Resolve storage timestamps needed by following upload (or download)
+    of given artifacts with one batched lookup per storage handler,
+    so that per-artifact checks are answered from metadata cache.
+    """
+    batches = dict()
+    for art in artifacts:
+        keys = art.get_metadata_keys(for_upload=for_upload)
+        if keys:
+            handler = art.storage_handler
+            batches.setdefault(id(handler), (handler, []))[1].extend(keys)
+    for handler, keys in batches.values():
+        handler.get_file_timestamps(keys)
@@ -3,6 +3,7 @@
     Used both for client and evaluator execution.
 """
 
+import hashlib
 import os
 import uuid
 import json
@@ -131,6 +132,39 @@ def get_blob_cache(blobkey):
     )
 
 
+def get_chunk_cache(chunk_hash):
+    chunkcache_dir = os.path.join(get_studio_home(), 'blobcache', 'chunks')
+    if not os.path.exists(chunkcache_dir):
+        os.makedirs(chunkcache_dir, exist_ok=True)
+
+    return os.path.join(chunkcache_dir, chunk_hash)
+
+
+def get_checkpoint_manifest(key):
+    manifest_dir = os.path.join(get_studio_home(), 'checkpoint_manifests')
+    if not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir, exist_ok=True)
+
+    return os.path.join(manifest_dir,
+                        hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+
+def get_download_state(location, local_dir):
+    """
+    Path of the resume state of a directory download
+    from given remote location into local_dir,
+    kept in studio home so the destination tree is not touched.
+    """
+    state_dir = os.path.join(get_studio_home(), 'download_states')
+    if not os.path.exists(state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+
+    state_key = location + '\n' + os.path.realpath(local_dir)
+    return os.path.join(state_dir,
+                        hashlib.sha256(state_key.encode()).hexdigest() +
+                        '.json')
+
+
 def _get_artifact_mapping_path(experiment_name=None):
     experiment_name = experiment_name if experiment_name else \
         os.environ[STUDIOML_EXPERIMENT]
@@ -0,0 +1,309 @@
+"""
+    Managed local cache of immutable blobs (~/.studioml/blobcache).
+    Keeps a persistent index of cached blobs with their size,
+    last access time, access count and pins, and evicts
+    least recently (or least frequently) used blobs
+    when total size of the cache exceeds configured budget.
+    Index is shared by all worker processes on the host
+    and guarded by a file lock.
+"""
+
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Dict
+
+import filelock
+import psutil
+
+from studio.artifacts.artifacts_tracker import get_studio_home
+from studio.storage.storage_setup import get_storage_verbose_level
+from studio.util import logs
+from studio.util import util
+
+INDEX_FILE_NAME = '.index.json'
+LOCK_FILE_NAME = '.index.lock'
+EVICT_PREFIX = '.evict-'
+# Sub-directory of the blob cache which is not a blob itself:
+CHUNKS_DIR_NAME = 'chunks'
+
+POLICY_LRU = 'lru'
+POLICY_LFU = 'lfu'
+
+_blob_cache = None
+
+
+class BlobCache:
+    def __init__(self, root: str = None, max_size=None, policy=POLICY_LRU):
+        self.logger = logs.get_logger(self.__class__.__name__)
+        self.logger.setLevel(get_storage_verbose_level())
+
+        self.root = root if root else \
+            os.path.join(get_studio_home(), 'blobcache')
+        os.makedirs(self.root, exist_ok=True)
+        self.max_size = util.str2size(max_size)
+        self.policy = policy.lower() if policy else POLICY_LRU
+        if self.policy not in [POLICY_LRU, POLICY_LFU]:
+            raise ValueError('Unknown blob cache eviction policy {0}'
+                             .format(policy))
+
+        self.index_path = os.path.join(self.root, INDEX_FILE_NAME)
+        self._lock = filelock.FileLock(
+            os.path.join(self.root, LOCK_FILE_NAME))
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def get_name(self, local_path: str):
+        """
+        Name of the cached blob which contains local_path,
+        or None if local_path is outside of the cache.
+        """
+        if local_path is None:
+            return None
+        rel_path = os.path.relpath(os.path.abspath(local_path),
+                                   os.path.abspath(self.root))
+        if rel_path.startswith('..') or rel_path == '.':
+            return None
+        name = rel_path.split(os.sep)[0]
+        if not self._is_blob_name(name):
+            return None
+        return name
+
+    def lookup(self, name: str) -> bool:
+        """
+        Check if blob is in the cache, recording a hit or a miss.
+        """
+        with self._lock:
+            index = self._load_index()
+            entry = index['blobs'].get(name, None)
+            if entry is not None and not os.path.exists(self.get_path(name)):
+                del index['blobs'][name]
+                entry = None
+            if entry is None and os.path.exists(self.get_path(name)):
+                # Blob was put in the cache by older version of studio
+                # or outside of it:
+                entry = self._new_entry(name)
+                index['blobs'][name] = entry
+            if entry is None:
+                index['stats']['misses'] += 1
+            else:
+                index['stats']['hits'] += 1
+                self._touch(entry)
+            self._save_index(index)
+        return entry is not None
+
+    def add(self, name: str):
+        """
+        Register blob which was just written into the cache
+        and evict other blobs if the cache is over budget.
+        """
+        with self._lock:
+            index = self._load_index()
+            entry = index['blobs'].get(name, None)
+            if entry is None:
+                entry = self._new_entry(name)
+                index['blobs'][name] = entry
+            else:
+                entry['size'] = _get_size(self.get_path(name))
+            self._touch(entry)
+            evicted = self._evict(index, keep=name)
+            self._save_index(index)
+        self._remove(evicted)
+
+    def pin(self, local_path: str, owner: int = None):
+        """
+        Protect blob containing local_path from eviction
+        while its owner (process id by default) is alive.
+        """
+        self._update_pins(local_path, owner, 1)
+
+    def unpin(self, local_path: str, owner: int = None):
+        self._update_pins(local_path, owner, -1)
+
+    def evict(self, max_size=None):
+        """Evict unpinned blobs until cache fits into max_size bytes."""
+        with self._lock:
+            index = self._load_index()
+            evicted = self._evict(index, max_size=util.str2size(max_size))
+            self._save_index(index)
+        self._remove(evicted)
+        return evicted
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            index = self._load_index()
+        stats = dict(index['stats'])
+        stats['blobs'] = len(index['blobs'])
+        stats['size'] = sum(entry['size'] for entry in index['blobs'].values())
+        stats['max_size'] = self.max_size
+        stats['policy'] = self.policy
+        return stats
+
+    def _update_pins(self, local_path: str, owner: int, delta: int):
+        name = self.get_name(local_path)
+        if name is None:
+            return
+        owner = str(owner if owner is not None else os.getpid())
+        with self._lock:
+            index = self._load_index()
+            entry = index['blobs'].get(name, None)
+            if entry is None:
+                if not os.path.exists(self.get_path(name)):
+                    return
+                entry = self._new_entry(name)
+                index['blobs'][name] = entry
+            pins = entry['pins']
+            pins[owner] = pins.get(owner, 0) + delta
+            if pins[owner] <= 0:
+                del pins[owner]
+            self._save_index(index)
+
+    def _is_pinned(self, entry) -> bool:
+        for owner in list(entry['pins'].keys()):
+            if not psutil.pid_exists(int(owner)):
+                # Pin is left over by dead process:
+                del entry['pins'][owner]
+        return len(entry['pins']) > 0
+
+    def _evict(self, index, keep: str = None, max_size=None):
+        max_size = max_size if max_size is not None else self.max_size
+        if max_size is None:
+            return []
+        blobs = index['blobs']
+        total_size = sum(entry['size'] for entry in blobs.values())
+        if total_size <= max_size:
+            return []
+
+        def order(item):
+            entry = item[1]
+            if self.policy == POLICY_LFU:
+                return entry['count'], entry['last_access']
+            return entry['last_access']
+
+        evicted = []
+        for name, entry in sorted(blobs.items(), key=order):
+            if total_size <= max_size:
+                break
+            if name == keep or self._is_pinned(entry):
+                continue
+            # Move blob out of the way while holding the lock,
+            # so other processes never see it half-deleted.
+            evict_path = os.path.join(
+                self.root, EVICT_PREFIX + str(uuid.uuid4()))
+            try:
+                os.rename(self.get_path(name), evict_path)
+            except OSError as exc:
+                self.logger.info('FAILED to evict blob %s: %s', name, exc)
+                continue
+            total_size -= entry['size']
+            del blobs[name]
+            index['stats']['evictions'] += 1
+            index['stats']['evicted_bytes'] += entry['size']
+            evicted.append(evict_path)
+            self.logger.debug('Evicted blob %s (%d bytes)',
+                              name, entry['size'])
+
+        if total_size > max_size:
+            self.logger.info(
+                'Blob cache size %d exceeds budget %d, '
+                'remaining blobs are pinned', total_size, max_size)
+        return evicted
+
+    def _remove(self, paths):
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def _new_entry(self, name: str) -> Dict:
+        path = self.get_path(name)
+        return {
+            'size': _get_size(path),
+            'last_access': os.path.getmtime(path),
+            'count': 0,
+            'pins': dict()
+        }
+
+    def _touch(self, entry):
+        entry['last_access'] = time.time()
+        entry['count'] += 1
+
+    def _is_blob_name(self, name: str) -> bool:
+        return not name.startswith('.') and name != CHUNKS_DIR_NAME
+
+    def _load_index(self) -> Dict:
+        index = None
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f_in:
+                    index = json.load(f_in)
+            except ValueError:
+                self.logger.info('Blob cache index %s is corrupted, '
+                                 'rebuilding it', self.index_path)
+        if index is None:
+            index = self._rebuild_index()
+        return index
+
+    def _rebuild_index(self) -> Dict:
+        index = {
+            'blobs': dict(),
+            'stats': {
+                'hits': 0,
+                'misses': 0,
+                'evictions': 0,
+                'evicted_bytes': 0
+            }
+        }
+        for name in os.listdir(self.root):
+            if self._is_blob_name(name):
+                index['blobs'][name] = self._new_entry(name)
+            elif name.startswith(EVICT_PREFIX):
+                # Leftover of interrupted eviction:
+                self._remove([self.get_path(name)])
+        return index
+
+    def _save_index(self, index: Dict):
+        tmp_path = self.index_path + '.' + str(uuid.uuid4())
+        with open(tmp_path, 'w') as f_out:
+            json.dump(index, f_out)
+        os.replace(tmp_path, self.index_path)
+
+
+def _get_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    total_size = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            if not os.path.islink(file_path):
+                total_size += os.path.getsize(file_path)
+    return total_size
+
+
+def setup_blob_cache(config: Dict):
+    """
+    Configure the blob cache from "blob_cache" section of studio config:
+        blob_cache:
+            max_size: 50g
+            policy: lru
+    """
+    global _blob_cache
+    config = config if config else dict()
+    _blob_cache = BlobCache(max_size=config.get('max_size', None),
+                            policy=config.get('policy', POLICY_LRU))
+    return _blob_cache
+
+
+def get_blob_cache() -> BlobCache:
+    global _blob_cache
+    if _blob_cache is None or \
+            _blob_cache.root != os.path.join(get_studio_home(), 'blobcache'):
+        max_size = _blob_cache.max_size if _blob_cache else None
+        policy = _blob_cache.policy if _blob_cache else POLICY_LRU
+        _blob_cache = BlobCache(max_size=max_size, policy=policy)
+    return _blob_cache
@@ -0,0 +1,339 @@
+"""
+    Sharing of immutable blobs between workers on the same network.
+    Each worker may run a blob server (a sidecar thread) which exposes
+    its blob cache over HTTP: GET /blobs/<name> streams uncompressed
+    tarball of cached blob. Before downloading immutable artifact
+    from the artifact store, workers ask their peers for it,
+    so a fleet starting the same sweep fetches each blob
+    from the origin store only a few times.
+    Peers are either listed statically in config, or discovered
+    through the database: every blob server registers itself there
+    and refreshes its record periodically.
+    Blobs got from peers are extracted into a private temporary
+    directory, refusing tarball members which would be written outside
+    of it, and checked against their names (workspace content hashes)
+    before being moved into the blob cache, so a faulty or malicious peer
+    cannot put wrong content there.
+    Blob server has no authentication: it listens only on the address
+    advertised to peers (or configured host), which should be
+    reachable only from the workers' private network.
+"""
+
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, List
+
+import requests
+
+from studio.artifacts.blob_cache import get_blob_cache
+from studio.artifacts.workspace_hash import workspace_hash
+from studio.storage import storage_setup
+from studio.storage.storage_setup import get_storage_verbose_level
+from studio.storage.storage_util import get_http_session, \
+    tar_artifact_to_stream, untar_artifact, HTTP_BUFFER_SIZE
+from studio.util import logs
+from studio.util import util
+
+DEFAULT_PORT = 7071
+BLOBS_PATH = '/blobs/'
+# Number of peers asked for a blob before going to the origin store:
+MAX_PEER_ATTEMPTS = 3
+# (connect, read) timeouts for peer requests, in seconds:
+PEER_TIMEOUT = (2, 30)
+# Blob servers refresh their database record this often (seconds),
+# and records older than PEER_TTL are ignored:
+HEARTBEAT_PERIOD = 60
+PEER_TTL = 5 * HEARTBEAT_PERIOD
+
+DISCOVERY_STATIC = 'static'
+DISCOVERY_DB = 'db'
+
+_config = dict()
+_server = None
+_server_lock = threading.Lock()
+# Peers discovered through the database: (time of lookup, urls)
+_discovered = (0, [])
+_discovered_lock = threading.Lock()
+
+
+def setup_blob_peers(config: Dict):
+    """
+    Configure blob sharing from "blob_peers" section of studio config:
+        blob_peers:
+            serve: true
+            port: 7071
+            advertise: 10.0.0.5
+            host: 10.0.0.5
+            discovery: db
+            peers:
+                - http://10.0.0.6:7071
+    Peers from the static list are used with any discovery method.
+    """
+    global _config, _discovered
+    _config = dict(config) if config else dict()
+    _discovered = (0, [])
+
+
+def get_peer_urls(exclude: str = None) -> List[str]:
+    """Base URLs of known blob servers, except exclude."""
+    urls = [url.rstrip('/') for url in _config.get('peers', None) or []]
+    if _config.get('discovery', DISCOVERY_STATIC) == DISCOVERY_DB:
+        urls.extend(_discover_peers())
+    if exclude is None and _server is not None:
+        exclude = _server.url
+    result = []
+    for url in urls:
+        if url != exclude and url not in result:
+            result.append(url)
+    return result
+
+
+def _discover_peers() -> List[str]:
+    # Peer records change slowly, so they are looked up
+    # once per heartbeat period rather than for every blob:
+    global _discovered
+    with _discovered_lock:
+        lookup_time, urls = _discovered
+        if time.time() - lookup_time < HEARTBEAT_PERIOD:
+            return urls
+        db_provider = storage_setup.get_storage_db_provider()
+        get_blob_peers = getattr(db_provider, 'get_blob_peers', None)
+        if get_blob_peers is None:
+            return []
+        try:
+            urls = get_blob_peers(max_age=PEER_TTL)
+        except BaseException as exc:
+            util.check_for_kb_interrupt()
+            logs.get_logger('blob_peers').info(
+                'FAILED to discover blob peers: %s', exc)
+            urls = []
+        _discovered = (time.time(), urls)
+        return urls
+
+
+def _is_content_hash(name: str) -> bool:
+    return len(name) == 64 and \
+        all(c in '0123456789abcdef' for c in name)
+
+
+def fetch_from_peers(name: str, local_path: str, logger) -> bool:
+    """
+    Try to get blob with given name from peers' blob caches
+    into local_path. Returns True on success.
+    Only blobs named by their content hash can be verified,
+    so only these are fetched from peers.
+    """
+    if not _is_content_hash(name):
+        return False
+    peers = get_peer_urls()
+    if not peers:
+        return False
+    random.shuffle(peers)
+    session = get_http_session()
+    parent_dir = os.path.dirname(os.path.abspath(local_path))
+    os.makedirs(parent_dir, exist_ok=True)
+    for url in peers[:MAX_PEER_ATTEMPTS]:
+        tar_filename = util.get_temp_filename() + '.tar'
+        temp_dir = tempfile.mkdtemp(dir=parent_dir, prefix='.peer-')
+        blob_path = os.path.join(temp_dir, os.path.basename(local_path))
+        tic = time.time()
+        try:
+            with session.get(url + BLOBS_PATH + name, stream=True,
+                             timeout=PEER_TIMEOUT) as response:
+                if response.status_code != 200:
+                    logger.debug('Peer %s has no blob %s (%d)',
+                                 url, name, response.status_code)
+                    continue
+                with open(tar_filename, 'wb') as f_out:
+                    for chunk in response.iter_content(HTTP_BUFFER_SIZE):
+                        f_out.write(chunk)
+            if not untar_artifact(blob_path, tar_filename, logger,
+                                  untrusted=True):
+                continue
+            if workspace_hash(blob_path, logger) != name:
+                logger.info('Blob %s from peer %s does not match its hash, '
+                            'discarding it', name, url)
+                continue
+            util.rm_rf(local_path)
+            os.replace(blob_path, local_path)
+            logger.debug('Got blob %s from peer %s in %f s',
+                         name, url, time.time() - tic)
+            return True
+        except (requests.exceptions.RequestException, OSError) as exc:
+            logger.debug('FAILED to get blob %s from peer %s: %s',
+                         name, url, exc)
+        finally:
+            if os.path.exists(tar_filename):
+                os.remove(tar_filename)
+            util.rm_rf(temp_dir)
+    return False
+
+
+class _ChunkedWriter:
+    """
+    Write-only file-like object sending data with HTTP chunked
+    transfer encoding. Tarball is sent without knowing its size upfront,
+    and the terminating chunk tells the client it got all of it.
+    """
+
+    def __init__(self, wfile, buffer_size: int = HTTP_BUFFER_SIZE):
+        self.wfile = wfile
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self._send()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        self._send()
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _send(self):
+        if self.buffer:
+            self.wfile.write('{0:x}\r\n'.format(len(self.buffer)).encode())
+            self.wfile.write(self.buffer)
+            self.wfile.write(b'\r\n')
+            self.buffer = bytearray()
+
+
+class _BlobRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format, *args)
+
+    def do_GET(self):
+        if not self.path.startswith(BLOBS_PATH):
+            self.send_error(404)
+            return
+        name = self.path[len(BLOBS_PATH):]
+        blob_cache = get_blob_cache()
+        blob_path = blob_cache.get_path(name)
+        if name != os.path.basename(name) or \
+                blob_cache.get_name(blob_path) != name or \
+                not os.path.exists(blob_path):
+            self.send_error(404)
+            return
+        # Blob must not be evicted while we are sending it:
+        blob_cache.pin(blob_path)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-tar')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            writer = _ChunkedWriter(self.wfile)
+            tar_artifact_to_stream(blob_path, None, None, writer,
+                                   self.server.logger, cache=False)
+            writer.finish()
+            self.server.logger.debug('Served blob %s to %s',
+                                     name, self.client_address[0])
+        except BaseException as exc:
+            util.check_for_kb_interrupt()
+            # Response is cut before its last chunk,
+            # so client knows it is incomplete:
+            self.server.logger.info('FAILED to serve blob %s: %s', name, exc)
+        finally:
+            blob_cache.unpin(blob_path)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class BlobServer:
+    def __init__(self, host: str = None, port: int = DEFAULT_PORT,
+                 advertise: str = None, register: bool = False):
+        self.logger = logs.get_logger(self.__class__.__name__)
+        self.logger.setLevel(get_storage_verbose_level())
+
+        if advertise is None:
+            advertise = socket.gethostbyname(socket.gethostname())
+        # Only the interface peers use is exposed, not all of them:
+        if host is None:
+            host = advertise
+        self.httpd = _ThreadingHTTPServer((host, port), _BlobRequestHandler)
+        self.httpd.logger = self.logger
+        self.port = self.httpd.server_address[1]
+        self.url = 'http://{0}:{1}'.format(advertise, self.port)
+        self.peer_id = '{0}_{1}'.format(advertise, self.port)
+        self.register = register
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._threads.append(threading.Thread(
+            target=self.httpd.serve_forever, name='BlobServer', daemon=True))
+        if self.register:
+            self._threads.append(threading.Thread(
+                target=self._heartbeat_loop, name='BlobServerHeartbeat',
+                daemon=True))
+        for thread in self._threads:
+            thread.start()
+        self.logger.info('Serving blob cache at %s', self.url)
+
+    def stop(self):
+        self._stopped.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.register:
+            db_provider = storage_setup.get_storage_db_provider()
+            if hasattr(db_provider, 'unregister_blob_peer'):
+                db_provider.unregister_blob_peer(self.peer_id)
+
+    def _heartbeat_loop(self):
+        while not self._stopped.is_set():
+            db_provider = storage_setup.get_storage_db_provider()
+            if hasattr(db_provider, 'register_blob_peer'):
+                try:
+                    db_provider.register_blob_peer(self.peer_id, self.url)
+                except BaseException as exc:
+                    util.check_for_kb_interrupt()
+                    self.logger.info('FAILED to register blob server: %s',
+                                     exc)
+            self._stopped.wait(HEARTBEAT_PERIOD)
+
+
+def start_blob_server():
+    """
+    Start blob server of this process, if configured
+    and not started yet. Returns the server or None.
+    """
+    global _server
+    serve = _config.get('serve', False)
+    if isinstance(serve, str):
+        serve = serve.lower() == 'true'
+    if not serve:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = BlobServer(
+                host=_config.get('host', None),
+                port=int(_config.get('port', DEFAULT_PORT)),
+                advertise=_config.get('advertise', None),
+                register=_config.get('discovery',
+                                     DISCOVERY_STATIC) == DISCOVERY_DB)
+            _server.start()
+        return _server
+
+
+def stop_blob_server():
+    global _server
+    with _server_lock:
+        if _server is not None:
+            _server.stop()
+            _server = None
@@ -0,0 +1,317 @@
+"""
+    Incremental checkpoints of mutable directory artifacts.
+    Artifact key holds full (base) tarball of the artifact.
+    Later checkpoints upload only files which were added or changed
+    since the last one, as delta tarballs stored under "<key>.delta/",
+    listed in order in "<key>.delta/index.json" together with
+    files deleted by each delta.
+    Uncompressed base tarball of directory comes with
+    "<key>.members.json" index of its files' data offsets,
+    used for ranged reads of single files.
+    Local manifest of the last uploaded state (path, size, mtime, hash)
+    tells which files have changed. When deltas grow too many or too big,
+    next checkpoint uploads full tarball again and drops the deltas.
+"""
+
+import json
+import os
+import time
+from typing import Dict
+
+from studio.artifacts import artifacts_tracker
+from studio.storage.compression import get_codec
+from studio.storage.ignore_matcher import get_ignore_matcher, walk_files
+from studio.storage.storage_util import stream_tar_artifact, \
+    untar_artifact_update
+from studio.util import util
+
+DELTA_SUFFIX = '.delta/'
+INDEX_NAME = 'index.json'
+MEMBERS_SUFFIX = '.members.json'
+MANIFEST_VERSION = 1
+# Compact deltas into new base tarball, when there are this many of them:
+MAX_SEGMENTS = 16
+# ... or when their total size exceeds this fraction of base size:
+MAX_DELTA_RATIO = 1.0
+
+
+def scan_files(local_path: str) -> Dict:
+    """
+    Map of relative file path -> [size, mtime_ns]
+    for all files under local_path directory,
+    except ones excluded by its ignore file.
+    """
+    if not os.path.isdir(local_path):
+        stat = os.stat(local_path)
+        return {os.path.basename(local_path):
+                [stat.st_size, stat.st_mtime_ns]}
+    result = dict()
+    for rel_path, entry in walk_files(local_path,
+                                      get_ignore_matcher(local_path)):
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        result[rel_path] = [stat.st_size, stat.st_mtime_ns]
+    return result
+
+
+class IncrementalCheckpoint:
+    def __init__(self, storage_handler, key: str, logger):
+        self.storage_handler = storage_handler
+        self.key = key
+        self.logger = logger
+        self.manifest_path = artifacts_tracker.get_checkpoint_manifest(key)
+
+    def get_index_key(self) -> str:
+        return self.key + DELTA_SUFFIX + INDEX_NAME
+
+    def get_members_key(self) -> str:
+        return self.key + MEMBERS_SUFFIX
+
+    def _get_segment_key(self, seq: int) -> str:
+        extension = self.key[self.key.rfind('.tar'):] \
+            if '.tar' in self.key else '.tar'
+        return self.key + DELTA_SUFFIX + '{0:06d}'.format(seq) + extension
+
+    def upload(self, local_path: str, compression, threads: int = 1,
+               cache: bool = True):
+        current = scan_files(local_path)
+        manifest = self._load_manifest()
+        if manifest is not None and not self._is_remote_current(manifest):
+            self.logger.debug('Stored %s was changed by someone else, '
+                              'doing full checkpoint', self.key)
+            manifest = None
+
+        if manifest is not None:
+            changed, deleted = self._get_changes(manifest, local_path, current)
+            if not changed and not deleted:
+                self.logger.debug(
+                    'No changes in %s, skipping checkpoint to %s',
+                    local_path, self.key)
+                self._save_manifest(manifest)
+                return
+            delta_size = sum(current[rel_path][0] for rel_path in changed)
+            if os.path.isdir(local_path) and \
+                    len(manifest['segments']) < MAX_SEGMENTS and \
+                    manifest['delta_size'] + delta_size <= \
+                    MAX_DELTA_RATIO * manifest['base_size']:
+                self._upload_delta(manifest, local_path, current,
+                                   changed, deleted, delta_size,
+                                   compression, threads)
+                return
+
+        self._upload_full(manifest, local_path, current, compression, threads,
+                          cache=cache)
+
+    def _get_changes(self, manifest, local_path: str, current: Dict):
+        files = manifest['files']
+        changed = []
+        for rel_path, (size, mtime) in current.items():
+            entry = files.get(rel_path, None)
+            if entry is not None and entry['size'] == size:
+                if entry['mtime'] == mtime:
+                    continue
+                # File was touched, check if content really changed:
+                file_hash = util.sha256_checksum(
+                    os.path.join(local_path, rel_path)
+                    if os.path.isdir(local_path) else local_path)
+                if file_hash == entry.get('hash', None):
+                    entry['mtime'] = mtime
+                    continue
+                entry['hash'] = file_hash
+            elif entry is not None:
+                # Size changed, so known hash is stale:
+                entry.pop('hash', None)
+            changed.append(rel_path)
+        deleted = [rel_path for rel_path in files
+                   if rel_path not in current]
+        return sorted(changed), sorted(deleted)
+
+    def _upload_delta(self, manifest, local_path: str, current: Dict,
+                      changed, deleted, delta_size: int,
+                      compression, threads: int):
+        seq = manifest['seq'] + 1
+        segment_key = self._get_segment_key(seq)
+        stream_tar_artifact(local_path, segment_key, compression,
+                            self.storage_handler, self.logger,
+                            cache=False, threads=threads, members=changed)
+        manifest['segments'].append({'key': segment_key, 'deleted': deleted})
+        # Index is updated only after its new segment is fully uploaded,
+        # so readers never see partial state:
+        self._upload_index(manifest['segments'])
+
+        for rel_path in deleted:
+            del manifest['files'][rel_path]
+        for rel_path in changed:
+            entry = manifest['files'].get(rel_path, dict())
+            entry['size'], entry['mtime'] = current[rel_path]
+            manifest['files'][rel_path] = entry
+        manifest['seq'] = seq
+        manifest['delta_size'] += delta_size
+        manifest['index_timestamp'] = self.storage_handler \
+            .get_cached_file_timestamp(self.get_index_key())
+        self._save_manifest(manifest)
+        self.logger.debug('Uploaded delta %s of %s: %d changed, %d deleted, '
+                          '%d bytes', segment_key, self.key, len(changed),
+                          len(deleted), delta_size)
+
+    def _upload_full(self, manifest, local_path: str, current: Dict,
+                     compression, threads: int, cache: bool = True):
+        old_segments = self._get_remote_segments(manifest)
+        if old_segments:
+            # Drop the index first: until new base is uploaded,
+            # readers see old base without deltas, and never
+            # old deltas on top of new base.
+            self.storage_handler.delete_file(self.get_index_key())
+        # Same for members index, which is only valid for its base:
+        self.delete_members()
+        members = dict() if os.path.isdir(local_path) and \
+            get_codec(compression).name == 'none' else None
+        stream_tar_artifact(local_path, self.key, compression,
+                            self.storage_handler, self.logger,
+                            cache=cache, threads=threads, index=members)
+        if members:
+            self._upload_json(self.get_members_key(), members)
+        for segment in old_segments:
+            self.storage_handler.delete_file(segment['key'])
+
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'key': self.key,
+            'files': {rel_path: {'size': size, 'mtime': mtime}
+                      for rel_path, (size, mtime) in current.items()},
+            'base_size': sum(size for size, _ in current.values()),
+            'base_timestamp':
+                self.storage_handler.get_cached_file_timestamp(self.key),
+            'index_timestamp': None,
+            'delta_size': 0,
+            'seq': manifest['seq'] if manifest else 0,
+            'segments': []
+        }
+        self._save_manifest(manifest)
+
+    def _is_remote_current(self, manifest) -> bool:
+        timestamps = self.storage_handler.get_file_timestamps(
+            [self.key, self.get_index_key()])
+        return timestamps[self.key] == manifest['base_timestamp'] and \
+            timestamps[self.get_index_key()] == manifest['index_timestamp']
+
+    def _get_remote_segments(self, manifest):
+        if manifest is not None:
+            return manifest['segments']
+        index = self._download_index()
+        return index['segments'] if index else []
+
+    def _upload_index(self, segments):
+        self._upload_json(self.get_index_key(),
+                          {'version': MANIFEST_VERSION,
+                           'time': time.time(),
+                           'segments': segments})
+
+    def _upload_json(self, key: str, data):
+        json_file = util.get_temp_filename()
+        try:
+            with open(json_file, 'w') as f_out:
+                json.dump(data, f_out)
+            self.storage_handler.upload_file(key, json_file)
+        finally:
+            os.remove(json_file)
+
+    def _download_index(self):
+        if self.storage_handler.get_cached_file_timestamp(
+                self.get_index_key()) is None:
+            return None
+        index_file = util.get_temp_filename()
+        try:
+            if not self.storage_handler.download_file(
+                    self.get_index_key(), index_file):
+                return None
+            with open(index_file, 'r') as f_in:
+                return json.load(f_in)
+        finally:
+            if os.path.exists(index_file):
+                os.remove(index_file)
+
+    def has_deltas(self) -> bool:
+        return self.storage_handler.get_cached_file_timestamp(
+            self.get_index_key()) is not None
+
+    def get_timestamp(self):
+        """Time of the latest checkpoint in storage, base or delta."""
+        timestamps = self.storage_handler.get_file_timestamps(
+            [self.key, self.get_index_key()])
+        values = [t for t in timestamps.values() if t is not None]
+        return max(values) if values else None
+
+    def apply_deltas(self, local_path: str) -> bool:
+        """
+        Bring downloaded base content of artifact at local_path
+        up to date with stored deltas.
+        """
+        index = self._download_index()
+        if index is None:
+            return True
+        for segment in index['segments']:
+            tar_filename = util.get_temp_filename()
+            try:
+                if not self.storage_handler.download_file(
+                        segment['key'], tar_filename):
+                    self.logger.info('FAILED to download delta %s of %s',
+                                     segment['key'], self.key)
+                    return False
+                if not untar_artifact_update(local_path, tar_filename,
+                                             self.logger, key=segment['key'],
+                                             deleted=segment['deleted']):
+                    return False
+            finally:
+                if os.path.exists(tar_filename):
+                    os.remove(tar_filename)
+        self.logger.debug('Applied %d deltas of %s to %s',
+                          len(index['segments']), self.key, local_path)
+        return True
+
+    def delete_deltas(self):
+        index = self._download_index()
+        if index is None:
+            return
+        self.storage_handler.delete_file(self.get_index_key())
+        for segment in index['segments']:
+            self.storage_handler.delete_file(segment['key'])
+
+    def get_members(self):
+        """
+        Index of base tarball: member name -> [data offset, size],
+        or None if there is no index.
+        """
+        data = self.storage_handler.read_range(self.get_members_key(), 0)
+        if not data:
+            return None
+        try:
+            return json.loads(data.decode('utf-8'))
+        except ValueError:
+            return None
+
+    def delete_members(self):
+        if self.storage_handler.get_cached_file_timestamp(
+                self.get_members_key()) is not None:
+            self.storage_handler.delete_file(self.get_members_key())
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, 'r') as f_in:
+                manifest = json.load(f_in)
+        except ValueError:
+            return None
+        if manifest.get('version') != MANIFEST_VERSION or \
+                manifest.get('key') != self.key:
+            return None
+        return manifest
+
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f_out:
+            json.dump(manifest, f_out)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,239 @@
+"""
+    Content-only hash of artifact workspace, used to derive
+    blobstore keys of immutable artifacts.
+    Unlike sha256 of artifact tarball, it does not depend on
+    file modification times, owners or permissions (except for
+    executable bit), so the same content gets the same key
+    on any machine.
+    Each file is hashed separately (in a thread pool), and file hashes
+    are combined into Merkle tree of directories in sorted name order,
+    git style: with file modes, empty directories,
+    and whether the root is a file or a directory.
+    File hashes are cached in local sqlite database
+    (~/.studioml/hash_cache.db) by path, inode, size and mtime,
+    so re-hashing unchanged workspace only needs to stat its files.
+"""
+
+import hashlib
+import os
+import sqlite3
+import stat as stat_module
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from studio.artifacts.artifacts_tracker import get_studio_home
+from studio.storage.ignore_matcher import get_ignore_matcher, walk_files
+from studio.storage.storage_setup import get_storage_verbose_level
+from studio.util import logs
+from studio.util import util
+
+HASH_CACHE_FILE_NAME = 'hash_cache.db'
+HASH_WORKERS = 8
+HASH_BLOCK_SIZE = 1024 * 1024
+# Files modified this recently may still be written to
+# within the same mtime tick, so their hashes are not cached:
+RACY_INTERVAL_NS = 2 * 1000 * 1000 * 1000
+# Tree entry modes, as in git:
+MODE_FILE = '100644'
+MODE_EXECUTABLE = '100755'
+MODE_LINK = '120000'
+MODE_TREE = '40000'
+
+_hash_cache = None
+_hash_cache_lock = threading.Lock()
+
+
+class HashCache:
+    """
+    Persistent map of absolute file path ->
+    (inode, size, mtime_ns, sha256 of content).
+    Shared by all processes on the host, sqlite takes care of locking.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.logger = logs.get_logger(self.__class__.__name__)
+        self.logger.setLevel(get_storage_verbose_level())
+
+        self.db_path = db_path if db_path else \
+            os.path.join(get_studio_home(), HASH_CACHE_FILE_NAME)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS files ('
+                    'path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, '
+                    'mtime_ns INTEGER, hash TEXT)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def load(self, root: str) -> Dict:
+        """
+        Cached entries for root file, or all files under root directory,
+        as map of path -> (inode, size, mtime_ns, hash).
+        """
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    'SELECT path, inode, size, mtime_ns, hash FROM files '
+                    'WHERE path = ? OR (path >= ? AND path < ?)',
+                    (root, root + '/', root + '0')).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as exc:
+            self.logger.info('FAILED to read hash cache %s: %s',
+                             self.db_path, exc)
+            return dict()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def update(self, entries: Dict, stale=()):
+        """
+        Store entries (path -> (inode, size, mtime_ns, hash))
+        and drop entries for stale paths.
+        """
+        if not entries and not stale:
+            return
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        'DELETE FROM files WHERE path = ?',
+                        [(path,) for path in stale])
+                    conn.executemany(
+                        'INSERT OR REPLACE INTO files '
+                        '(path, inode, size, mtime_ns, hash) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        [(path,) + tuple(value)
+                         for path, value in entries.items()])
+            finally:
+                conn.close()
+        except sqlite3.Error as exc:
+            self.logger.info('FAILED to update hash cache %s: %s',
+                             self.db_path, exc)
+
+
+def get_hash_cache() -> HashCache:
+    global _hash_cache
+    db_path = os.path.join(get_studio_home(), HASH_CACHE_FILE_NAME)
+    with _hash_cache_lock:
+        if _hash_cache is None or _hash_cache.db_path != db_path:
+            _hash_cache = HashCache(db_path)
+        return _hash_cache
+
+
+def _hash_file(path: str, is_link: bool) -> str:
+    if is_link:
+        target = os.readlink(path).encode('utf-8', 'surrogateescape')
+        return hashlib.sha256(target).hexdigest()
+    return util.sha256_checksum(path, block_size=HASH_BLOCK_SIZE)
+
+
+def _get_mode(stat, is_link: bool) -> str:
+    if is_link:
+        return MODE_LINK
+    if stat.st_mode & stat_module.S_IXUSR:
+        return MODE_EXECUTABLE
+    return MODE_FILE
+
+
+def _combine(file_hashes: Dict, dir_paths, is_dir: bool) -> str:
+    tree = dict()
+    for rel_path in dir_paths:
+        node = tree
+        for part in rel_path.split('/'):
+            node = node.setdefault(part, dict())
+    for rel_path, file_entry in file_hashes.items():
+        parts = rel_path.split('/')
+        node = tree
+        for part in parts[:-1]:
+            node = node.setdefault(part, dict())
+        node[parts[-1]] = file_entry
+    root_type = 'tree' if is_dir else 'blob'
+    record = 'root {0}\0{1}\n'.format(root_type, _hash_tree(tree))
+    return hashlib.sha256(record.encode('utf-8')).hexdigest()
+
+
+def _hash_tree(node: Dict) -> str:
+    hashobj = hashlib.sha256()
+    for name in sorted(node.keys()):
+        child = node[name]
+        if isinstance(child, dict):
+            record = 'tree {0} {1}\0{2}\n'.format(
+                MODE_TREE, name, _hash_tree(child))
+        else:
+            mode, file_hash = child
+            record = 'blob {0} {1}\0{2}\n'.format(mode, name, file_hash)
+        hashobj.update(record.encode('utf-8', 'surrogateescape'))
+    return hashobj.hexdigest()
+
+
+def workspace_hash(local_path: str, logger=None,
+                   cache: HashCache = None,
+                   workers: int = HASH_WORKERS) -> str:
+    """
+    Content hash of file or directory at local_path,
+    with files excluded by its ignore file left out.
+    """
+    if logger is None:
+        logger = logs.get_logger('workspace_hash')
+        logger.setLevel(get_storage_verbose_level())
+    if cache is None:
+        cache = get_hash_cache()
+
+    tic = time.time()
+    root = os.path.abspath(local_path)
+    is_dir = os.path.isdir(root)
+    dir_paths = []
+    if is_dir:
+        files = []
+        for rel_path, entry in walk_files(root, get_ignore_matcher(root),
+                                          dirs=True):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dir_paths.append(rel_path)
+                    continue
+                files.append((rel_path, entry.path, entry.is_symlink(),
+                              entry.stat(follow_symlinks=False)))
+            except OSError:
+                continue
+    else:
+        files = [(os.path.basename(root), root, os.path.islink(root),
+                  os.stat(root, follow_symlinks=False))]
+
+    cached = cache.load(root)
+    file_hashes = dict()
+    to_hash = []
+    for rel_path, path, is_link, stat in files:
+        entry = cached.get(path, None)
+        if entry is not None and \
+                entry[:3] == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            file_hashes[rel_path] = (_get_mode(stat, is_link), entry[3])
+        else:
+            to_hash.append((rel_path, path, is_link, stat))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        hashes = list(executor.map(
+            lambda item: _hash_file(item[1], item[2]), to_hash))
+
+    now_ns = int(time.time() * 1e9)
+    updates = dict()
+    for (rel_path, path, is_link, stat), file_hash in zip(to_hash, hashes):
+        file_hashes[rel_path] = (_get_mode(stat, is_link), file_hash)
+        if now_ns - stat.st_mtime_ns >= RACY_INTERVAL_NS:
+            updates[path] = (stat.st_ino, stat.st_size,
+                             stat.st_mtime_ns, file_hash)
+    current = set(path for _, path, _, _ in files)
+    cache.update(updates,
+                 stale=[path for path in cached if path not in current])
+
+    result = _combine(file_hashes, dir_paths, is_dir)
+    logger.debug('Hashed %s: %d files, %d re-hashed, in %f s',
+                 local_path, len(files), len(to_hash), time.time() - tic)
+    return result
@@ -0,0 +1,388 @@
+"""
+    Background uploader of experiment checkpoints for local worker.
+    Checkpoint is done in two steps: mutable artifacts of experiment
+    are quickly snapshotted into staging area (~/.studioml/checkpoint_uploads)
+    by hardlinking or cloning their files, and the snapshot is uploaded
+    by background thread while worker goes on with its next job.
+    Last uploaded snapshot of every experiment is kept as a base
+    for the next one, which hardlinks files unchanged since then.
+    Number of snapshots waiting for upload is bounded, so producers
+    block when uploads fall behind. Every pending upload is recorded
+    in on-disk journal, and uploads left over by previous worker
+    process are resumed on start; so are final checkpoints
+    whose upload failed. Journal keeps only database and storage config
+    of uploads, without credentials, which are taken from config
+    of the resuming worker.
+"""
+
+import copy
+import json
+import os
+import queue
+import shutil
+import stat as stat_module
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import filelock
+import psutil
+
+from studio import model
+from studio.artifacts import artifacts_tracker
+from studio.artifacts.artifact import prefetch_metadata
+from studio.credentials.credentials import KEY_CREDENTIALS
+from studio.storage.ignore_matcher import get_ignore_matcher, walk_files
+from studio.storage.storage_util import copy_file_fast
+from studio.util import logs
+from studio.util.util import retry, check_for_kb_interrupt
+
+UPLOADS_DIR_NAME = 'checkpoint_uploads'
+JOURNAL_DIR_NAME = 'journal'
+STAGING_DIR_NAME = 'staging'
+LOCK_FILE_NAME = 'journal.lock'
+# Base snapshots of worker process are kept in staging/base-<pid>:
+BASE_DIR_PREFIX = 'base-'
+
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_RETRIES = 5
+DEFAULT_RETRY_SLEEP = 10
+UPLOAD_WORKERS = 8
+# Parts of config written to journal (without credentials):
+JOURNAL_CONFIG_KEYS = ('database', 'storage', 'verbose')
+
+
+def snapshot_artifact(local_path: str, staged_path: str, hardlink: bool,
+                      base_path: str = None):
+    """
+    Capture current content of artifact at local_path into staged_path.
+    Hardlinks are only safe when nobody writes to artifact files anymore,
+    otherwise files are cloned (or copied) with their modification times,
+    so that incremental checkpoints see unchanged files as such.
+    If base_path (previous snapshot of the same artifact) is given,
+    files with the same size and modification time as there
+    are hardlinked from it: snapshots are never written to,
+    so sharing their files is safe.
+    Files excluded by artifact's ignore file are not staged.
+    """
+    if not os.path.isdir(local_path):
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        _snapshot_file(local_path, staged_path, hardlink, base_path)
+        return
+    os.makedirs(staged_path, exist_ok=True)
+    for rel_path, entry in walk_files(local_path,
+                                      get_ignore_matcher(local_path)):
+        target_path = os.path.join(staged_path, rel_path)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        base_file = os.path.join(base_path, rel_path) \
+            if base_path is not None else None
+        try:
+            _snapshot_file(entry.path, target_path, hardlink, base_file)
+        except FileNotFoundError:
+            # File was removed while we were walking the directory:
+            continue
+
+
+def _snapshot_file(src_path: str, dst_path: str, hardlink: bool,
+                   base_path: str = None):
+    if os.path.islink(src_path):
+        os.symlink(os.readlink(src_path), dst_path)
+        return
+    stat = os.stat(src_path)
+    if base_path is not None and _link_unchanged(base_path, dst_path, stat):
+        return
+    copy_file_fast(src_path, dst_path, hardlink=hardlink)
+    if not os.path.samefile(src_path, dst_path):
+        os.utime(dst_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def _link_unchanged(base_path: str, dst_path: str, stat) -> bool:
+    try:
+        base_stat = os.stat(base_path, follow_symlinks=False)
+        if not stat_module.S_ISREG(base_stat.st_mode) or \
+                base_stat.st_size != stat.st_size or \
+                base_stat.st_mtime_ns != stat.st_mtime_ns:
+            return False
+        os.link(base_path, dst_path)
+        return True
+    except OSError:
+        # Base snapshot is gone or cannot be linked, file is copied:
+        return False
+
+
+def _remove_credentials(value):
+    if isinstance(value, dict):
+        return {name: _remove_credentials(item)
+                for name, item in value.items()
+                if name != KEY_CREDENTIALS}
+    if isinstance(value, list):
+        return [_remove_credentials(item) for item in value]
+    return value
+
+
+def _get_journal_config(config):
+    """Part of config needed to upload checkpoint, without credentials."""
+    return {name: _remove_credentials(config[name])
+            for name in JOURNAL_CONFIG_KEYS if name in config}
+
+
+def _restore_credentials(journal_config, config):
+    """
+    Config from journal, with sections which are the same in config
+    (up to credentials) taken from config with their credentials.
+    """
+    result = copy.deepcopy(journal_config)
+    if not config:
+        return result
+    for name, section in journal_config.items():
+        own_section = config.get(name, None)
+        if isinstance(section, dict) and isinstance(own_section, dict) \
+                and _remove_credentials(own_section) == section:
+            result[name] = copy.deepcopy(own_section)
+    return result
+
+
+class CheckpointUploader:
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 retries: int = DEFAULT_RETRIES,
+                 retry_sleep: float = DEFAULT_RETRY_SLEEP,
+                 root: str = None, config=None, verbose=None):
+        self.logger = logs.get_logger(self.__class__.__name__)
+        if verbose is not None:
+            self.logger.setLevel(verbose)
+        # Credentials for uploads resumed from journal:
+        self.config = config
+
+        self.root = root if root else \
+            os.path.join(artifacts_tracker.get_studio_home(), UPLOADS_DIR_NAME)
+        self.journal_dir = os.path.join(self.root, JOURNAL_DIR_NAME)
+        self.staging_dir = os.path.join(self.root, STAGING_DIR_NAME)
+        self.base_dir = os.path.join(
+            self.staging_dir, BASE_DIR_PREFIX + str(os.getpid()))
+        os.makedirs(self.journal_dir, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+        self.retries = max(1, int(retries))
+        self.retry_sleep = retry_sleep
+
+        # Slots for staged snapshots, taken before snapshot is made
+        # and given back after its upload is done:
+        self._slots = threading.BoundedSemaphore(max(1, int(queue_size)))
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        # Experiment key -> number of periodic checkpoints waiting in queue:
+        self._waiting = dict()
+
+        self._thread = threading.Thread(target=self._upload_loop,
+                                        name='CheckpointUploader',
+                                        daemon=True)
+        self._thread.start()
+        self._recover()
+
+    def submit(self, experiment, config, final: bool = False):
+        """
+        Snapshot mutable artifacts of experiment and queue their upload.
+        For final checkpoint, experiment is marked as finished
+        after the upload. Periodic checkpoint is skipped if previous one
+        of the same experiment is still waiting in the queue.
+        Blocks while the queue is full.
+        """
+        if not final:
+            with self._lock:
+                if self._waiting.get(experiment.key, 0) > 0:
+                    self.logger.debug(
+                        'Checkpoint of %s is still pending, skipping',
+                        experiment.key)
+                    return None
+
+        self._slots.acquire()
+        job_id = '{0:020d}-{1}'.format(int(time.time() * 1e6),
+                                       uuid.uuid4().hex)
+        job = {
+            'id': job_id,
+            'experiment': experiment.key,
+            'config': config,
+            'final': final,
+            'owner': os.getpid(),
+            'time': time.time(),
+            'artifacts': dict()
+        }
+        try:
+            tic = time.time()
+            for tag, art in experiment.artifacts.items():
+                if not art.is_mutable or art.local_path is None or \
+                        not os.path.exists(art.local_path):
+                    continue
+                staged_path = os.path.join(self.staging_dir, job_id, tag)
+                # Nobody writes to artifacts after experiment is done,
+                # so final snapshot can share files with them,
+                # periodic one shares unchanged files with the previous:
+                base_path = None if final else \
+                    os.path.join(self._get_base_path(experiment.key), tag)
+                snapshot_artifact(art.local_path, staged_path,
+                                  hardlink=final, base_path=base_path)
+                job['artifacts'][tag] = staged_path
+            self._write_journal(job)
+        except BaseException:
+            self._remove_job_files(job_id)
+            self._slots.release()
+            raise
+        self.logger.debug('Staged checkpoint %s of %s in %f s',
+                          job_id, experiment.key, time.time() - tic)
+        self._enqueue(job, has_slot=True)
+        return job_id
+
+    def wait(self):
+        """Block until all queued uploads are done."""
+        self._jobs.join()
+
+    def _enqueue(self, job, has_slot: bool):
+        if not job['final']:
+            with self._lock:
+                self._waiting[job['experiment']] = \
+                    self._waiting.get(job['experiment'], 0) + 1
+        self._jobs.put((job, has_slot))
+
+    def _recover(self):
+        # Several workers may share the same studio home,
+        # each of them takes over only uploads of workers which are gone:
+        with filelock.FileLock(os.path.join(self.root, LOCK_FILE_NAME)):
+            self._remove_stale_bases()
+            job_files = sorted(name for name in os.listdir(self.journal_dir)
+                               if name.endswith('.json'))
+            for name in job_files:
+                path = os.path.join(self.journal_dir, name)
+                try:
+                    with open(path, 'r') as f_in:
+                        job = json.load(f_in)
+                except ValueError:
+                    self.logger.info('Dropping corrupted journal entry %s',
+                                     path)
+                    os.remove(path)
+                    continue
+                owner = job.get('owner', None)
+                if owner is not None and owner != os.getpid() and \
+                        psutil.pid_exists(owner):
+                    continue
+                self.logger.info('Resuming checkpoint upload %s of %s',
+                                 job['id'], job['experiment'])
+                job['owner'] = os.getpid()
+                job['config'] = _restore_credentials(job['config'],
+                                                     self.config)
+                self._write_journal(job)
+                # Left over uploads may exceed the queue bound,
+                # but they are never dropped:
+                self._enqueue(job,
+                              has_slot=self._slots.acquire(blocking=False))
+
+    def _upload_loop(self):
+        while True:
+            job, has_slot = self._jobs.get()
+            try:
+                if not job['final']:
+                    with self._lock:
+                        self._waiting[job['experiment']] -= 1
+                retry(lambda: self._upload(job),
+                      no_retries=self.retries,
+                      sleep_time=self.retry_sleep,
+                      logger=self.logger)
+                self._finish_job(job)
+            except BaseException as exc:
+                check_for_kb_interrupt()
+                if job['final']:
+                    # Experiment is only marked as finished by this upload,
+                    # so its journal entry is kept for recovery:
+                    self.logger.error(
+                        'FAILED to upload final checkpoint %s of %s: %s, '
+                        'it will be resumed when uploader is restarted',
+                        job['id'], job['experiment'], exc)
+                else:
+                    self.logger.error(
+                        'FAILED to upload checkpoint %s of %s: %s',
+                        job['id'], job['experiment'], exc)
+                    self._remove_job_files(job['id'])
+            finally:
+                if has_slot:
+                    self._slots.release()
+                self._jobs.task_done()
+
+    def _finish_job(self, job):
+        base_path = self._get_base_path(job['experiment'])
+        shutil.rmtree(base_path, ignore_errors=True)
+        staged_path = os.path.join(self.staging_dir, job['id'])
+        if job['final'] or not os.path.isdir(staged_path):
+            self._remove_job_files(job['id'])
+            try:
+                os.rmdir(self.base_dir)
+            except OSError:
+                # Bases of other experiments are still there:
+                pass
+            return
+        # Uploaded snapshot becomes the base of the next one:
+        os.remove(self._get_journal_path(job['id']))
+        os.makedirs(self.base_dir, exist_ok=True)
+        os.replace(staged_path, base_path)
+
+    def _get_base_path(self, experiment_key: str) -> str:
+        return os.path.join(self.base_dir, experiment_key)
+
+    def _remove_stale_bases(self):
+        for name in os.listdir(self.staging_dir):
+            if not name.startswith(BASE_DIR_PREFIX):
+                continue
+            try:
+                pid = int(name[len(BASE_DIR_PREFIX):])
+            except ValueError:
+                continue
+            if pid != os.getpid() and not psutil.pid_exists(pid):
+                shutil.rmtree(os.path.join(self.staging_dir, name),
+                              ignore_errors=True)
+
+    def _upload(self, job):
+        tic = time.time()
+        with model.get_db_provider(job['config']) as db:
+            experiment = db.get_experiment(job['experiment'], getinfo=False)
+            if experiment is None:
+                raise ValueError('Experiment {0} is not found'
+                                 .format(job['experiment']))
+            # Upload snapshots, never live artifact content:
+            to_upload = []
+            for tag, art in experiment.artifacts.items():
+                if art.is_mutable:
+                    staged_path = job['artifacts'].get(tag, None)
+                    if staged_path is not None:
+                        to_upload.append((art, staged_path))
+                    art.local_path = None
+            prefetch_metadata([art for art, _ in to_upload], for_upload=True)
+            with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+                list(executor.map(lambda item: item[0].upload(item[1]),
+                                  to_upload))
+            # Nothing left to upload, only checkpoint time is updated:
+            db.checkpoint_experiment(experiment)
+            if job['final']:
+                db.finish_experiment(experiment)
+        self.logger.debug('Uploaded checkpoint %s of %s in %f s',
+                          job['id'], job['experiment'], time.time() - tic)
+
+    def _get_journal_path(self, job_id: str) -> str:
+        return os.path.join(self.journal_dir, job_id + '.json')
+
+    def _write_journal(self, job):
+        path = self._get_journal_path(job['id'])
+        tmp_path = path + '.tmp'
+        job = dict(job, config=_get_journal_config(job['config']))
+        # Journal is readable only by its owner, like studio config:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f_out:
+            json.dump(job, f_out)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.replace(tmp_path, path)
+
+    def _remove_job_files(self, job_id: str):
+        path = self._get_journal_path(job_id)
+        if os.path.exists(path):
+            os.remove(path)
+        shutil.rmtree(os.path.join(self.staging_dir, job_id),
+                      ignore_errors=True)
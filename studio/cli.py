@@ -4,6 +4,7 @@ import time
 from terminaltables import AsciiTable
 
 from studio import model
+from studio.db_providers import db_provider_setup
 from studio.util import logs
 
 _my_logger = None
@@ -16,6 +17,9 @@ def print_help():
     print('\tlist [username] - display experiments')
     print('\tstop [experiment] - stop running experiment')
     print('\tkill [experiment] - stop and delete experiment')
+    print('\treindex - rebuild experiment indexes of the database')
+    print('\tmigrate [config] - copy database of another config file ' +
+          'into this one')
     print('')
 
 
@@ -25,6 +29,12 @@ def main():
     parser.add_argument(
         '--short', '-s', help='Brief output - names of experiments only',
         action='store_true')
+    parser.add_argument(
+        '--status', help='List only experiments with this status',
+        default=None)
+    parser.add_argument(
+        '--page-size', help='Number of experiments fetched at once',
+        type=int, default=50)
 
     cli_args, script_args = parser.parse_known_args(sys.argv)
 
@@ -44,6 +54,10 @@ def main():
         _stop(script_args[2:], cli_args)
     elif cmd == 'kill':
         _kill(script_args[2:], cli_args)
+    elif cmd == 'reindex':
+        _reindex(cli_args)
+    elif cmd == 'migrate':
+        _migrate(script_args[2:], cli_args)
 
     else:
         get_logger().critical('Unknown command ' + cmd)
@@ -54,25 +68,24 @@ def main():
 
 def _list(args, cli_args):
     with model.get_db_provider(cli_args.config) as db:
-        if len(args) == 0:
-            experiments = db.get_user_experiments()
-        elif args[0] == 'project':
-            assert len(args) == 2
-            experiments = db.get_project_experiments(args[1])
-        elif args[0] == 'users':
+        if len(args) > 0 and args[0] == 'users':
             assert len(args) == 1
             users = db.get_users()
             for u in users:
                 print(users[u].get('email'))
             return
+        if hasattr(db, 'iter_experiments'):
+            _list_indexed(db, args, cli_args)
+            return
+
+        if len(args) == 0:
+            experiments = db.get_user_experiments()
+        elif args[0] == 'project':
+            assert len(args) == 2
+            experiments = db.get_project_experiments(args[1])
         elif args[0] == 'user':
             assert len(args) == 2
-            users = db.get_users()
-            user_ids = [u for u in users if users[u].get('email') == args[1]]
-            assert len(user_ids) == 1, \
-                'The user with email ' + args[1] + \
-                'not found!'
-            experiments = db.get_user_experiments(user_ids[0])
+            experiments = db.get_user_experiments(_get_user_id(db, args[1]))
         elif args[0] == 'all':
             assert len(args) == 1
             users = db.get_users()
@@ -83,22 +96,73 @@ def _list(args, cli_args):
             get_logger().critical('Unknown command ' + args[0])
             return
 
-        if cli_args.short:
+        if cli_args.short and cli_args.status is None:
             for e in experiments:
                 print(e)
             return
 
         experiments = [db.get_experiment(e) for e in experiments]
 
+    experiments = [e for e in experiments
+                   if cli_args.status is None or e.status == cli_args.status]
     experiments.sort(key=lambda e: -e.time_added)
+    if cli_args.short:
+        for e in experiments:
+            print(e.key)
+        return
+    _print_experiments([e.__dict__ for e in experiments])
+
+
+def _list_indexed(db, args, cli_args):
+    # Experiments are listed from secondary indexes page by page,
+    # newest first, without fetching experiment records:
+    if not db.has_indexes():
+        get_logger().info('Experiments are not indexed yet, indexing them')
+        count = db.rebuild_indexes()
+        get_logger().info('Indexed %d experiments', count)
+    filters = {'status': cli_args.status}
+    if len(args) == 0:
+        filters['owner'] = db._get_userid()
+    elif args[0] == 'project':
+        assert len(args) == 2
+        filters['project'] = args[1]
+    elif args[0] == 'user':
+        assert len(args) == 2
+        filters['owner'] = _get_user_id(db, args[1])
+    elif args[0] == 'all':
+        assert len(args) == 1
+    else:
+        get_logger().critical('Unknown command ' + args[0])
+        return
+
+    for summaries in db.iter_experiments(page_size=cli_args.page_size,
+                                         **filters):
+        if cli_args.short:
+            for summary in summaries:
+                print(summary['key'])
+        else:
+            _print_experiments(summaries)
+
+
+def _get_user_id(db, email):
+    users = db.get_users()
+    user_ids = [u for u in users if users[u].get('email') == email]
+    assert len(user_ids) == 1, \
+        'The user with email ' + email + \
+        'not found!'
+    return user_ids[0]
+
+
+def _print_experiments(experiments):
     table = [['Time added', 'Key', 'Project', 'Status']]
 
     for e in experiments:
         table.append([
-            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e.time_added)),
-            e.key,
-            e.project,
-            e.status])
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(e['time_added'])),
+            e['key'],
+            e['project'],
+            e['status']])
 
     print(AsciiTable(table).table)
 
@@ -117,6 +181,21 @@ def _kill(args, cli_args):
             db.delete_experiment(e)
 
 
+def _reindex(cli_args):
+    with model.get_db_provider(cli_args.config) as db:
+        count = db.rebuild_indexes()
+        get_logger().info('Indexed %d experiments', count)
+
+
+def _migrate(args, cli_args):
+    assert len(args) == 1, 'Config file of the source database is expected'
+    source = db_provider_setup.create_key_value_provider(
+        model.get_config(args[0])['database'])
+    with model.get_db_provider(cli_args.config) as db:
+        count = db.import_records(source)
+        get_logger().info('Copied %d records from %s', count, args[0])
+
+
 def get_logger():
     global _my_logger
     if not _my_logger:
@@ -27,6 +27,10 @@ DEFAULT_RESOURCES_NEEDED = {
 RESUMABLE = False
 CLEAN_QUEUE = True
 QUEUE_UPSCALING = False
+# All submitted experiments are checked for results again after this many
+# waits for changes, in case a check after the last change missed it
+# (failed, or read stale artifact):
+RESCAN_WAITS = 5
 
 
 class CompletionService:
@@ -107,6 +111,12 @@ class CompletionService:
         self.queue_name = self.queue.get_name()
 
         self.submitted = {}
+        # Experiments to check for results: all of them at first,
+        # then only those whose state changed since the last check,
+        # if database keeps log of changes.
+        self.changed = set()
+        self.change_cursor = None
+        self.waits = 0
         self.use_spot = cloud_name in ['ec2spot', 'gcspot']
 
         self.logger.info("Project name: {0}".format(self.project_name))
@@ -239,52 +249,63 @@ class CompletionService:
 
         while True:
             with model.get_db_provider(self.config) as db:
-
-                for key, submitted_time in six.iteritems(self.submitted):
-                    try:
-                        e = db.get_experiment(key)
-                        if e is not None:
-                            retval_path = db.get_artifact(
-                                e.artifacts['retval'])
-                            if os.path.exists(retval_path) and \
-                               os.path.getmtime(retval_path) > submitted_time:
-                                with open(retval_path, 'rb') as f:
-                                    data = pickle.load(f)
-
-                                del self.submitted[e.key]
-                                return (e.key, data)
-                    except BaseException as e:
-                        self.logger.debug(
-                            "Getting result failed due to exception:")
-                        self.logger.debug(e)
-
-                    '''
-                    if e is not None and e.status == 'finished':
-                        self.logger.debug(
-                            'Experiment {} finished, getting results' .format(
-                                e.key))
-                        with open(db.get_artifact(e.artifacts['retval']),
-                                  'rb') as f:
-                            data = pickle.load(f)
-
-                        if not self.resumable:
-                            self.submitted.remove(e.key)
-                        else:
-                            db.delete_experiment(e.key)
-
-                        return (e.key, data)
-                    '''
-
-            if timeout == 0 or \
-               (timeout > 0 and total_sleep_time > timeout):
-                return None
-
-            if self.p is not None:
-                assert self.p.poll() is None, \
-                    "Executor process died, no point in waiting for results"
-
-            time.sleep(sleep_time)
-            total_sleep_time += sleep_time
+                watching = hasattr(db, 'has_change_log') and \
+                    db.has_change_log()
+                if not watching or self.change_cursor is None or \
+                        self.waits >= RESCAN_WAITS:
+                    if watching and self.change_cursor is None:
+                        self.change_cursor = db.get_change_cursor()
+                    self.changed = set(self.submitted.keys())
+                    self.waits = 0
+
+                for key in list(self.changed):
+                    self.changed.discard(key)
+                    if key not in self.submitted:
+                        continue
+                    result = self._get_result(db, key)
+                    if result is not None:
+                        return result
+
+                if timeout == 0 or \
+                   (timeout > 0 and total_sleep_time > timeout):
+                    return None
+
+                if self.p is not None:
+                    assert self.p.poll() is None, \
+                        "Executor process died, " + \
+                        "no point in waiting for results"
+
+                tic = time.time()
+                if watching:
+                    # Wake up as soon as any experiment changes:
+                    changed, self.change_cursor = db.wait_for_experiments(
+                        self.submitted.keys(), self.change_cursor,
+                        sleep_time)
+                    self.changed.update(changed)
+                    self.waits += 1
+                else:
+                    time.sleep(sleep_time)
+                total_sleep_time += time.time() - tic
+
+    def _get_result(self, db, key):
+        submitted_time = self.submitted[key]
+        try:
+            e = db.get_experiment(key, getinfo=False)
+            if e is not None:
+                retval_path = db.get_artifact(
+                    e.artifacts['retval'])
+                if os.path.exists(retval_path) and \
+                   os.path.getmtime(retval_path) > submitted_time:
+                    with open(retval_path, 'rb') as f:
+                        data = pickle.load(f)
+
+                    del self.submitted[e.key]
+                    return (e.key, data)
+        except BaseException as e:
+            self.logger.debug(
+                "Getting result failed due to exception:")
+            self.logger.debug(e)
+        return None
 
     def getResults(self, blocking=True):
         return self.getResultsWithTimeout(-1 if blocking else 0)
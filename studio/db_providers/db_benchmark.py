@@ -0,0 +1,112 @@
+"""
+    Benchmark of bulk experiment submission to file-based databases.
+    Usage: python -m studio.db_providers.db_benchmark [--records N]
+    For each database type, serializer and fsync mode, writes N
+    experiment records (with their states, user and secondary index entries)
+    in sweep-sized batches, as add_experiments does, and reports
+    records per second.
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+from terminaltables import AsciiTable
+
+from studio.db_providers import record_serializer
+from studio.db_providers.keyvalue_provider import STATE_FIELDS
+from studio.db_providers.local_db_provider import LocalDbProvider, \
+    FSYNC_NEVER, FSYNC_BATCH, FSYNC_ALWAYS
+from studio.db_providers.sqlite_provider import SQLiteProvider
+from studio.storage.storage_handler_factory import StorageHandlerFactory
+
+
+def _make_experiment(key: str, time_added: float):
+    artifacts = dict()
+    for tag in ['workspace', 'modeldir', 'output', 'tb', '_metrics']:
+        artifacts[tag] = {
+            'key': 'experiments/{0}/{1}.tar'.format(key, tag),
+            'mutable': tag != 'workspace',
+            'local': '/tmp/studioml/experiments/{0}/{1}'.format(key, tag),
+            'qualified': 's3://bucket/experiments/{0}/{1}.tar'
+                         .format(key, tag)}
+    return {
+        'key': key, 'filename': 'train.py', 'args': ['--lr', '0.01'],
+        'pythonenv': ['numpy==1.19.5', 'keras==2.4.3'] * 20,
+        'project': 'benchmark', 'owner': 'guest', 'status': 'waiting',
+        'time_added': time_added, 'time_started': None,
+        'time_last_checkpoint': time_added, 'time_finished': None,
+        'artifacts': artifacts, 'resources_needed': {'cpus': 2, 'ram': '3g'},
+        'metric': None, 'max_duration': None, 'info': {}}
+
+
+def _measure(db, records: int, batch_size: int):
+    keys = [str(uuid.uuid4()) for _ in range(records)]
+    tic = time.time()
+    for start in range(0, records, batch_size):
+        items = dict()
+        for key in keys[start:start + batch_size]:
+            experiment = _make_experiment(key, time.time())
+            items[db._get_experiments_keybase() + key] = experiment
+            items[db._get_user_keybase() + 'experiments/' + key] = \
+                experiment['time_added']
+            items[db._get_states_keybase() + key] = \
+                {field: experiment[field] for field in STATE_FIELDS}
+            items.update(db._get_index_entries(experiment))
+        db._set_many(items)
+    if hasattr(db, 'flush'):
+        db.flush()
+    return max(time.time() - tic, 1e-6)
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description='Benchmark bulk experiment submission.')
+    parser.add_argument('--records', type=int, default=2000,
+                        help='number of experiments (default: 2000)')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='experiments per submission (default: 100)')
+    parser.add_argument('--serializers', default=None,
+                        help='comma-separated list of serializers ' +
+                        '(default: all available)')
+    parser.add_argument('--fsync', default=','.join(
+        [FSYNC_NEVER, FSYNC_BATCH, FSYNC_ALWAYS]),
+        help='comma-separated list of fsync modes (default: all)')
+    parser.add_argument('--dir', default=None,
+                        help='directory for databases (default: temporary)')
+    parsed_args = parser.parse_args(args)
+
+    serializers = parsed_args.serializers.split(',') \
+        if parsed_args.serializers \
+        else record_serializer.get_available_serializers()
+    fsync_modes = parsed_args.fsync.split(',')
+
+    table = [['Database', 'Serializer', 'Fsync', 'Records', 'Records/s']]
+    root = tempfile.mkdtemp(dir=parsed_args.dir)
+    try:
+        runs = [('local', serializer, fsync)
+                for serializer in serializers for fsync in fsync_modes]
+        runs.append(('sqlite', 'json', 'wal'))
+        for db_type, serializer, fsync in runs:
+            bucket = '{0}_{1}_{2}'.format(db_type, serializer, fsync)
+            config = {'endpoint': root, 'bucket': bucket,
+                      'serializer': serializer, 'fsync': fsync,
+                      'cache': False}
+            db = LocalDbProvider(config) if db_type == 'local' \
+                else SQLiteProvider(config)
+            elapsed = _measure(db, parsed_args.records,
+                               parsed_args.batch_size)
+            table.append([db_type, serializer, fsync, parsed_args.records,
+                          '{0:.0f}'.format(parsed_args.records / elapsed)])
+    finally:
+        StorageHandlerFactory.get_factory().cleanup()
+        shutil.rmtree(root)
+
+    print(AsciiTable(table).table)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,13 +3,19 @@ import os
 import yaml
 import pyhocon
 
+from studio.artifacts.blob_cache import setup_blob_cache
+from studio.artifacts.blob_peers import setup_blob_peers
 from studio.db_providers.local_db_provider import LocalDbProvider
 from studio.db_providers.s3_provider import S3Provider
+from studio.db_providers.sqlite_provider import SQLiteProvider
 from studio.storage.storage_handler import StorageHandler
 from studio.storage.storage_handler_factory import StorageHandlerFactory
+from studio.storage.http_storage_handler import setup_http_config
 from studio.storage.storage_setup import setup_storage, get_storage_db_provider,\
     set_storage_verbose_level
 from studio.storage.storage_type import StorageType
+from studio.storage.s3_storage_handler import S3StorageHandler
+from studio.storage.local_storage_handler import LocalStorageHandler
 from studio.util import logs
 from studio.util.util import parse_verbosity
 
@@ -59,11 +65,21 @@ def get_artifact_store(config) -> StorageHandler:
     factory: StorageHandlerFactory = StorageHandlerFactory.get_factory()
     if storage_type == 's3':
         handler = factory.get_handler(StorageType.storageS3, config)
-        return handler
-    if storage_type == 'local':
+        handler_id = S3StorageHandler.get_id(config)
+    elif storage_type == 'local':
         handler = factory.get_handler(StorageType.storageLocal, config)
-        return handler
-    raise ValueError('Unknown storage type: ' + storage_type)
+        handler_id = LocalStorageHandler.get_id(config)
+    else:
+        raise ValueError('Unknown storage type: ' + storage_type)
+
+    if _is_true(config.get('chunked', False)):
+        handler = factory.get_chunked_handler(handler, handler_id, config)
+    return handler
+
+def _is_true(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
 
 def get_db_provider(config=None, blocking_auth=True):
 
@@ -83,30 +99,36 @@ def get_db_provider(config=None, blocking_auth=True):
     logger.debug('Choosing db provider with config:')
     logger.debug(config)
 
+    setup_blob_cache(config.get('blob_cache', None))
+    setup_http_config(config.get('http', None))
+    setup_blob_peers(config.get('blob_peers', None))
+
     if 'storage' in config.keys():
         artifact_store = get_artifact_store(config['storage'])
     else:
         artifact_store = None
 
     assert 'database' in config.keys()
-    db_config = config['database']
-    if db_config['type'].lower() == 's3':
-        db_provider = S3Provider(db_config,
-                          blocking_auth=blocking_auth)
-        if artifact_store is None:
-            artifact_store = db_provider.get_storage_handler()
-
-    elif db_config['type'].lower() == 'gs':
-        raise NotImplementedError("GS is not supported.")
-
-    elif db_config['type'].lower() == 'local':
-        db_provider = LocalDbProvider(db_config,
-                          blocking_auth=blocking_auth)
-        if artifact_store is None:
-            artifact_store = db_provider.get_storage_handler()
-
-    else:
-        raise ValueError('Unknown type of the database ' + db_config['type'])
+    db_provider = create_key_value_provider(config['database'],
+                                            blocking_auth=blocking_auth)
+    if artifact_store is None:
+        artifact_store = db_provider.get_storage_handler()
 
     setup_storage(db_provider, artifact_store)
     return db_provider
+
+def create_key_value_provider(db_config, blocking_auth=True):
+    """
+    New key/value database provider for "database" config section,
+    not registered as the storage provider of this process.
+    """
+    db_type: str = db_config['type'].lower()
+    if db_type == 's3':
+        return S3Provider(db_config, blocking_auth=blocking_auth)
+    if db_type == 'gs':
+        raise NotImplementedError("GS is not supported.")
+    if db_type == 'local':
+        return LocalDbProvider(db_config, blocking_auth=blocking_auth)
+    if db_type == 'sqlite':
+        return SQLiteProvider(db_config, blocking_auth=blocking_auth)
+    raise ValueError('Unknown type of the database ' + db_config['type'])
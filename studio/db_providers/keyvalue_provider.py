@@ -1,14 +1,46 @@
+import random
 import time
+from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict
 
 from studio.util import util, logs
 from studio.storage.storage_handler import StorageHandler
-from studio.artifacts.artifact import Artifact
+from studio.artifacts.artifact import Artifact, prefetch_metadata
+from studio.db_providers.record_cache import RecordCache, \
+    DEFAULT_RECORD_TTL, DEFAULT_MAX_RECORDS
 from studio.experiments.experiment import Experiment, experiment_from_dict
 from studio.storage.storage_setup import get_storage_verbose_level
 from studio.util.util import retry, report_fatal,\
     compression_to_extension, check_for_kb_interrupt
 
+# How much of experiment output is read to show its log tail:
+LOGTAIL_SIZE = 64 * 1024
+
+# Experiment fields with secondary indexes, in order of preference
+# when a query filters on several of them:
+INDEXED_FIELDS = ['project', 'owner', 'status']
+# Fields of experiment summary kept in index entries:
+SUMMARY_FIELDS = ['key', 'status', 'project', 'owner', 'time_added']
+DEFAULT_PAGE_SIZE = 100
+# Index entries are named by inverted time they were added,
+# so listing them in name order gives newest experiments first:
+INDEX_TIME_BASE = 10 ** 10
+# Experiment is kept as two records: its spec (command, environment,
+# artifacts...), written once when experiment is added, and small
+# state with these mutable fields, updated with conditional writes
+# on every status change or checkpoint:
+STATE_FIELDS = ['status', 'time_started', 'time_last_checkpoint',
+                'time_finished']
+# How many times conflicting state update is retried:
+STATE_UPDATE_RETRIES = 20
+# How often watch() looks for new changes, seconds:
+DEFAULT_WATCH_INTERVAL = 1.0
+
+# Change of a key, as reported by watch(); cursor is
+# an opaque string to resume watching after this change:
+ChangeEvent = namedtuple('ChangeEvent', ['key', 'time', 'cursor'])
+
 
 class KeyValueProvider:
     """Data provider for managing experiment lifecycle."""
@@ -30,6 +62,19 @@ class KeyValueProvider:
         self.storage_handler = handler
 
         self.max_keys = db_config.get('max_keys', 100)
+        self.watch_interval = float(db_config.get('watch_interval',
+                                                  DEFAULT_WATCH_INTERVAL))
+
+        # Cache of records read from and written to the database,
+        # set "cache: false" in database config to disable it:
+        max_records = int(db_config.get('cache_max_records',
+                                        DEFAULT_MAX_RECORDS))
+        if str(db_config.get('cache', True)).lower() == 'false':
+            max_records = 0
+        self.record_cache = RecordCache(
+            ttl=float(db_config.get('cache_ttl', DEFAULT_RECORD_TTL)),
+            max_records=max_records,
+            prefix_ttl=db_config.get('cache_prefix_ttl', None))
 
     def _report_fatal(self, msg: str):
         report_fatal(msg, self.logger)
@@ -56,6 +101,18 @@ class KeyValueProvider:
     def _get_projects_keybase(self):
         return "projects/"
 
+    def _get_blob_peers_keybase(self):
+        return "peers/blob_servers/"
+
+    def _get_indexes_keybase(self):
+        return "indexes/"
+
+    def _get_states_keybase(self):
+        return "states/"
+
+    def _get_changes_keybase(self):
+        return "changes/"
+
     def _experiment_key(self, experiment):
         if not isinstance(experiment, str):
             key = experiment.key
@@ -65,77 +122,150 @@ class KeyValueProvider:
 
     def add_experiment(self, experiment: Experiment,
                        userid=None, compression=None):
-        self._delete(self._get_experiments_keybase() + experiment.key)
-        experiment.time_added = time.time()
-        experiment.status = 'waiting'
-
+        self.add_experiments([experiment], userid=userid,
+                             compression=compression)
+
+    def add_experiments(self, experiments,
+                        userid=None, compression=None):
+        """
+        Add a batch of experiments (like a hyperparameter sweep):
+        artifacts of all experiments are uploaded together,
+        and all experiment records and indexes are written
+        with one batched call.
+        """
         compression = compression if compression else self.compression
+        userid = userid if userid else self._get_userid()
 
-        for tag, item in experiment.artifacts.items():
-            art: Artifact = item
-            if art.is_mutable:
-                art.key = self._get_mutable_artifact_key(experiment, tag)
-            else:
-                if art.local_path is not None:
-                    # upload immutable artifacts
-                    art.key = art.upload(art.local_path)
-                elif art.hash is not None:
+        for experiment in experiments:
+            experiment.time_added = time.time()
+            experiment.status = 'waiting'
+            experiment.owner = userid
+
+        self._upload_immutable_artifacts(
+            [art for experiment in experiments
+             for art in experiment.artifacts.values()
+             if not art.is_mutable and art.local_path is not None])
+
+        for experiment in experiments:
+            for tag, item in experiment.artifacts.items():
+                art: Artifact = item
+                if art.is_mutable:
+                    art.key = self._get_mutable_artifact_key(
+                        experiment, tag, compression=art.get_compression())
+                elif art.local_path is None and art.hash is not None:
                     art.key = self._get_immutable_artifact_key(
                         art.hash,
                         compression=compression
                     )
 
-            if art.key is not None and art.remote_path is None:
-                art.remote_path = art.storage_handler.get_qualified_location(art.key)
+                if art.key is not None and art.remote_path is None:
+                    art.remote_path = art.storage_handler.get_qualified_location(art.key)
 
-        userid = userid if userid else self._get_userid()
-        experiment.owner = userid
-
-        experiment_dict = experiment.to_dict()
+        # Initial checkpoint of mutable artifacts goes together
+        # with experiment records, instead of re-writing them after:
+        mutable = [art for experiment in experiments
+                   for art in experiment.artifacts.values()
+                   if art.is_mutable and art.local_path is not None]
+        retry(lambda: self._upload_mutable_artifacts(mutable),
+              sleep_time=10,
+              logger=self.logger)
 
-        self._set(self._get_experiments_keybase() + experiment.key,
-                  experiment_dict)
+        states = dict()
+        records = dict()
+        checkpoint_time = time.time()
+        for experiment in experiments:
+            experiment.time_last_checkpoint = checkpoint_time
+            experiment_dict = experiment.to_dict()
+            states[self._get_states_keybase() + experiment.key] = \
+                {field: experiment_dict.pop(field) for field in STATE_FIELDS}
+            records[self._get_experiments_keybase() + experiment.key] = \
+                experiment_dict
+
+            if not experiment.from_compl_service:
+                records[self._get_user_keybase(userid) + "experiments/" +
+                        experiment.key] = experiment.time_added
+
+                if experiment.project and userid:
+                    records[self._get_projects_keybase() +
+                            experiment.project + "/" +
+                            experiment.key + "/owner"] = userid
+
+            records.update(self._get_index_entries(experiment.to_dict()))
+
+        # States go first: experiment whose spec is found
+        # always has its state too.
+        self._set_many(states)
+        self._set_many(records)
+        for experiment in experiments:
+            self.logger.info("Added experiment %s", experiment.key)
+
+    def _upload_immutable_artifacts(self, artifacts):
+        prefetch_metadata(artifacts, for_upload=True)
+        # Experiments of a sweep share their workspace and other inputs,
+        # each distinct one is uploaded once:
+        groups = dict()
+        for art in artifacts:
+            group_key = (id(art.storage_handler), art.local_path,
+                         art.get_compression(), art.key)
+            groups.setdefault(group_key, []).append(art)
+        groups = list(groups.values())
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            keys = list(executor.map(
+                lambda group: group[0].upload(group[0].local_path), groups))
+        for group, key in zip(groups, keys):
+            for art in group:
+                art.key = key
 
-        if not experiment.from_compl_service:
-            self._set(self._get_user_keybase(userid) + "experiments/" +
-                  experiment.key,
-                  experiment.time_added)
+    def _upload_mutable_artifacts(self, artifacts):
+        prefetch_metadata(artifacts, for_upload=True)
 
-            if experiment.project and userid:
-                self._set(self._get_projects_keybase() +
-                      experiment.project + "/" +
-                      experiment.key + "/owner",
-                      userid)
+        workers = []
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for art in artifacts:
+                workers.append(executor.submit(art.upload, None))
+            wait(workers)
 
-        retry(lambda: self.checkpoint_experiment(experiment),
-              sleep_time=10,
-              logger=self.logger)
-        self.logger.info("Added experiment %s", experiment.key)
+        for worker in workers:
+            try:
+                worker.result()
+            except Exception as exc:
+                # If any of artifact savers failed and threw an exception,
+                # rethrow it to signal overall checkpoint failure
+                raise exc
 
     def _get_immutable_artifact_key(self, arthash, compression=None):
         retval = "blobstore/" + arthash + ".tar" + \
                  compression_to_extension(compression)
         return retval
 
-    def _get_mutable_artifact_key(self, experiment: Experiment, tag: str) -> str:
+    def _get_mutable_artifact_key(self, experiment: Experiment, tag: str,
+                                  compression=None) -> str:
         return self._get_experiments_keybase() + \
-            experiment.key + '/' + tag + '.tar'
+            experiment.key + '/' + tag + '.tar' + \
+            compression_to_extension(compression)
 
     def start_experiment(self, experiment):
         time_started = time.time()
         experiment.time_started = time_started
-        experiment.status = 'running'
-
-        experiment_dict = self._get(self._get_experiments_keybase() +
-                                    experiment.key)
-        experiment_dict['time_started'] = time_started
-        experiment_dict['status'] = 'running'
-
-        self._set(self._get_experiments_keybase() +
-                  experiment.key,
-                  experiment_dict)
+        self._upload_mutable_artifacts(
+            [art for art in experiment.artifacts.values()
+             if art.is_mutable and art.local_path is not None])
+
+        def update(state):
+            # Experiment stopped while it was waiting stays stopped,
+            # worker finds that out on its first status check:
+            if state.get('status', None) == 'stopped':
+                return None
+            state['status'] = 'running'
+            state['time_started'] = time_started
+            state['time_last_checkpoint'] = time.time()
+            return state
 
-        self.checkpoint_experiment(experiment)
+        state = self._update_experiment_state(experiment.key, update)
+        if state is not None:
+            experiment.status = state.get('status', None)
+            experiment.time_last_checkpoint = \
+                state.get('time_last_checkpoint', None)
 
     def stop_experiment(self, key):
         # can be called remotely (the assumption is
@@ -143,13 +273,11 @@ class KeyValueProvider:
         # and if it is 'stopped', kills the experiment)
         key = self._experiment_key(key)
 
-        experiment_data = self._get(self._get_experiments_keybase() +
-                                    key)
-
-        experiment_data['status'] = 'stopped'
+        def update(state):
+            state['status'] = 'stopped'
+            return state
 
-        self._set(self._get_experiments_keybase() +
-                  key, experiment_data)
+        self._update_experiment_state(key, update)
 
     def finish_experiment(self, experiment):
         time_finished = time.time()
@@ -158,14 +286,12 @@ class KeyValueProvider:
             experiment.status = 'finished'
             experiment.time_finished = time_finished
 
-        experiment_dict = self._get(
-            self._get_experiments_keybase() + key)
-
-        experiment_dict['status'] = 'finished'
-        experiment_dict['time_finished'] = time_finished
+        def update(state):
+            state['status'] = 'finished'
+            state['time_finished'] = time_finished
+            return state
 
-        self._set(self._get_experiments_keybase() +
-                  key, experiment_dict)
+        self._update_experiment_state(key, update)
 
     def delete_experiment(self, experiment):
         if experiment is None:
@@ -180,8 +306,7 @@ class KeyValueProvider:
         else:
             experiment_key = experiment.key
 
-        experiment_dict = self._get(self._get_experiments_keybase() +
-                                    experiment_key)
+        experiment_dict = self._get_experiment_dict(experiment_key)
         if experiment_dict is None:
             self.logger.error("FAILED to delete experiment %s: NOT FOUND.",
                               experiment_key)
@@ -189,9 +314,10 @@ class KeyValueProvider:
 
         from_compl_service: bool = experiment_dict.get('from_compl_service', False)
         experiment_owner = experiment_dict.get('owner')
+        to_delete = []
         if experiment_owner is not None and not from_compl_service:
-            self._delete(self._get_user_keybase(experiment_owner) +
-                     'experiments/' + experiment_key, shallow=False)
+            to_delete.append(self._get_user_keybase(experiment_owner) +
+                             'experiments/' + experiment_key)
 
         if experiment is not None:
             for tag, art in experiment.artifacts.items():
@@ -203,12 +329,14 @@ class KeyValueProvider:
                     art.delete()
 
             if experiment.project is not None and not from_compl_service:
-                self._delete(
+                to_delete.append(
                     self._get_projects_keybase() +
-                    experiment.project + "/" + experiment_key + "/" + "owner",
-                    shallow=False)
+                    experiment.project + "/" + experiment_key + "/" + "owner")
 
-        self._delete(self._get_experiments_keybase() + experiment_key, shallow=False)
+        to_delete.extend(self._get_index_entries(experiment_dict).keys())
+        to_delete.append(self._get_states_keybase() + experiment_key)
+        to_delete.append(self._get_experiments_keybase() + experiment_key)
+        self._delete_many(to_delete, shallow=False)
 
 
     def cleanup(self):
@@ -218,32 +346,322 @@ class KeyValueProvider:
 
     def checkpoint_experiment(self, experiment):
         key = self._experiment_key(experiment)
-        key_path = self._get_experiments_keybase() + key
-
-        self.logger.debug('checkpointing %s', key_path)
 
-        experiment_dict = self._get(key_path)
+        self.logger.debug('checkpointing %s', key)
 
-        workers = []
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            for _, art in experiment.artifacts.items():
-                if art.is_mutable and art.local_path is not None:
-                    workers.append(executor.submit(art.upload, None))
-            wait(workers)
-
-        for worker in workers:
-            try:
-                worker.result()
-            except Exception as exc:
-                # If any of artifact savers failed and threw an exception,
-                # rethrow it to signal overall checkpoint failure
-                raise exc
+        self._upload_mutable_artifacts(
+            [art for art in experiment.artifacts.values()
+             if art.is_mutable and art.local_path is not None])
 
+        # Only experiment state is updated, its spec is not rewritten:
         checkpoint_time = time.time()
         experiment.time_last_checkpoint = checkpoint_time
-        experiment_dict['time_last_checkpoint'] = checkpoint_time
 
-        self._set(key_path, experiment_dict)
+        def update(state):
+            state['time_last_checkpoint'] = checkpoint_time
+            return state
+
+        self._update_experiment_state(key, update)
+
+    def get_experiment_state(self, key):
+        """
+        Current state of experiment (status and timestamps),
+        read without its spec. Returns None if experiment is not found.
+        """
+        state = self._get(self._get_states_keybase() + key)
+        if isinstance(state, dict):
+            return state
+        return self._get_legacy_state(
+            self._get(self._get_experiments_keybase() + key))
+
+    def _get_legacy_state(self, experiment_dict):
+        # Experiments added before their states were kept separately
+        # have state fields in experiment record; experiment without
+        # either of them is being added or deleted.
+        if not isinstance(experiment_dict, dict) or \
+                'status' not in experiment_dict:
+            return None
+        return {field: experiment_dict.get(field, None)
+                for field in STATE_FIELDS}
+
+    def _get_experiment_dict(self, key):
+        """
+        Experiment spec merged with its current state, or None.
+        """
+        record_key = self._get_experiments_keybase() + key
+        state_key = self._get_states_keybase() + key
+        # Both records are read in one batch:
+        records = self._get_many([record_key, state_key])
+        experiment_dict = records.get(record_key, None)
+        if not isinstance(experiment_dict, dict):
+            return None
+        state = records.get(state_key, None)
+        if not isinstance(state, dict):
+            state = self._get_legacy_state(experiment_dict)
+            if state is None:
+                return None
+        experiment_dict.update(state)
+        return experiment_dict
+
+    def _update_experiment_state(self, key, update):
+        """
+        Read-modify-write of experiment state with conditional writes:
+        update(state) returns new state, or None to leave it as it is.
+        If somebody else changes the state in between, it is read
+        and updated again, so concurrent updates (like experiment
+        stopped while it is checkpointed) are never lost.
+        Index entries follow status changes.
+        Returns resulting state, or None if experiment is not found.
+        """
+        state_key = self._get_states_keybase() + key
+        for attempt in range(STATE_UPDATE_RETRIES):
+            state, version = self._get_versioned(state_key)
+            experiment_dict = None
+            if not isinstance(state, dict):
+                experiment_dict = self._get(
+                    self._get_experiments_keybase() + key)
+                state = self._get_legacy_state(experiment_dict)
+                if state is None:
+                    self.logger.error(
+                        "FAILED to update experiment %s: NOT FOUND.", key)
+                    return None
+                version = None
+            previous_status = state.get('status', None)
+            new_state = update(dict(state))
+            if new_state is None:
+                return state
+            if self._set_if(state_key, new_state, version):
+                if new_state.get('status', None) != previous_status:
+                    if experiment_dict is None:
+                        experiment_dict = self._get(
+                            self._get_experiments_keybase() + key) or {}
+                    self._move_index_entries(
+                        dict(experiment_dict, **new_state), previous_status)
+                return new_state
+            self.logger.debug(
+                'Conflicting update of experiment %s state, retrying', key)
+            time.sleep(random.uniform(0, 0.01 * (attempt + 1)))
+
+        msg: str = ("FAILED to update experiment {0} state: " +
+                    "{1} conflicting updates").format(
+                        key, STATE_UPDATE_RETRIES)
+        self._report_fatal(msg)
+        return None
+
+    def _move_index_entries(self, experiment_dict, previous_status):
+        """
+        Index entries for new status are written first,
+        and entries for previous status are removed after that,
+        so experiment is never missing from the indexes.
+        """
+        entries = self._get_index_entries(experiment_dict)
+        previous_entries = self._get_index_entries(
+            dict(experiment_dict, status=previous_status))
+        self._set_many(entries)
+        stale_entries = [entry for entry in previous_entries
+                         if entry not in entries]
+        if stale_entries:
+            self._delete_many(stale_entries)
+
+    def _get_index_entries(self, experiment_dict) -> Dict:
+        """
+        Index entries of experiment: entry key -> experiment summary.
+        """
+        summary = {field: experiment_dict.get(field, None)
+                   for field in SUMMARY_FIELDS}
+        if summary['key'] is None or summary['time_added'] is None:
+            return dict()
+        name = '{0:017.6f}_{1}'.format(
+            INDEX_TIME_BASE - summary['time_added'], summary['key'])
+        keybase = self._get_indexes_keybase()
+        entries = {keybase + 'all/' + name: summary}
+        from_compl_service = experiment_dict.get('from_compl_service', False)
+        for field in INDEXED_FIELDS:
+            if field != 'status' and from_compl_service:
+                # Just like in user and project indexes:
+                continue
+            if summary[field]:
+                entries['{0}{1}/{2}/{3}'.format(
+                    keybase, field, summary[field], name)] = summary
+        return entries
+
+    def query_experiments(self, status=None, project=None, owner=None,
+                          page_size=DEFAULT_PAGE_SIZE, page_token=None):
+        """
+        Page of summaries (key, status, project, owner, time_added)
+        of experiments matching all given filters, newest first.
+        Returns tuple (summaries, next_page_token);
+        next_page_token is None on the last page.
+        """
+        filters = {'status': status, 'project': project, 'owner': owner}
+        filters = {field: value for field, value in filters.items()
+                   if value is not None}
+        prefix = self._get_indexes_keybase() + 'all/'
+        for field in INDEXED_FIELDS:
+            if field in filters:
+                prefix = '{0}{1}/{2}/'.format(self._get_indexes_keybase(),
+                                              field, filters[field])
+                break
+
+        summaries = []
+        start_after = page_token
+        while True:
+            names = self._list_page(prefix, start_after, page_size)
+            entries = self._get_many([prefix + name for name in names])
+            self._refresh_summaries(
+                [summary for summary in entries.values() if summary])
+            for name in names:
+                start_after = name
+                summary = entries.get(prefix + name, None)
+                # Entry of other status may still be there
+                # while experiment is moved between indexes:
+                if summary is None or \
+                        any(summary.get(field, None) != value
+                            for field, value in filters.items()):
+                    continue
+                summaries.append(summary)
+                if len(summaries) >= page_size:
+                    return summaries, start_after
+            if len(names) < page_size:
+                return summaries, None
+
+    def _refresh_summaries(self, summaries):
+        # Index entries may lag behind status changes,
+        # current status is taken from experiment states:
+        states_keybase = self._get_states_keybase()
+        states = self._get_many([states_keybase + summary['key']
+                                 for summary in summaries])
+        for summary in summaries:
+            state = states.get(states_keybase + summary['key'], None)
+            if isinstance(state, dict):
+                summary['status'] = state.get('status', None)
+
+    def iter_experiments(self, status=None, project=None, owner=None,
+                         page_size=DEFAULT_PAGE_SIZE):
+        """Generator of all pages of query_experiments results."""
+        page_token = None
+        while True:
+            summaries, page_token = self.query_experiments(
+                status=status, project=project, owner=owner,
+                page_size=page_size, page_token=page_token)
+            if summaries:
+                yield summaries
+            if page_token is None:
+                return
+
+    def has_indexes(self) -> bool:
+        """
+        Whether experiments are indexed: false for databases
+        populated before the indexes were introduced,
+        which have experiments but no index entries.
+        """
+        if self._list_page(self._get_indexes_keybase() + 'all/', limit=1):
+            return True
+        return not self._list_page(self._get_experiments_keybase(), limit=1)
+
+    def rebuild_indexes(self):
+        """
+        Write index entries of all experiments in the database,
+        for databases populated before the indexes were introduced.
+        Returns number of indexed experiments.
+        """
+        keybase = self._get_experiments_keybase()
+        states_keybase = self._get_states_keybase()
+        names = self._get(keybase, shallow=True) or []
+        count = 0
+        for start in range(0, len(names), DEFAULT_PAGE_SIZE):
+            batch = names[start:start + DEFAULT_PAGE_SIZE]
+            records = self._get_many([keybase + name for name in batch] +
+                                     [states_keybase + name for name in batch])
+            entries = dict()
+            for name in batch:
+                record = records.get(keybase + name, None)
+                state = records.get(states_keybase + name, None)
+                if isinstance(record, dict) and isinstance(state, dict):
+                    record.update(state)
+                if isinstance(record, dict) and record.get('key', None):
+                    entries.update(self._get_index_entries(record))
+                    count += 1
+            self._set_many(entries)
+        return count
+
+    def has_change_log(self) -> bool:
+        """
+        Whether database keeps log of changes of experiment states,
+        which can be watched instead of polling experiments.
+        """
+        return False
+
+    def get_change_cursor(self) -> str:
+        """Cursor to watch changes made from now on."""
+        raise NotImplementedError("Not implemented: get_change_cursor")
+
+    def watch(self, prefix, since=None, timeout=None):
+        """
+        Generator of ChangeEvents for keys under prefix (which should be
+        under experiment states keybase, other keys are not logged),
+        changed after cursor since (or from now on, if since is None).
+        Waits for new changes until timeout seconds pass,
+        or forever if timeout is None.
+        A change is logged after it is made, so reading the key after
+        its event gives the new value (or a later one). Changes are
+        reported at least once, another watch may report them again.
+        Events read together may share the cursor after all of them,
+        which continues watching the same prefix.
+        """
+        if not prefix.startswith(self._get_states_keybase()):
+            raise ValueError('Changes of {0} are not logged'.format(prefix))
+        cursor = since if since is not None else self.get_change_cursor()
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            events, cursor = self._read_changes(cursor, prefix)
+            for event in events:
+                if event.key.startswith(prefix):
+                    yield event
+            if deadline is not None and time.time() >= deadline:
+                return
+            if not events:
+                time.sleep(self.watch_interval if deadline is None else
+                           max(0, min(self.watch_interval,
+                                      deadline - time.time())))
+
+    def wait_for_experiments(self, keys, since, timeout):
+        """
+        Wait up to timeout seconds for state changes of experiments
+        with given keys, made after cursor since.
+        Returns tuple (keys of changed experiments, cursor to continue
+        waiting from). For databases without change log, sleeps
+        for timeout seconds and reports all experiments as changed.
+        """
+        if not self.has_change_log():
+            time.sleep(timeout)
+            return set(keys), since
+        keybase = self._get_states_keybase()
+        keys = set(keys)
+        # Changes of a single experiment are read without the others:
+        prefix = keybase + next(iter(keys)) if len(keys) == 1 else keybase
+        deadline = time.time() + timeout
+        cursor = since
+        while True:
+            events, cursor = self._read_changes(cursor, prefix)
+            changed = set(event.key[len(keybase):] for event in events) & keys
+            remaining = deadline - time.time()
+            if changed or remaining <= 0:
+                return changed, cursor
+            if not events:
+                time.sleep(min(self.watch_interval, remaining))
+
+    def _is_logged(self, key) -> bool:
+        """Whether changes of key are written to change log."""
+        return key.startswith(self._get_states_keybase())
+
+    def _read_changes(self, cursor, prefix=None):
+        """
+        ChangeEvents logged after cursor, without waiting:
+        tuple (events, cursor after them). Databases may use prefix
+        to read fewer changes, events of other keys can be returned too.
+        """
+        raise NotImplementedError("Not implemented: _read_changes")
 
     def _get_experiment_info(self, experiment: Experiment):
         info = {}
@@ -255,17 +673,18 @@ class KeyValueProvider:
         info['logtail'] = self._get_experiment_logtail(experiment)
         return info
 
-    def _get_experiment_logtail(self, experiment: Experiment):
+    def _get_experiment_logtail(self, experiment: Experiment,
+                                tail_size: int = LOGTAIL_SIZE):
         try:
-            tarf = experiment.artifacts['output'].stream()
-            if not tarf:
+            logdata = experiment.artifacts['output'].read_tail(tail_size)
+            if logdata is None:
                 return None
-            tarf_member = tarf.members[0]
-            while tarf_member is not None and tarf_member.name == '':
-                tarf_member = tarf.next()
-
-            logdata = tarf.extractfile(tarf_member).read()
-            logdata = util.remove_backspaces(logdata).split('\n')
+            truncated = len(logdata) >= tail_size
+            logdata = util.remove_backspaces(
+                logdata.decode('utf-8', errors='replace')).split('\n')
+            if truncated:
+                # First line is most likely cut in the middle:
+                logdata = logdata[1:]
             return logdata
         except BaseException as exc:
             self.logger.debug('Getting experiment logtail raised an exception: %s',
@@ -274,7 +693,7 @@ class KeyValueProvider:
             return None
 
     def get_experiment(self, key, getinfo=True) -> Experiment:
-        data = self._get(self._get_experiments_keybase() + key)
+        data = self._get_experiment_dict(key)
         if data is None:
             return None
 
@@ -308,12 +727,12 @@ class KeyValueProvider:
         return experiment_keys
 
     def get_project_experiments(self, project):
-        experiment_keys = self._get(self._get_projects_keybase() +
-                                    project)
+        experiment_keys = self._get(
+            self._get_projects_keybase() + project + '/', shallow=True)
         if not experiment_keys:
-            experiment_keys = {}
+            experiment_keys = []
 
-        return experiment_keys.keys()
+        return experiment_keys
 
     def get_artifacts(self, key):
         if isinstance(key, str):
@@ -341,9 +760,11 @@ class KeyValueProvider:
         user_ids = self._get('users/', shallow=True)
         retval = {}
         if user_ids:
+            emails = self._get_many(['users/' + user_id + '/email'
+                                     for user_id in user_ids])
             for user_id in user_ids:
                 retval[user_id] = {
-                    'email': self._get('users/' + user_id + '/email')
+                    'email': emails.get('users/' + user_id + '/email', None)
                 }
         return retval
 
@@ -376,15 +797,106 @@ class KeyValueProvider:
         if existing_email != email:
             self._set(keypath, email)
 
+    def register_blob_peer(self, peer_id: str, url: str):
+        self._set(self._get_blob_peers_keybase() + peer_id,
+                  {'url': url, 'time': time.time()})
+
+    def unregister_blob_peer(self, peer_id: str):
+        self._delete(self._get_blob_peers_keybase() + peer_id)
+
+    def get_blob_peers(self, max_age=None):
+        """
+        URLs of registered blob servers, which refreshed
+        their records within max_age seconds.
+        """
+        now = time.time()
+        urls = []
+        for key in self._list_keys(self._get_blob_peers_keybase()):
+            record = self._get(key)
+            if not record or 'url' not in record:
+                continue
+            if max_age is None or now - record.get('time', 0) <= max_age:
+                urls.append(record['url'])
+        return urls
+
+    def import_records(self, source, batch_size: int = DEFAULT_PAGE_SIZE):
+        """
+        Copy all records of another key/value database
+        (like a LocalDbProvider JSON tree) into this one,
+        and index the copied experiments.
+        Returns number of copied records.
+        """
+        skipped = (self._get_indexes_keybase(), self._get_changes_keybase())
+        keys = [key for key in source._list_keys('')
+                if not key.startswith(skipped)]
+        count = 0
+        for start in range(0, len(keys), batch_size):
+            records = source._get_many(keys[start:start + batch_size])
+            records = {key: value for key, value in records.items()
+                       if value is not None}
+            self._set_many(records)
+            count += len(records)
+            self.logger.info('Copied %d of %d records', count, len(keys))
+        self.rebuild_indexes()
+        return count
+
     def get_storage_handler(self):
         return self.storage_handler
 
+    def get_cache_stats(self) -> Dict:
+        """Counters of the record cache: hits, revalidations, misses."""
+        return self.record_cache.get_stats()
+
     def _get(self, key, shallow=False):
         raise NotImplementedError("Not implemented: _get")
 
     def _set(self, key, value):
         raise NotImplementedError("Not implemented: _set")
 
+    def _get_many(self, keys) -> Dict:
+        """Values of several keys at once: key -> value (None if missing)."""
+        return {key: self._get(key) for key in keys}
+
+    def _set_many(self, items: Dict):
+        """Write several key -> value pairs at once."""
+        for key, value in items.items():
+            self._set(key, value)
+
+    def _delete_many(self, keys, shallow=True):
+        for key in keys:
+            self._delete(key, shallow=shallow)
+
+    def _get_versioned(self, key):
+        """
+        Value of key with its version: tuple (value, version),
+        version is None if key does not exist.
+        """
+        value = self._get(key)
+        return value, None
+
+    def _set_if(self, key, value, version) -> bool:
+        """
+        Write value only if key still has given version
+        (or still does not exist, if version is None).
+        Returns False if key was changed by somebody else.
+        Databases without conditional writes just write the value.
+        """
+        self._set(key, value)
+        return True
+
+    def _list_keys(self, prefix):
+        return self.storage_handler.list_files(prefix)
+
+    def _list_page(self, prefix, start_after=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Up to limit names of keys directly under prefix,
+        in name order, starting after given name.
+        """
+        names = sorted(key[len(prefix):] for key in self._list_keys(prefix))
+        return [name for name in names
+                if '/' not in name and
+                (start_after is None or name > start_after)][:limit]
+
     def _delete(self, key, shallow=True):
         raise NotImplementedError("Not implemented: _delete")
 
@@ -1,11 +1,48 @@
-import os
+import bisect
+import hashlib
 import json
+import os
+import threading
+import time
+import uuid
 
-from studio.db_providers.keyvalue_provider import KeyValueProvider
+from studio.db_providers import record_serializer
+from studio.db_providers.keyvalue_provider import KeyValueProvider, \
+    ChangeEvent
 from studio.storage.storage_handler_factory import StorageHandlerFactory
 from studio.storage.storage_type import StorageType
 from studio.util import util
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# When records are flushed to disk (fsync):
+# never - left to the OS; records are still replaced atomically,
+#         so readers never see partially written record;
+# always - before each write returns;
+# batch - group commit: written records are flushed together,
+#         at most group_commit_interval seconds after the write.
+FSYNC_NEVER = 'never'
+FSYNC_ALWAYS = 'always'
+FSYNC_BATCH = 'batch'
+DEFAULT_GROUP_COMMIT_INTERVAL = 1.0
+DEFAULT_GROUP_COMMIT_SIZE = 1000
+# Records are written into temporary files with this suffix
+# and renamed into place:
+TEMP_SUFFIX = '.studioml_tmp'
+# Lock file next to database directory,
+# held while conditional writes check and replace records:
+LOCK_SUFFIX = '.lock'
+# Change log: file next to database directory, one JSON line
+# per change; it is rotated when it grows over CHANGE_LOG_SIZE,
+# the previous one is kept with ROTATED_SUFFIX for slow readers.
+CHANGES_SUFFIX = '.changes'
+ROTATED_SUFFIX = '.1'
+CHANGE_LOG_SIZE = 16 * 1024 * 1024
+
+
 class LocalDbProvider(KeyValueProvider):
 
     def __init__(self, config, blocking_auth=True):
@@ -21,30 +58,321 @@ class LocalDbProvider(KeyValueProvider):
 
         super().__init__(config, self.meta_store, blocking_auth)
 
+        self.serializer = record_serializer.get_serializer(
+            config.get('serializer', None), self.logger)
+        self.fsync = str(config.get('fsync', FSYNC_NEVER)).lower()
+        if self.fsync not in [FSYNC_NEVER, FSYNC_ALWAYS, FSYNC_BATCH]:
+            raise ValueError('Unknown fsync mode ' + self.fsync)
+        self.group_commit_interval = float(config.get(
+            'group_commit_interval', DEFAULT_GROUP_COMMIT_INTERVAL))
+        self.group_commit_size = int(config.get(
+            'group_commit_size', DEFAULT_GROUP_COMMIT_SIZE))
+        self._pending_sync = set()
+        self._sync_lock = threading.Lock()
+        self._sync_timer = None
+        # Conditional writes are serialized between threads by this lock,
+        # and between processes by file lock (where fcntl is available):
+        self._write_lock = threading.Lock()
+        self.lock_path = self.db_root + LOCK_SUFFIX
+        self.changes_path = self.db_root + CHANGES_SUFFIX
+
     def _ensure_path_dirs_exist(self, path):
         dirs = os.path.dirname(path)
         os.makedirs(dirs, mode = 0o777, exist_ok = True)
 
     def _get(self, key, shallow=False):
         file_name = os.path.join(self.db_root, key)
-        if not os.path.exists(file_name):
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            self.record_cache.invalidate(key)
             return None
+        if os.path.isdir(file_name):
+            return self._list_dir(file_name) if shallow else None
+
+        # File that has the same modification time and size
+        # as the cached record is not read again:
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self.record_cache.get(key)
+        if cached is not None and \
+                (cached.fresh or cached.version == version):
+            if not cached.fresh:
+                self.record_cache.revalidated(key)
+            return record_serializer.loads(cached.text)
         try:
-            with open(file_name) as infile:
-                result = json.load(infile)
+            with open(file_name, 'rb') as infile:
+                data = infile.read()
+            result = record_serializer.loads(data)
         except BaseException as exc:
             self.logger.error("FAILED to load file %s - %s", file_name, exc)
-            result = None
+            return None
+        self.record_cache.fetched(key, version, data)
         return result
 
+    def _get_many(self, keys):
+        return {key: self._get(key) for key in keys}
+
+    def _get_versioned(self, key):
+        # Version of record is digest of its contents, like S3 ETag:
+        # file modification times are too coarse to tell apart
+        # records replaced quickly one after another.
+        file_name = os.path.join(self.db_root, key)
+        data = _read_file(file_name)
+        if data is None:
+            return None, None
+        try:
+            return record_serializer.loads(data), _digest(data)
+        except BaseException as exc:
+            self.logger.error("FAILED to load file %s - %s", file_name, exc)
+            return None, _digest(data)
+
+    def _set_if(self, key, value, version):
+        file_name = os.path.join(self.db_root, key)
+        self._ensure_path_dirs_exist(file_name)
+        with self._write_lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            data = _read_file(file_name)
+            current = _digest(data) if data is not None else None
+            if current != version:
+                return False
+            self._write(key, value)
+        self._log_changes([key])
+        return True
+
+    def _set_many(self, items):
+        # Records of a batch mostly share few directories:
+        dirs = set(os.path.dirname(os.path.join(self.db_root, key))
+                   for key in items.keys())
+        for dir_path in dirs:
+            os.makedirs(dir_path, mode=0o777, exist_ok=True)
+        for key, value in items.items():
+            self._write(key, value)
+        self._log_changes(items.keys())
+
+    def _delete_many(self, keys, shallow=True):
+        for key in keys:
+            self._delete(key, shallow=shallow)
+
+    def _list_dir(self, dir_path):
+        return sorted(name for name in os.listdir(dir_path)
+                      if not name.endswith(TEMP_SUFFIX))
+
+    def _list_keys(self, prefix):
+        prefix_path = os.path.join(self.db_root, prefix)
+        top = prefix_path if prefix.endswith('/') \
+            else os.path.dirname(prefix_path)
+        result = []
+        for dir_path, _, file_names in os.walk(top):
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                if path.startswith(prefix_path) and \
+                        not name.endswith(TEMP_SUFFIX):
+                    result.append(os.path.relpath(path, self.db_root)
+                                  .replace(os.sep, '/'))
+        return sorted(result)
+
+    def _list_page(self, prefix, start_after=None, limit=None):
+        dir_path = os.path.join(self.db_root, prefix)
+        if not os.path.isdir(dir_path):
+            return []
+        names = self._list_dir(dir_path)
+        start = 0 if start_after is None \
+            else bisect.bisect_right(names, start_after)
+        return names[start:start + limit] if limit else names[start:]
+
     def _delete(self, key, shallow=True):
         file_name = os.path.join(self.db_root, key)
         if os.path.exists(file_name):
             self.logger.debug("Deleting local database file %s.", file_name)
             util.delete_local_path(file_name, self.db_root, shallow)
+        self.record_cache.invalidate(key, prefix=True)
+        self._log_changes([key])
 
     def _set(self, key, value):
         file_name = os.path.join(self.db_root, key)
         self._ensure_path_dirs_exist(file_name)
-        with open(file_name, 'w') as outfile:
-            json.dump(value, outfile)
+        self._write(key, value)
+        self._log_changes([key])
+
+    def _write(self, key, value):
+        # Record is written next to its file and renamed over it,
+        # so concurrent readers see either old or new record,
+        # and interrupted write leaves old record in place:
+        file_name = os.path.join(self.db_root, key)
+        temp_name = '{0}.{1}{2}'.format(
+            file_name, uuid.uuid4().hex[:8], TEMP_SUFFIX)
+        data = record_serializer.dumps(value, self.serializer)
+        try:
+            with open(temp_name, 'wb') as outfile:
+                outfile.write(data)
+                outfile.flush()
+                if self.fsync == FSYNC_ALWAYS:
+                    os.fsync(outfile.fileno())
+                # Version of our own record: after the rename,
+                # file_name may already hold another writer's one:
+                stat = os.fstat(outfile.fileno())
+            os.replace(temp_name, file_name)
+        except BaseException:
+            self.record_cache.invalidate(key)
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+        self.record_cache.put(key, (stat.st_mtime_ns, stat.st_size), data)
+
+        if self.fsync == FSYNC_ALWAYS:
+            _fsync_path(os.path.dirname(file_name))
+        elif self.fsync == FSYNC_BATCH:
+            self._add_pending_sync(file_name)
+
+    def has_change_log(self):
+        return True
+
+    def get_change_cursor(self):
+        try:
+            stat = os.stat(self.changes_path)
+        except OSError:
+            return _make_cursor(0, 0)
+        return _make_cursor(stat.st_ino, stat.st_size)
+
+    def _log_changes(self, keys):
+        keys = [key for key in keys if self._is_logged(key)]
+        if not keys:
+            return
+        change_time = time.time()
+        data = ''.join(json.dumps({'key': key, 'time': change_time}) + '\n'
+                       for key in keys).encode('utf-8')
+        with self._write_lock:
+            while True:
+                with open(self.changes_path, 'ab') as log_file:
+                    if fcntl is not None:
+                        fcntl.flock(log_file.fileno(), fcntl.LOCK_EX)
+                    stat = os.fstat(log_file.fileno())
+                    try:
+                        rotated = stat.st_ino != \
+                            os.stat(self.changes_path).st_ino
+                    except OSError:
+                        rotated = True
+                    if rotated:
+                        # Rotated by another process meanwhile:
+                        continue
+                    if stat.st_size + len(data) > CHANGE_LOG_SIZE:
+                        os.replace(self.changes_path,
+                                   self.changes_path + ROTATED_SUFFIX)
+                        continue
+                    log_file.write(data)
+                    return
+
+    def _read_changes(self, cursor, prefix=None):
+        inode, offset = _parse_cursor(cursor)
+        try:
+            stat = os.stat(self.changes_path)
+        except OSError:
+            return [], cursor
+        events = []
+        if stat.st_ino != inode:
+            # Log was rotated (or created) after cursor,
+            # the rest of previous log goes first:
+            events, _ = _read_log(self.changes_path + ROTATED_SUFFIX,
+                                  inode, offset)
+            inode, offset = stat.st_ino, 0
+        new_events, offset = _read_log(self.changes_path, inode, offset)
+        events.extend(new_events)
+        return events, _make_cursor(inode, offset)
+
+    def _add_pending_sync(self, file_name):
+        with self._sync_lock:
+            self._pending_sync.add(file_name)
+            if len(self._pending_sync) >= self.group_commit_size:
+                flush_now = True
+            else:
+                flush_now = False
+                if self._sync_timer is None:
+                    self._sync_timer = threading.Timer(
+                        self.group_commit_interval, self.flush)
+                    self._sync_timer.daemon = True
+                    self._sync_timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """
+        Flush records written since last group commit to disk.
+        """
+        with self._sync_lock:
+            pending = self._pending_sync
+            self._pending_sync = set()
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+        dirs = set()
+        for file_name in pending:
+            try:
+                _fsync_path(file_name)
+            except OSError as exc:
+                # Record may be deleted or replaced meanwhile:
+                self.logger.debug("FAILED to flush %s: %s", file_name, exc)
+            dirs.add(os.path.dirname(file_name))
+        for dir_path in dirs:
+            try:
+                _fsync_path(dir_path)
+            except OSError as exc:
+                self.logger.debug("FAILED to flush %s: %s", dir_path, exc)
+        return len(pending)
+
+    def cleanup(self):
+        self.flush()
+        super().cleanup()
+
+
+def _make_cursor(inode, offset):
+    return '{0}:{1}'.format(inode, offset)
+
+
+def _parse_cursor(cursor):
+    inode, offset = cursor.split(':')
+    return int(inode), int(offset)
+
+
+def _read_log(path, inode, offset):
+    # Complete lines of change log after offset,
+    # if the log is still the file with given inode:
+    try:
+        with open(path, 'rb') as log_file:
+            if os.fstat(log_file.fileno()).st_ino != inode:
+                return [], offset
+            log_file.seek(offset)
+            data = log_file.read()
+    except OSError:
+        return [], offset
+    events = []
+    for line in data.split(b'\n')[:-1]:
+        offset += len(line) + 1
+        change = json.loads(line.decode('utf-8'))
+        events.append(ChangeEvent(change['key'], change['time'],
+                                  _make_cursor(inode, offset)))
+    return events, offset
+
+
+def _read_file(file_name):
+    try:
+        with open(file_name, 'rb') as infile:
+            return infile.read()
+    except OSError:
+        return None
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def _fsync_path(path):
+    # Directories are flushed so that renames in them persist;
+    # this is not supported on Windows.
+    if os.path.isdir(path) and os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
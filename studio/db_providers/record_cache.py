@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Dict
+
+# By default cached records are revalidated on every read,
+# which is a cheap conditional request instead of a full one:
+DEFAULT_RECORD_TTL = 0.0
+DEFAULT_MAX_RECORDS = 10000
+
+CachedRecord = namedtuple('CachedRecord', ['fresh', 'version', 'text'])
+
+
+# RecordCache keeps serialized database records read or written
+# by key/value provider, together with their version
+# (ETag of S3 object, modification time and size of local file).
+# Record younger than its TTL is returned without going to the database;
+# older record is revalidated by the provider with conditional request,
+# which does not transfer record again if its version did not change.
+# TTL may be set per key prefix, the longest matching prefix wins.
+class RecordCache:
+    def __init__(self, ttl: float = DEFAULT_RECORD_TTL,
+                 max_records: int = DEFAULT_MAX_RECORDS,
+                 prefix_ttl: Dict = None):
+        self.ttl = ttl
+        self.max_records = max_records
+        self.prefix_ttl = sorted(
+            [(prefix, float(value))
+             for prefix, value in (prefix_ttl or dict()).items()],
+            key=lambda item: len(item[0]), reverse=True)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def get_ttl(self, key: str) -> float:
+        for prefix, ttl in self.prefix_ttl:
+            if key.startswith(prefix):
+                return ttl
+        return self.ttl
+
+    def get(self, key: str):
+        """
+        Returns CachedRecord for key or None.
+        Fresh records are counted as cache hits.
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            expires, version, text = entry
+            fresh = expires > time.time()
+            if fresh:
+                self.hits += 1
+            return CachedRecord(fresh, version, text)
+
+    def revalidated(self, key: str):
+        """Record is confirmed to be current: extend its lifetime."""
+        with self._lock:
+            entry = self._entries.get(key, None)
+            self.revalidations += 1
+            if entry is not None:
+                self._entries[key] = \
+                    (time.time() + self.get_ttl(key), entry[1], entry[2])
+
+    def fetched(self, key: str, version, text: str):
+        """Record was read from the database."""
+        with self._lock:
+            self.misses += 1
+        self.put(key, version, text)
+
+    def put(self, key: str, version, text: str):
+        if self.max_records <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.get_ttl(key),
+                                  version, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_records:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str, prefix: bool = False):
+        with self._lock:
+            self._entries.pop(key, None)
+            if prefix:
+                for entry_key in [k for k in self._entries
+                                  if k.startswith(key)]:
+                    del self._entries[entry_key]
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'records': len(self._entries),
+                'hits': self.hits,
+                'revalidations': self.revalidations,
+                'misses': self.misses
+            }
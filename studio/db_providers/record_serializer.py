@@ -0,0 +1,78 @@
+"""
+    Serialization of database records stored as files.
+    Records are JSON by default; orjson writes the same JSON faster
+    (with NaN and Infinity written as null), and msgpack
+    writes a compact binary form. Binary records start with
+    a byte which can begin neither JSON text nor msgpack data,
+    so records written with any serializer can be read back
+    regardless of current configuration.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SERIALIZER_JSON = 'json'
+SERIALIZER_ORJSON = 'orjson'
+SERIALIZER_MSGPACK = 'msgpack'
+
+MSGPACK_MAGIC = b'\xc1'
+
+
+def get_available_serializers():
+    result = [SERIALIZER_JSON]
+    if orjson is not None:
+        result.append(SERIALIZER_ORJSON)
+    if msgpack is not None:
+        result.append(SERIALIZER_MSGPACK)
+    return result
+
+
+def get_serializer(name: str, logger=None) -> str:
+    """
+    Serializer to use for configured name: falls back to JSON
+    if requested package is not installed.
+    """
+    name = (name or SERIALIZER_JSON).lower()
+    if name not in [SERIALIZER_JSON, SERIALIZER_ORJSON, SERIALIZER_MSGPACK]:
+        raise ValueError('Unknown record serializer ' + name)
+    if name not in get_available_serializers():
+        if logger is not None:
+            logger.info('%s is not installed, using json records', name)
+        return SERIALIZER_JSON
+    return name
+
+
+def dumps(value, serializer: str = SERIALIZER_JSON) -> bytes:
+    if serializer == SERIALIZER_ORJSON:
+        try:
+            return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Values orjson does not support (like integers
+            # over 64 bits) are written by standard json module:
+            pass
+    elif serializer == SERIALIZER_MSGPACK:
+        return MSGPACK_MAGIC + msgpack.packb(value, use_bin_type=True)
+    return json.dumps(value).encode('utf-8')
+
+
+def loads(data: bytes):
+    if data[:1] == MSGPACK_MAGIC:
+        if msgpack is None:
+            raise ValueError('msgpack is needed to read binary record')
+        return msgpack.unpackb(data[1:], raw=False, strict_map_key=False)
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN and Infinity are written by standard json module:
+            pass
+    return json.loads(data.decode('utf-8'))
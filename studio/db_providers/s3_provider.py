@@ -1,8 +1,40 @@
 import json
-from studio.db_providers.keyvalue_provider import KeyValueProvider
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import botocore
+
+from studio.db_providers.keyvalue_provider import KeyValueProvider, \
+    ChangeEvent
 from studio.storage.storage_handler_factory import StorageHandlerFactory
 from studio.storage.storage_type import StorageType
 
+# Number of concurrent requests for batched reads and writes:
+BATCH_WORKERS = 16
+# S3 limit on number of keys in one delete_objects request:
+MAX_DELETE_KEYS = 1000
+# Every change is logged as two empty objects:
+# changes/log/<time of change>_<random id>/<changed key>,
+# so that one listing after given time returns changes of all keys,
+# and changes/keys/<changed key>/<time of change>_<random id>,
+# so that changes of one experiment are listed without the others.
+CHANGE_LOG_PREFIX = 'log/'
+CHANGE_KEYS_PREFIX = 'keys/'
+# Changes are listed starting this many seconds before the last one seen,
+# to pick up changes logged by clients whose clocks are behind:
+CHANGE_LOG_SKEW = 10.0
+# Changes older than this (seconds) are deleted by writers:
+# every logged change starts trimming with probability
+# 1 / CHANGE_LOG_TRIM_PERIOD, so all clients together trim about
+# once per that many changes, however short-lived each of them is.
+CHANGE_LOG_TTL = 3600.0
+CHANGE_LOG_TRIM_PERIOD = 1000
+# Every poll for changes is a LIST request, so it is done less often
+# than for other databases (seconds):
+WATCH_INTERVAL = 10.0
+
 
 class S3Provider(KeyValueProvider):
 
@@ -17,43 +49,129 @@ class S3Provider(KeyValueProvider):
             config,
             self.meta_store,
             blocking_auth)
+        self.watch_interval = float(config.get('watch_interval',
+                                               WATCH_INTERVAL))
 
     def _get(self, key, shallow=False):
+        if shallow:
+            return self._list_children(key)
+        cached = self.record_cache.get(key)
+        if cached is not None and cached.fresh:
+            return json.loads(cached.text)
+
+        kwargs = {'Bucket': self.bucket, 'Key': key}
+        if cached is not None and cached.version:
+            # Conditional GET: unchanged record is not sent again.
+            kwargs['IfNoneMatch'] = cached.version
         try:
-            response = self.meta_store.client.list_objects(
-                Bucket=self.bucket,
-                Prefix=key,
-                Delimiter='/',
-                MaxKeys=1024*16
-            )
+            response = self.meta_store.client.get_object(**kwargs)
+            text = response['Body'].read().decode("utf-8")
         except Exception as exc:
-            msg: str = "FAILED to list objects in bucket {0}: {1}"\
-                .format(self.bucket, exc)
+            error_code = _error_code(exc)
+            if error_code in ('304', 'NotModified') and \
+                    'IfNoneMatch' in kwargs:
+                self.record_cache.revalidated(key)
+                return json.loads(cached.text)
+            self.record_cache.invalidate(key)
+            if error_code in ('NoSuchKey', '404'):
+                return None
+            msg: str = "FAILED to get object {0} in bucket {1}: {2}"\
+                .format(key, self.bucket, exc)
             self._report_fatal(msg)
             return None
+        self.record_cache.fetched(key, response.get('ETag', None), text)
+        return json.loads(text)
 
-        if response is None:
-            return None
-
-        if 'Contents' not in response.keys():
-            return None
+    def _get_versioned(self, key):
+        try:
+            response = self.meta_store.client.get_object(
+                Bucket=self.bucket, Key=key)
+            text = response['Body'].read().decode("utf-8")
+        except Exception as exc:
+            if _error_code(exc) in ('NoSuchKey', '404'):
+                self.record_cache.invalidate(key)
+                return None, None
+            msg: str = "FAILED to get object {0} in bucket {1}: {2}"\
+                .format(key, self.bucket, exc)
+            self._report_fatal(msg)
+            return None, None
+        version = response.get('ETag', None)
+        self.record_cache.put(key, version, text)
+        return json.loads(text), version
 
-        key_count = len(response['Contents'])
+    def _set_if(self, key, value, version):
+        text = json.dumps(value)
+        self.record_cache.invalidate(key)
+        # Conditional PUT: fails with 412 Precondition Failed
+        # if object was changed (or created) by somebody else.
+        kwargs = {'Bucket': self.bucket, 'Key': key, 'Body': text}
+        if version is None:
+            kwargs['IfNoneMatch'] = '*'
+        else:
+            kwargs['IfMatch'] = version
+        try:
+            response = self.meta_store.client.put_object(**kwargs)
+        except Exception as exc:
+            # 409 is returned for concurrent conditional writes:
+            if _error_code(exc) in ('PreconditionFailed', '412',
+                                    'ConditionalRequestConflict', '409'):
+                return False
+            msg: str = "FAILED to write object {0} in bucket {1}: {2}"\
+                .format(key, self.bucket, exc)
+            self._report_fatal(msg)
+            return False
+        self.record_cache.put(key, response.get('ETag', None), text)
+        self._log_changes([key])
+        return True
 
-        if key_count == 0:
+    def _list_children(self, prefix):
+        """
+        Names of keys and "subdirectories" directly under prefix,
+        like names of files in a directory.
+        """
+        if not prefix.endswith('/'):
+            prefix += '/'
+        result = []
+        try:
+            paginator = self.meta_store.client.get_paginator(
+                'list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket,
+                                           Prefix=prefix,
+                                           Delimiter='/'):
+                for item in page.get('CommonPrefixes', []):
+                    result.append(item['Prefix'][len(prefix):].rstrip('/'))
+                for item in page.get('Contents', []):
+                    result.append(item['Key'][len(prefix):])
+        except Exception as exc:
+            msg: str = "FAILED to list objects {0} in bucket {1}: {2}"\
+                .format(prefix, self.bucket, exc)
+            self._report_fatal(msg)
             return None
+        return sorted(name for name in result if name)
 
-        for key_item in response['Contents']:
-            if 'Key' in key_item.keys() and key_item['Key'] == key:
-                response = self.meta_store.client.get_object(
-                    Bucket=self.bucket,
-                    Key=key)
-                return json.loads(response['Body'].read().decode("utf-8"))
-
-        return None
+    def _list_page(self, prefix, start_after=None, limit=None):
+        kwargs = {'Bucket': self.bucket, 'Prefix': prefix, 'Delimiter': '/'}
+        if start_after is not None:
+            kwargs['StartAfter'] = prefix + start_after
+        if limit:
+            kwargs['PaginationConfig'] = {'MaxItems': limit}
+        result = []
+        try:
+            paginator = self.meta_store.client.get_paginator(
+                'list_objects_v2')
+            for page in paginator.paginate(**kwargs):
+                for item in page.get('Contents', []):
+                    result.append(item['Key'][len(prefix):])
+        except Exception as exc:
+            msg: str = "FAILED to list objects {0} in bucket {1}: {2}"\
+                .format(prefix, self.bucket, exc)
+            self._report_fatal(msg)
+            return []
+        return result[:limit] if limit else result
 
     def _delete(self, key, shallow=True):
         self.logger.info("S3 deleting object: %s/%s", self.bucket, key)
+        self.record_cache.invalidate(key)
 
         try:
             response = self.meta_store.client.delete_object(
@@ -64,6 +182,7 @@ class S3Provider(KeyValueProvider):
                 .format(key, self.bucket, exc)
             self.logger.info(msg)
             return
+        self._log_changes([key])
 
         reason = response['ResponseMetadata'] if response else "None"
         if response is None or\
@@ -74,11 +193,13 @@ class S3Provider(KeyValueProvider):
             self.logger.info(msg)
 
     def _set(self, key, value):
+        text = json.dumps(value)
+        self.record_cache.invalidate(key)
         try:
             response = self.meta_store.client.put_object(
                 Bucket=self.bucket,
                 Key=key,
-                Body=json.dumps(value))
+                Body=text)
         except Exception as exc:
             msg: str = "FAILED to write object {0} in bucket {1}: {2}"\
                 .format(key, self.bucket, exc)
@@ -91,3 +212,178 @@ class S3Provider(KeyValueProvider):
                        ' returned response {2}')\
                 .format(key, self.bucket, reason)
             self._report_fatal(msg)
+        self.record_cache.put(key, response.get('ETag', None), text)
+        self._log_changes([key])
+
+    def _get_many(self, keys):
+        keys = list(keys)
+        if len(keys) <= 1:
+            return {key: self._get(key) for key in keys}
+        with ThreadPoolExecutor(
+                max_workers=min(len(keys), BATCH_WORKERS)) as executor:
+            return dict(zip(keys, executor.map(self._get, keys)))
+
+    def _set_many(self, items):
+        if len(items) <= 1:
+            for key, value in items.items():
+                self._set(key, value)
+            return
+        with ThreadPoolExecutor(
+                max_workers=min(len(items), BATCH_WORKERS)) as executor:
+            list(executor.map(lambda item: self._set(*item), items.items()))
+
+    def _delete_many(self, keys, shallow=True):
+        keys = list(keys)
+        for start in range(0, len(keys), MAX_DELETE_KEYS):
+            batch = keys[start:start + MAX_DELETE_KEYS]
+            for key in batch:
+                self.record_cache.invalidate(key)
+            try:
+                response = self.meta_store.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={'Objects': [{'Key': key} for key in batch],
+                            'Quiet': True})
+            except Exception as exc:
+                msg: str = "FAILED to delete {0} objects in bucket {1}: {2}"\
+                    .format(len(batch), self.bucket, exc)
+                self.logger.info(msg)
+                continue
+            for error in response.get('Errors', []):
+                self.logger.info("FAILED to delete object %s in bucket %s: %s",
+                                 error.get('Key'), self.bucket,
+                                 error.get('Message'))
+            self._log_changes(batch)
+
+    def has_change_log(self):
+        return True
+
+    def get_change_cursor(self):
+        # Changes already logged within the listing window
+        # are marked as seen:
+        _, cursor = self._read_changes(_make_cursor(time.time(), []))
+        return cursor
+
+    def _log_changes(self, keys):
+        change_time = time.time()
+        keybase = self._get_changes_keybase()
+        logged = 0
+        for key in keys:
+            if not self._is_logged(key):
+                continue
+            name = '{0}_{1}'.format(_change_stamp(change_time),
+                                    uuid.uuid4().hex[:8])
+            try:
+                for change_key in [
+                        keybase + CHANGE_LOG_PREFIX + name + '/' + key,
+                        keybase + CHANGE_KEYS_PREFIX + key + '/' + name]:
+                    self.meta_store.client.put_object(
+                        Bucket=self.bucket, Key=change_key, Body=b'')
+                logged += 1
+            except Exception as exc:
+                self.logger.info("FAILED to log change of %s: %s", key, exc)
+        if logged and random.random() < logged / CHANGE_LOG_TRIM_PERIOD:
+            self._trim_changes(change_time - CHANGE_LOG_TTL)
+
+    def _trim_changes(self, before_time):
+        # Log is listed in time order, only up to before_time:
+        keybase = self._get_changes_keybase()
+        log_keybase = keybase + CHANGE_LOG_PREFIX
+        end = log_keybase + _change_stamp(before_time)
+        old_keys = []
+        try:
+            paginator = self.meta_store.client.get_paginator(
+                'list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket,
+                                           Prefix=log_keybase):
+                items = [item['Key'] for item in page.get('Contents', [])]
+                for change_key in items:
+                    if change_key >= end:
+                        break
+                    name, key = change_key[len(log_keybase):].split('/', 1)
+                    old_keys.append(change_key)
+                    old_keys.append(
+                        keybase + CHANGE_KEYS_PREFIX + key + '/' + name)
+                if items and items[-1] >= end:
+                    break
+        except Exception as exc:
+            self.logger.info("FAILED to list old changes in bucket %s: %s",
+                             self.bucket, exc)
+            return
+        if old_keys:
+            self._delete_many(old_keys)
+            self.logger.debug('Deleted %d old changes', len(old_keys) // 2)
+
+    def _read_changes(self, cursor, prefix=None):
+        # Cursor is time of the last change seen, with names
+        # of changes seen within CHANGE_LOG_SKEW before it,
+        # which are listed again and should not be reported twice.
+        # Changes under a prefix narrower than the whole states keybase
+        # (like of one experiment) are listed from their own objects.
+        last_time, seen = json.loads(cursor)
+        seen = set(seen)
+        start = _change_stamp(last_time - CHANGE_LOG_SKEW)
+        keybase = self._get_changes_keybase()
+        if prefix is not None and prefix != self._get_states_keybase():
+            list_args = {'Prefix': keybase + CHANGE_KEYS_PREFIX + prefix}
+        else:
+            list_args = {'Prefix': keybase + CHANGE_LOG_PREFIX,
+                         'StartAfter': keybase + CHANGE_LOG_PREFIX + start}
+        changes = []
+        try:
+            paginator = self.meta_store.client.get_paginator(
+                'list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, **list_args):
+                for item in page.get('Contents', []):
+                    changes.append(_parse_change(
+                        item['Key'][len(keybase):]))
+        except Exception as exc:
+            msg: str = "FAILED to list changes in bucket {0}: {1}"\
+                .format(self.bucket, exc)
+            self._report_fatal(msg)
+            return [], cursor
+
+        events = []
+        for name, key in sorted(change for change in changes
+                                if change is not None):
+            if name < start or name in seen:
+                continue
+            change_time = float(name.split('_')[0])
+            seen.add(name)
+            last_time = max(last_time, change_time)
+            events.append((key, change_time))
+        if not events:
+            return [], cursor
+        # All changes read together share the cursor after them:
+        cursor = _make_cursor(last_time, seen)
+        return [ChangeEvent(key, change_time, cursor)
+                for key, change_time in events], cursor
+
+
+def _change_stamp(change_time):
+    return '{0:017.6f}'.format(change_time)
+
+
+def _parse_change(name):
+    # (<time>_<id>, changed key) of change object name
+    # under changes keybase, or None for unknown name:
+    if name.startswith(CHANGE_LOG_PREFIX):
+        parts = name[len(CHANGE_LOG_PREFIX):].split('/', 1)
+        if len(parts) == 2:
+            return parts[0], parts[1]
+    elif name.startswith(CHANGE_KEYS_PREFIX):
+        parts = name[len(CHANGE_KEYS_PREFIX):].rsplit('/', 1)
+        if len(parts) == 2:
+            return parts[1], parts[0]
+    return None
+
+
+def _make_cursor(last_time, seen):
+    start = _change_stamp(last_time - CHANGE_LOG_SKEW)
+    return json.dumps([last_time,
+                       sorted(name for name in seen if name >= start)])
+
+
+def _error_code(exc):
+    if isinstance(exc, botocore.exceptions.ClientError):
+        return exc.response.get('Error', {}).get('Code', None)
+    return None
@@ -0,0 +1,322 @@
+"""
+    Key/value database in a single SQLite file.
+    Records are kept in WAL mode, so that readers do not block
+    the writer, and several processes on one host (workers, runner, UI)
+    can use the same database safely. Multi-key updates of experiment
+    lifecycle are done in one transaction each. Every record has
+    a sequence number, incremented on each write, which is used
+    for conditional writes of experiment states, and changes
+    of experiment states are logged in a table, which can be watched
+    instead of polling experiments. Experiment records
+    are indexed by owner, project, status and time in a separate table,
+    which is updated together with the records.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from studio.db_providers.keyvalue_provider import KeyValueProvider, \
+    ChangeEvent, DEFAULT_PAGE_SIZE, SUMMARY_FIELDS
+from studio.storage.storage_handler_factory import StorageHandlerFactory
+from studio.storage.storage_type import StorageType
+
+# How long to wait for other processes holding the database lock, seconds:
+BUSY_TIMEOUT = 60
+# Upper bound for keys starting with given prefix:
+MAX_KEY_CHAR = chr(0x10ffff)
+# Number of keys looked up with one query:
+GET_BATCH_SIZE = 500
+# Number of latest changes kept in change log:
+CHANGE_LOG_RECORDS = 100000
+# Change log is trimmed every this many changes:
+CHANGE_LOG_TRIM_INTERVAL = 1000
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS records (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        time_updated REAL NOT NULL,
+        version INTEGER NOT NULL DEFAULT 1)''',
+    '''CREATE TABLE IF NOT EXISTS experiments (
+        key TEXT PRIMARY KEY,
+        owner TEXT,
+        project TEXT,
+        status TEXT,
+        time_added REAL,
+        summary TEXT NOT NULL)''',
+    '''CREATE INDEX IF NOT EXISTS experiments_time
+        ON experiments (time_added, key)''',
+    '''CREATE INDEX IF NOT EXISTS experiments_owner
+        ON experiments (owner, time_added, key)''',
+    '''CREATE INDEX IF NOT EXISTS experiments_project
+        ON experiments (project, time_added, key)''',
+    '''CREATE INDEX IF NOT EXISTS experiments_status
+        ON experiments (status, time_added, key)''',
+    '''CREATE TABLE IF NOT EXISTS changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT NOT NULL,
+        time REAL NOT NULL)'''
+]
+
+
+class SQLiteProvider(KeyValueProvider):
+
+    def __init__(self, config, blocking_auth=True):
+        self.config = config
+        self.bucket = config.get('bucket', 'studioml-meta')
+
+        factory: StorageHandlerFactory = StorageHandlerFactory.get_factory()
+        self.meta_store = factory.get_handler(StorageType.storageLocal, config)
+
+        self.endpoint = self.meta_store.get_endpoint()
+        self.db_path = config.get('path', None)
+        if self.db_path is None:
+            self.db_path = os.path.join(self.endpoint, self.bucket + '.sqlite')
+        self.db_path = os.path.expanduser(self.db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)),
+                    mode=0o777, exist_ok=True)
+
+        # sqlite3 connections can not be shared between threads
+        # (or forked processes), each of them opens its own:
+        self._local = threading.local()
+
+        super().__init__(config, self.meta_store, blocking_auth)
+
+        with self._transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            columns = [row[1] for row in
+                       conn.execute('PRAGMA table_info(records)')]
+            if 'version' not in columns:
+                # Database created before records were versioned:
+                conn.execute('ALTER TABLE records ADD COLUMN '
+                             'version INTEGER NOT NULL DEFAULT 1')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT,
+                               isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock upfront, so that concurrent
+        # writers wait for each other instead of failing on upgrade:
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _experiment_name(self, key, keybase=None):
+        # Name of experiment, if key is experiment record
+        # (or its state, for states keybase):
+        if keybase is None:
+            keybase = self._get_experiments_keybase()
+        if key.startswith(keybase) and '/' not in key[len(keybase):]:
+            return key[len(keybase):]
+        return None
+
+    def _get(self, key, shallow=False):
+        conn = self._connect()
+        if shallow:
+            prefix = key if key.endswith('/') else key + '/'
+            names = []
+            for (child_key,) in conn.execute(
+                    'SELECT key FROM records WHERE key > ? AND key < ? '
+                    'ORDER BY key', (prefix, prefix + MAX_KEY_CHAR)):
+                name = child_key[len(prefix):].split('/')[0]
+                if name and (not names or names[-1] != name):
+                    names.append(name)
+            return names if names else None
+
+        row = conn.execute('SELECT value FROM records WHERE key = ?',
+                           (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _get_many(self, keys) -> Dict:
+        keys = list(keys)
+        result = {key: None for key in keys}
+        conn = self._connect()
+        # Stay below SQLite limit on number of query parameters:
+        for start in range(0, len(keys), GET_BATCH_SIZE):
+            batch = keys[start:start + GET_BATCH_SIZE]
+            for key, value in conn.execute(
+                    'SELECT key, value FROM records WHERE key IN ({0})'
+                    .format(','.join('?' * len(batch))), batch):
+                result[key] = json.loads(value)
+        return result
+
+    def _set(self, key, value):
+        self._set_many({key: value})
+
+    def _set_many(self, items: Dict):
+        with self._transaction() as conn:
+            for key, value in items.items():
+                self._write(conn, key, value)
+
+    def _get_versioned(self, key):
+        row = self._connect().execute(
+            'SELECT value, version FROM records WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def _set_if(self, key, value, version):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT version FROM records WHERE key = ?',
+                               (key,)).fetchone()
+            if (row[0] if row is not None else None) != version:
+                return False
+            self._write(conn, key, value)
+            return True
+
+    def _write(self, conn, key, value):
+        conn.execute(
+            'INSERT OR REPLACE INTO records '
+            '(key, value, time_updated, version) VALUES (?, ?, ?, '
+            'COALESCE((SELECT version FROM records WHERE key = ?), 0) + 1)',
+            (key, json.dumps(value), time.time(), key))
+        self._log_change(conn, key)
+        if not isinstance(value, dict):
+            return
+        if self._experiment_name(key) is not None:
+            self._index_experiment(conn, value)
+            return
+        name = self._experiment_name(key, self._get_states_keybase())
+        if name is not None:
+            row = conn.execute('SELECT summary FROM experiments '
+                               'WHERE key = ?', (name,)).fetchone()
+            if row is not None:
+                summary = json.loads(row[0])
+                summary['status'] = value.get('status', None)
+                conn.execute('UPDATE experiments SET status = ?, '
+                             'summary = ? WHERE key = ?',
+                             (summary['status'], json.dumps(summary), name))
+
+    def _log_change(self, conn, key):
+        if not self._is_logged(key):
+            return
+        seq = conn.execute('INSERT INTO changes (key, time) VALUES (?, ?)',
+                           (key, time.time())).lastrowid
+        if seq % CHANGE_LOG_TRIM_INTERVAL == 0:
+            conn.execute('DELETE FROM changes WHERE seq <= ?',
+                         (seq - CHANGE_LOG_RECORDS,))
+
+    def has_change_log(self):
+        return True
+
+    def get_change_cursor(self):
+        row = self._connect().execute(
+            'SELECT MAX(seq) FROM changes').fetchone()
+        return str(row[0] or 0)
+
+    def _read_changes(self, cursor, prefix=None):
+        events = [ChangeEvent(key, change_time, str(seq))
+                  for seq, key, change_time in self._connect().execute(
+                      'SELECT seq, key, time FROM changes WHERE seq > ? '
+                      'ORDER BY seq', (int(cursor),))]
+        return events, events[-1].cursor if events else cursor
+
+    def _index_experiment(self, conn, experiment_dict):
+        summary = {field: experiment_dict.get(field, None)
+                   for field in SUMMARY_FIELDS}
+        row = conn.execute(
+            'SELECT value FROM records WHERE key = ?',
+            (self._get_states_keybase() + str(summary['key']),)).fetchone()
+        if row is not None:
+            # Status is kept in experiment state:
+            summary['status'] = json.loads(row[0]).get('status', None)
+        owner, project = summary['owner'], summary['project']
+        if experiment_dict.get('from_compl_service', False):
+            # Just like in user and project indexes:
+            owner, project = None, None
+        conn.execute(
+            'INSERT OR REPLACE INTO experiments '
+            '(key, owner, project, status, time_added, summary) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (summary['key'], owner, project, summary['status'],
+             summary['time_added'], json.dumps(summary)))
+
+    def _delete(self, key, shallow=True):
+        self._delete_many([key], shallow=shallow)
+
+    def _delete_many(self, keys, shallow=True):
+        with self._transaction() as conn:
+            for key in keys:
+                conn.execute('DELETE FROM records WHERE key = ?', (key,))
+                self._log_change(conn, key)
+                name = self._experiment_name(key)
+                if name is not None:
+                    conn.execute('DELETE FROM experiments WHERE key = ?',
+                                 (name,))
+
+    def _list_keys(self, prefix):
+        return [key for (key,) in self._connect().execute(
+            'SELECT key FROM records WHERE key >= ? AND key < ? '
+            'ORDER BY key', (prefix, prefix + MAX_KEY_CHAR))]
+
+    def _get_index_entries(self, experiment_dict) -> Dict:
+        # Experiments are indexed by the database itself.
+        return dict()
+
+    def has_indexes(self) -> bool:
+        # Experiments table is kept up to date with records.
+        return True
+
+    def query_experiments(self, status=None, project=None, owner=None,
+                          page_size=DEFAULT_PAGE_SIZE, page_token=None):
+        conditions = []
+        params = []
+        for field, value in [('status', status), ('project', project),
+                             ('owner', owner)]:
+            if value is not None:
+                conditions.append(field + ' = ?')
+                params.append(value)
+        if page_token is not None:
+            time_added, key = json.loads(page_token)
+            conditions.append(
+                '(time_added < ? OR (time_added = ? AND key < ?))')
+            params.extend([time_added, time_added, key])
+        query = 'SELECT summary FROM experiments'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY time_added DESC, key DESC LIMIT ?'
+        params.append(page_size)
+
+        summaries = [json.loads(summary) for (summary,) in
+                     self._connect().execute(query, params)]
+        if len(summaries) < page_size:
+            return summaries, None
+        last = summaries[-1]
+        return summaries, json.dumps([last['time_added'], last['key']])
+
+    def rebuild_indexes(self):
+        keybase = self._get_experiments_keybase()
+        count = 0
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM experiments')
+            for key, value in conn.execute(
+                    'SELECT key, value FROM records WHERE key > ? AND key < ?',
+                    (keybase, keybase + MAX_KEY_CHAR)).fetchall():
+                record = json.loads(value)
+                if self._experiment_name(key) is not None and \
+                        isinstance(record, dict) and record.get('key', None):
+                    self._index_experiment(conn, record)
+                    count += 1
+        return count
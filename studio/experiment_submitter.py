@@ -51,15 +51,21 @@ def submit_experiments(
         # Update Python environment info for our experiments:
         experiment.pythonenv = util.add_packages(experiment.pythonenv, python_pkg)
 
-        # Add experiment to database:
-        try:
-            with db_provider_setup.get_db_provider(config) as db:
+    # Add experiments to database, all at once if provider can do that:
+    try:
+        with db_provider_setup.get_db_provider(config) as db:
+            for experiment in experiments:
                 _add_git_info(experiment, logger)
-                db.add_experiment(experiment)
-        except BaseException:
-            traceback.print_exc()
-            raise
+            if hasattr(db, 'add_experiments'):
+                db.add_experiments(experiments)
+            else:
+                for experiment in experiments:
+                    db.add_experiment(experiment)
+    except BaseException:
+        traceback.print_exc()
+        raise
 
+    for experiment in experiments:
         payload = payload_builder.construct(experiment, config, python_pkg)
 
         logger.info("Submitting experiment: {0}"
@@ -7,6 +7,7 @@ import psutil
 import time
 import six
 import signal
+import threading
 import pdb
 
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -15,24 +16,34 @@ from studio import fs_tracker, model
 from studio.util import logs
 from studio.queues.local_queue import LocalQueue
 from studio.util.gpu_util import get_available_gpus, get_gpu_mapping, get_gpus_summary
-from studio.artifacts.artifact import Artifact
+from studio.artifacts.artifact import Artifact, prefetch_metadata
+from studio.artifacts.blob_cache import get_blob_cache
+from studio.artifacts.blob_peers import start_blob_server
+from studio.checkpoint_uploader import CheckpointUploader
 from studio.experiments.experiment import Experiment
 from studio.util.util import sixdecode, str2duration, retry,\
     parse_verbosity, check_for_kb_interrupt
 
 logs.get_logger('apscheduler.scheduler').setLevel(logs.ERROR)
 
+# How often running experiment is checked for being stopped
+# or running over its max_duration, seconds:
+STOP_CHECK_INTERVAL = 10
+
 class LocalExecutor(object):
     """Runs job while capturing environment and logs results.
     """
 
-    def __init__(self, queue, args):
+    def __init__(self, queue, args, uploader=None):
         self.config = args.config
 
         if args.guest:
             self.config['database']['guest'] = True
 
         self.task_queue = queue
+        # Background checkpoint uploader, if None,
+        # checkpoints are uploaded synchronously:
+        self.uploader = uploader
         self.logger = logs.get_logger('LocalExecutor')
         self.logger.setLevel(model.parse_verbosity(self.config.get('verbose', None)))
         self.logger.debug("Config: ")
@@ -124,7 +135,10 @@ class LocalExecutor(object):
 
                 def checkpoint():
                     try:
-                        db.checkpoint_experiment(experiment)
+                        if self.uploader is not None:
+                            self.uploader.submit(experiment, self.config)
+                        else:
+                            db.checkpoint_experiment(experiment)
                     except BaseException as e:
                         self.logger.info(e)
                         check_for_kb_interrupt()
@@ -139,14 +153,21 @@ class LocalExecutor(object):
                 sched.add_job(lambda: save_metrics(metrics_path),
                               'interval', minutes=minutes)
 
-                def kill_if_stopped():
+                def is_stopped():
                     try:
-                        db_expr = db.get_experiment(
-                            experiment.key,
-                            getinfo=False)
+                        # Only experiment state is needed here,
+                        # where database keeps it separately:
+                        if hasattr(db, 'get_experiment_state'):
+                            db_state = db.get_experiment_state(experiment.key)
+                        else:
+                            db_state = db.get_experiment(
+                                experiment.key,
+                                getinfo=False)
+                            db_state = db_state.__dict__ \
+                                if db_state is not None else None
                     except:
                         check_for_kb_interrupt()
-                        db_expr = None
+                        db_state = None
 
                     # Transient issues with getting experiment data might
                     # result in a None value being returned, as result
@@ -154,10 +175,36 @@ class LocalExecutor(object):
                     # do anything else even if this experiment is stopped
                     # in any event if the experiment runs too long then it
                     # will exceed its allocated time and stop
-                    if db_expr is not None:
-                        if db_expr.status == 'stopped':
+                    return db_state is not None and \
+                        db_state.get('status', None) == 'stopped'
+
+                # Status of experiment is checked when its state changes,
+                # if database keeps log of changes, instead of reading it
+                # every STOP_CHECK_INTERVAL seconds:
+                watching = hasattr(db, 'has_change_log') and \
+                    db.has_change_log()
+
+                def watch_if_stopped():
+                    cursor = db.get_change_cursor()
+                    changed = True
+                    while p.poll() is None:
+                        if changed and is_stopped():
                             kill_subprocess()
                             return
+                        try:
+                            changed, cursor = db.wait_for_experiments(
+                                [experiment.key], cursor, STOP_CHECK_INTERVAL)
+                        except BaseException as exc:
+                            check_for_kb_interrupt()
+                            self.logger.debug(
+                                'Watching experiment state failed: %s', exc)
+                            time.sleep(STOP_CHECK_INTERVAL)
+                            changed = True
+
+                def kill_if_stopped():
+                    if not watching and is_stopped():
+                        kill_subprocess()
+                        return
 
                     if experiment.max_duration is not None and \
                             time.time() > experiment.time_started + \
@@ -173,7 +220,11 @@ class LocalExecutor(object):
                     if not self.task_queue.is_active():
                         kill_subprocess()
 
-                sched.add_job(kill_if_stopped, 'interval', seconds=10)
+                sched.add_job(kill_if_stopped, 'interval',
+                              seconds=STOP_CHECK_INTERVAL)
+                if watching:
+                    threading.Thread(target=watch_if_stopped,
+                                     daemon=True).start()
 
                 while True:
                     output = p.stdout.readline()
@@ -189,8 +240,17 @@ class LocalExecutor(object):
                 finally:
                     save_metrics(metrics_path)
                     sched.shutdown()
-                    db.checkpoint_experiment(experiment)
-                    db.finish_experiment(experiment)
+                    if hasattr(db, 'get_cache_stats'):
+                        self.logger.debug('Database record cache: %s',
+                                          db.get_cache_stats())
+                    if self.uploader is not None:
+                        # Experiment is marked as finished
+                        # when its final checkpoint is uploaded:
+                        self.uploader.submit(experiment, self.config,
+                                             final=True)
+                    else:
+                        db.checkpoint_experiment(experiment)
+                        db.finish_experiment(experiment)
                     return p.returncode
 
 def allocate_resources(experiment, config=None, verbose=10):
@@ -305,6 +365,9 @@ def worker_loop(queue, parsed_args,
 
     hold_period = 4
     retval = 0
+    # Background checkpoint uploads are enabled by
+    # "background_checkpoints" config option:
+    uploader = None
     while True:
         msg = queue.dequeue(acknowledge=False, timeout=timeout)
         if not msg:
@@ -326,9 +389,16 @@ def worker_loop(queue, parsed_args,
 
         logger.debug('Received message: \n{}'.format(data_dict))
 
-        executor = LocalExecutor(queue, parsed_args)
+        if uploader is None and \
+                _is_enabled(config.get('background_checkpoints', False)):
+            # Uploads left over by previous worker run are resumed right away:
+            uploader = CheckpointUploader(config=config, verbose=verbose)
+
+        executor = LocalExecutor(queue, parsed_args, uploader=uploader)
 
         with model.get_db_provider(config) as db:
+            # Share our blob cache with other workers, if configured:
+            start_blob_server()
             # experiment = experiment_from_dict(data_dict['experiment'])
             def try_get_experiment():
                 experiment = db.get_experiment(experiment_key)
@@ -361,6 +431,8 @@ def worker_loop(queue, parsed_args,
                 sched.add_job(hold_job, 'interval', minutes=hold_period / 2)
                 sched.start()
 
+                blob_cache = get_blob_cache()
+                pinned = []
                 try:
                     python = 'python'
                     if experiment.pythonver[0] == '3':
@@ -385,6 +457,12 @@ def worker_loop(queue, parsed_args,
                                 for pkg in pip_diff:
                                     pip_install_packages([pkg], python, logger)
 
+                    # Resolve storage state of all artifacts to fetch
+                    # in one batch:
+                    prefetch_metadata(
+                        [art for art in experiment.artifacts.values()
+                         if not art.is_mutable and
+                         (fetch_artifacts or art.local_path is None)])
                     for tag, item in experiment.artifacts.items():
                         art: Artifact = item
                         if fetch_artifacts or art.local_path is None:
@@ -399,6 +477,10 @@ def worker_loop(queue, parsed_args,
                                     sleep_time=10,
                                     logger=logger
                                 )
+                                # Keep experiment inputs in the blob cache
+                                # while experiment is running:
+                                blob_cache.pin(art.local_path)
+                                pinned.append(art.local_path)
                             else:
                                 logger.info('Skipping mutable artifact ' + tag)
 
@@ -407,11 +489,15 @@ def worker_loop(queue, parsed_args,
                     if returncode != 0:
                         retval = returncode
                 finally:
+                    for local_path in pinned:
+                        blob_cache.unpin(local_path)
                     sched.shutdown()
                     queue.acknowledge(ack_key)
 
                 if single_experiment:
                     logger.info('single_experiment is True, quitting')
+                    if uploader is not None:
+                        uploader.wait()
                     return retval
             else:
                 logger.info('Cannot run experiment ' + experiment.key +
@@ -421,10 +507,19 @@ def worker_loop(queue, parsed_args,
 
     logger.info("Queue in {0} is empty, quitting"
                 .format(fs_tracker.get_queue_directory()))
+    if uploader is not None:
+        logger.info('Waiting for checkpoint uploads to finish')
+        uploader.wait()
 
     return retval
 
 
+def _is_enabled(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
+
+
 def pip_install_packages(packages, python='python', logger=None):
     pipp = subprocess.Popen(
         [python, '-m', 'pip', 'install'] + [p for p in packages],
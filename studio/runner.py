@@ -21,6 +21,11 @@ from studio import fs_tracker
 from studio.dependencies_policies.studio_dependencies_policy import StudioDependencyPolicy
 from studio.util import logs, util
 
+# Output of all pending experiments is read again after this many
+# waits for changes, in case reading it after the last change
+# found no result yet:
+RESCAN_WAITS = 5
+
 def main(args=sys.argv[1:]):
     logger = logs.get_logger('studio-runner')
     parser = argparse.ArgumentParser(
@@ -572,6 +577,13 @@ def get_experiment_fitnesses(experiments, optimizer, config, logger):
         skip_gen_timeout = term_criterion['skip_gen_timeout']
         result_timestamp = time.time()
 
+        # Output of experiments is read again only when their state
+        # changes (on checkpoints), if database keeps log of changes:
+        watching = hasattr(db, 'has_change_log') and db.has_change_log()
+        change_cursor = db.get_change_cursor() if watching else None
+        changed = set(experiment.key for experiment in experiments)
+        waits = 0
+
         while sum(has_result) < len(experiments):
             for i, experiment in enumerate(experiments):
                 if float(sum(has_result)) / len(experiments) >= skip_gen_thres\
@@ -583,10 +595,11 @@ def get_experiment_fitnesses(experiments, optimizer, config, logger):
                             len(experiments)))
                     has_result = [True] * len(experiments)
                     break
-                if has_result[i]:
+                if has_result[i] or experiment.key not in changed:
                     continue
+                # Output tail is read below, no need to read it twice:
                 returned_experiment = db.get_experiment(experiment.key,
-                                                        getinfo=True)
+                                                        getinfo=False)
                 output = db._get_experiment_logtail(
                     returned_experiment)
                 if output is None:
@@ -654,7 +667,18 @@ def get_experiment_fitnesses(experiments, optimizer, config, logger):
                             result_timestamp = time.time()
                             break
 
-            time.sleep(config['sleep_time'])
+            if watching:
+                changed, change_cursor = db.wait_for_experiments(
+                    [e.key for e, done in zip(experiments, has_result)
+                     if not done],
+                    change_cursor, config['sleep_time'])
+                waits += 1
+                if waits >= RESCAN_WAITS:
+                    changed = set(experiment.key
+                                  for experiment in experiments)
+                    waits = 0
+            else:
+                time.sleep(config['sleep_time'])
         return fitnesses, behaviors
 
 
@@ -0,0 +1,97 @@
+"""
+    Native async HTTP handler on top of aiohttp (optional package).
+    HTTP storage handler serves single URL (usually presigned one),
+    and a sweep touches many of them, so all handlers running
+    on the same event loop share one client session
+    with its pool of keep-alive connections.
+"""
+
+import asyncio
+import os
+import uuid
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from studio.storage.async_storage_handler import AsyncStorageHandler, \
+    DEFAULT_CONCURRENCY
+from studio.storage.storage_type import StorageType
+
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+
+# Event loop -> shared client session:
+_sessions = dict()
+
+
+def is_available() -> bool:
+    return aiohttp is not None
+
+
+def _get_session(concurrency: int):
+    loop = asyncio.get_event_loop()
+    session = _sessions.get(loop, None)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency))
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    """Close client session shared by handlers on current event loop."""
+    session = _sessions.pop(asyncio.get_event_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+# AsyncHTTPStorageHandler mirrors URL and timestamp
+# of existing HTTPStorageHandler; like the blocking one,
+# it ignores storage keys.
+class AsyncHTTPStorageHandler(AsyncStorageHandler):
+    def __init__(self, handler, concurrency: int = DEFAULT_CONCURRENCY):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for async HTTP storage')
+        self.handler = handler
+        self.url = handler.url
+        super().__init__(StorageType.storageHTTP, handler.logger,
+                         concurrency=concurrency)
+
+    async def upload_file(self, key, local_path) -> bool:
+        session = _get_session(self.concurrency)
+        with open(local_path, 'rb') as data:
+            async with session.put(self.url, data=data) as response:
+                if response.status != 200:
+                    self.logger.error(
+                        'Upload {0} to {1}: Response error {2}:{3}.'
+                        .format(local_path, self.url,
+                                response.status, response.reason))
+                    return False
+        return True
+
+    async def download_file(self, key, local_path) -> bool:
+        session = _get_session(self.concurrency)
+        async with session.get(self.url) as response:
+            if response.status != 200:
+                self.logger.error(
+                    'Download {0} from {1}: Response error with code {2}.'
+                    .format(local_path, self.url, response.status))
+                return False
+            head = os.path.dirname(local_path)
+            if head:
+                os.makedirs(head, exist_ok=True)
+            tmp_path = local_path + '.' + str(uuid.uuid4()) + '.tmp'
+            try:
+                with open(tmp_path, 'wb') as f_out:
+                    async for chunk in response.content.iter_chunked(
+                            DOWNLOAD_BUFFER_SIZE):
+                        f_out.write(chunk)
+                os.replace(tmp_path, local_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return True
+
+    async def get_file_timestamp(self, key):
+        return self.handler.timestamp
@@ -0,0 +1,163 @@
+"""
+    Native async S3 handler on top of aiobotocore (optional package).
+    All requests share one client with pool of max_pool_connections
+    keep-alive connections, so thousands of small requests
+    do not need thousands of threads or TCP handshakes.
+"""
+
+import asyncio
+import calendar
+import os
+import uuid
+from typing import List
+
+import botocore
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import AioSession
+except ImportError:
+    AioSession = None
+
+from studio.storage.async_storage_handler import AsyncStorageHandler, \
+    DEFAULT_CONCURRENCY
+from studio.storage.storage_type import StorageType
+
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+
+
+def is_available() -> bool:
+    return AioSession is not None
+
+
+# AsyncS3StorageHandler mirrors endpoint, bucket and credentials
+# of existing S3StorageHandler and keeps its metadata cache coherent.
+# Objects above multipart threshold are uploaded by blocking handler
+# in default executor, which does multipart transfers.
+class AsyncS3StorageHandler(AsyncStorageHandler):
+    def __init__(self, handler, concurrency: int = DEFAULT_CONCURRENCY):
+        if AioSession is None:
+            raise ImportError('aiobotocore is required for async S3 storage')
+        self.handler = handler
+        self.bucket = handler.bucket
+        self._client = None
+        self._client_context = None
+        self._client_lock = None
+        super().__init__(StorageType.storageS3, handler.logger,
+                         concurrency=concurrency)
+
+    async def _get_client(self):
+        if self._client_lock is None:
+            self._client_lock = asyncio.Lock()
+        async with self._client_lock:
+            if self._client is None:
+                credentials = self.handler.credentials
+                aws_key = credentials.get_key()
+                aws_secret_key = credentials.get_secret_key()
+                profile_name = credentials.get_profile()
+                if profile_name is not None:
+                    aws_key = None
+                    aws_secret_key = None
+                session = AioSession(profile=profile_name)
+                meta = self.handler.client.meta
+                self._client_context = session.create_client(
+                    's3',
+                    region_name=meta.region_name,
+                    endpoint_url=meta.endpoint_url,
+                    aws_access_key_id=aws_key,
+                    aws_secret_access_key=aws_secret_key,
+                    config=AioConfig(signature_version='s3v4',
+                                     max_pool_connections=self.concurrency))
+                self._client = await self._client_context.__aenter__()
+            return self._client
+
+    def _not_found(self, exc) -> bool:
+        try:
+            return exc.response['Error']['Code'] in ('404', 'NoSuchKey')
+        except Exception:
+            return False
+
+    async def upload_file(self, key, local_path) -> bool:
+        if not os.path.exists(local_path):
+            self.logger.debug(
+                "Local path {0} does not exist. SKIPPING upload to {1}/{2}"
+                .format(local_path, self.bucket, key))
+            return False
+        if os.path.getsize(local_path) >= self.handler.multipart_threshold:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                None, self.handler.upload_file, key, local_path)
+        self.handler._invalidate_metadata(key)
+        client = await self._get_client()
+        with open(local_path, 'rb') as data:
+            await client.put_object(Bucket=self.bucket, Key=key, Body=data)
+        return True
+
+    async def download_file(self, key, local_path) -> bool:
+        client = await self._get_client()
+        try:
+            response = await client.get_object(Bucket=self.bucket, Key=key)
+        except botocore.exceptions.ClientError as exc:
+            if not self._not_found(exc):
+                raise exc
+            self.logger.debug(
+                "No key found: {0}/{1}. SKIPPING download to {2}"
+                .format(self.bucket, key, local_path))
+            return False
+
+        head = os.path.dirname(local_path)
+        if head:
+            os.makedirs(head, exist_ok=True)
+        tmp_path = local_path + '.' + str(uuid.uuid4()) + '.tmp'
+        try:
+            async with response['Body'] as stream:
+                with open(tmp_path, 'wb') as f_out:
+                    while True:
+                        chunk = await stream.read(DOWNLOAD_BUFFER_SIZE)
+                        if not chunk:
+                            break
+                        f_out.write(chunk)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return True
+
+    async def get_file_timestamp(self, key):
+        client = await self._get_client()
+        try:
+            obj = await client.head_object(Bucket=self.bucket, Key=key)
+        except botocore.exceptions.ClientError as exc:
+            if self._not_found(exc):
+                self.logger.debug(
+                    "No key found: {0}/{1}. Cannot get timestamp."
+                    .format(self.bucket, key))
+            else:
+                self.logger.error(
+                    "FAILED to get timestamp for S3 object {0}/{1}: {2}"
+                    .format(self.bucket, key, exc))
+            return None
+        time_updated = obj.get('LastModified', None)
+        if time_updated:
+            return calendar.timegm(time_updated.timetuple())
+        return None
+
+    async def delete_file(self, key):
+        self.handler._invalidate_metadata(key)
+        client = await self._get_client()
+        await client.delete_object(Bucket=self.bucket, Key=key)
+
+    async def list_files(self, prefix: str) -> List[str]:
+        client = await self._get_client()
+        paginator = client.get_paginator('list_objects_v2')
+        result = []
+        async for page in paginator.paginate(Bucket=self.bucket,
+                                             Prefix=prefix):
+            result.extend(item['Key'] for item in page.get('Contents', []))
+        return result
+
+    async def close(self):
+        if self._client_context is not None:
+            context, self._client_context = self._client_context, None
+            self._client = None
+            await context.__aexit__(None, None, None)
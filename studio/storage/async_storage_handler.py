@@ -0,0 +1,167 @@
+"""
+    Asynchronous counterpart of StorageHandler interface
+    for basic storage operations: upload, download, timestamp,
+    delete and list. Many requests (thousands of small metadata
+    lookups or object transfers) can then be in flight at once
+    on a single event loop instead of one thread per request.
+    Blocking code drives async handlers on shared background loop
+    through run_sync().
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from studio.storage.storage_type import StorageType
+
+# Default limit of concurrent requests issued by one handler:
+DEFAULT_CONCURRENCY = 256
+# Default size of thread pool of ThreadedAsyncStorageHandler:
+DEFAULT_THREADS = 16
+
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Shared event loop running in background daemon thread,
+    created on first use.
+    """
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever,
+                                            name='AsyncStorageLoop',
+                                            daemon=True)
+            _loop_thread.start()
+        return _loop
+
+
+def run_sync(coro, timeout: float = None):
+    """
+    Run coroutine on shared event loop and wait for its result.
+    Must not be called from the loop thread itself.
+    """
+    loop = get_event_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError('run_sync() called from async storage loop')
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+
+async def gather_limited(coros, limit: int = DEFAULT_CONCURRENCY):
+    """
+    Await all coroutines with at most limit of them running at once,
+    results are returned in order.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def _run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[_run(coro) for coro in coros])
+
+
+# AsyncStorageHandler is asyncio version of StorageHandler
+# for specific storage endpoint. Implementations keep their
+# network connections pooled, so handler instance should be shared
+# by all requests made on its event loop.
+class AsyncStorageHandler:
+    def __init__(self, storage_type: StorageType, logger,
+                 concurrency: int = DEFAULT_CONCURRENCY):
+        self.type = storage_type
+        self.logger = logger
+        self.concurrency = max(1, int(concurrency))
+
+    async def upload_file(self, key, local_path) -> bool:
+        raise NotImplementedError("Not implemented: upload_file")
+
+    async def download_file(self, key, local_path) -> bool:
+        raise NotImplementedError("Not implemented: download_file")
+
+    async def get_file_timestamp(self, key):
+        raise NotImplementedError("Not implemented: get_file_timestamp")
+
+    async def delete_file(self, key):
+        raise NotImplementedError("Not implemented: delete_file")
+
+    async def list_files(self, prefix: str) -> List[str]:
+        raise NotImplementedError("Not implemented: list_files")
+
+    async def get_file_timestamps(self, keys: List[str]) -> Dict:
+        keys = list(keys)
+        timestamps = await gather_limited(
+            [self.get_file_timestamp(key) for key in keys],
+            self.concurrency)
+        return dict(zip(keys, timestamps))
+
+    async def upload_files(self, items) -> List[bool]:
+        """Upload (key, local_path) pairs concurrently."""
+        return await gather_limited(
+            [self.upload_file(key, local_path) for key, local_path in items],
+            self.concurrency)
+
+    async def download_files(self, items) -> List[bool]:
+        """Download (key, local_path) pairs concurrently."""
+        return await gather_limited(
+            [self.download_file(key, local_path)
+             for key, local_path in items],
+            self.concurrency)
+
+    async def delete_files(self, keys: List[str]):
+        await gather_limited([self.delete_file(key) for key in keys],
+                             self.concurrency)
+
+    async def close(self):
+        pass
+
+
+# ThreadedAsyncStorageHandler exposes any blocking StorageHandler
+# through async interface by running its calls in a thread pool.
+# Used for storage types without native async implementation,
+# or when packages needed for native implementation are not installed.
+class ThreadedAsyncStorageHandler(AsyncStorageHandler):
+    def __init__(self, handler, max_workers: int = DEFAULT_THREADS):
+        self.handler = handler
+        self.max_workers = max(1, int(max_workers))
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        super().__init__(handler.type, handler.logger,
+                         concurrency=self.max_workers)
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+            return self._executor
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    async def upload_file(self, key, local_path) -> bool:
+        return await self._call(self.handler.upload_file, key, local_path)
+
+    async def download_file(self, key, local_path) -> bool:
+        return await self._call(self.handler.download_file, key, local_path)
+
+    async def get_file_timestamp(self, key):
+        return await self._call(self.handler.get_file_timestamp, key)
+
+    async def delete_file(self, key):
+        return await self._call(self.handler.delete_file, key)
+
+    async def list_files(self, prefix: str) -> List[str]:
+        return await self._call(self.handler.list_files, prefix)
+
+    async def close(self):
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
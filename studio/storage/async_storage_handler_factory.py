@@ -0,0 +1,25 @@
+from studio.storage import async_http_storage_handler, \
+    async_s3_storage_handler
+from studio.storage.async_http_storage_handler import AsyncHTTPStorageHandler
+from studio.storage.async_s3_storage_handler import AsyncS3StorageHandler
+from studio.storage.async_storage_handler import AsyncStorageHandler, \
+    ThreadedAsyncStorageHandler, DEFAULT_CONCURRENCY, DEFAULT_THREADS
+from studio.storage.storage_type import StorageType
+
+
+def get_async_handler(handler,
+                      concurrency: int = DEFAULT_CONCURRENCY,
+                      threads: int = DEFAULT_THREADS) -> AsyncStorageHandler:
+    """
+    Async handler for the same endpoint as blocking handler:
+    native one, if there is an implementation for handler's storage type
+    and packages it needs are installed; otherwise handler's calls
+    are run in a pool of threads.
+    """
+    if handler.type == StorageType.storageS3 and \
+            async_s3_storage_handler.is_available():
+        return AsyncS3StorageHandler(handler, concurrency=concurrency)
+    if handler.type == StorageType.storageHTTP and \
+            async_http_storage_handler.is_available():
+        return AsyncHTTPStorageHandler(handler, concurrency=concurrency)
+    return ThreadedAsyncStorageHandler(handler, max_workers=threads)
@@ -0,0 +1,218 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from studio.artifacts import artifacts_tracker
+from studio.storage import chunker
+from studio.storage.storage_setup import get_storage_verbose_level
+from studio.storage.storage_handler import StorageHandler
+from studio.util import logs
+from studio.util import util
+
+MANIFEST_FORMAT = 'studioml-chunked-manifest'
+MANIFEST_VERSION = 1
+CHUNKS_KEYBASE = 'chunks/'
+
+
+# ChunkedStorageHandler wraps another StorageHandler
+# and stores each uploaded file as a set of content-defined chunks
+# (under "chunks/<sha256>") plus a small json manifest under the file key.
+# Chunks are shared between all artifacts in the store,
+# so only chunks that the store lacks are uploaded,
+# and only chunks missing in local chunk cache are downloaded.
+class ChunkedStorageHandler(StorageHandler):
+    def __init__(self, base_handler: StorageHandler, config: Dict):
+        self.logger = logs.get_logger(self.__class__.__name__)
+        self.logger.setLevel(get_storage_verbose_level())
+
+        self.base_handler = base_handler
+        self.chunk_size = int(config.get('chunk_size',
+                                         chunker.DEFAULT_CHUNK_SIZE))
+        self.max_workers = int(config.get('chunk_workers', 8))
+        # Chunks known to be present in the store:
+        self._known_chunks = set()
+
+        super().__init__(
+            base_handler.type,
+            self.logger,
+            False,
+            compression=base_handler.get_compression(),
+            compression_threads=base_handler.get_compression_threads())
+
+    @classmethod
+    def get_id(cls, config: Dict) -> str:
+        return None
+
+    @classmethod
+    def get_wrapped_id(cls, base_id: str) -> str:
+        if base_id is None:
+            return None
+        return '[chunked]{0}'.format(base_id)
+
+    def _get_chunk_key(self, chunk_hash: str) -> str:
+        return CHUNKS_KEYBASE + chunk_hash
+
+    def _has_chunk(self, chunk_hash: str) -> bool:
+        if chunk_hash in self._known_chunks:
+            return True
+        timestamp = self.base_handler.get_cached_file_timestamp(
+            self._get_chunk_key(chunk_hash))
+        if timestamp is not None:
+            self._known_chunks.add(chunk_hash)
+            return True
+        return False
+
+    def _upload_chunk(self, local_path: str, offset: int, length: int):
+        with open(local_path, 'rb') as src:
+            src.seek(offset)
+            data = src.read(length)
+        chunk_hash = chunker.chunk_hash(data)
+        if self._has_chunk(chunk_hash):
+            return chunk_hash, length, False
+
+        chunk_file = util.get_temp_filename()
+        try:
+            with open(chunk_file, 'wb') as dst:
+                dst.write(data)
+            self.base_handler.upload_file(
+                self._get_chunk_key(chunk_hash), chunk_file)
+        finally:
+            if os.path.exists(chunk_file):
+                os.remove(chunk_file)
+        self._known_chunks.add(chunk_hash)
+        return chunk_hash, length, True
+
+    def upload_file(self, key, local_path):
+        if not os.path.exists(local_path):
+            self.logger.debug(
+                "Local path {0} does not exist. SKIPPING upload to {1}"
+                .format(local_path, key))
+            return False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            workers = [executor.submit(self._upload_chunk,
+                                       local_path, offset, length)
+                       for offset, length in
+                       chunker.iter_chunks(local_path, self.chunk_size)]
+            chunks = [worker.result() for worker in workers]
+
+        uploaded = [c for c in chunks if c[2]]
+        self.logger.debug(
+            "Chunked upload of %s to %s: %d chunks, %d uploaded (%d bytes)",
+            local_path, key, len(chunks), len(uploaded),
+            sum(c[1] for c in uploaded))
+
+        manifest = {
+            'format': MANIFEST_FORMAT,
+            'version': MANIFEST_VERSION,
+            'size': sum(c[1] for c in chunks),
+            'chunks': [[c[0], c[1]] for c in chunks]
+        }
+        manifest_file = util.get_temp_filename()
+        try:
+            with open(manifest_file, 'w') as f_out:
+                json.dump(manifest, f_out)
+            return self.base_handler.upload_file(key, manifest_file)
+        finally:
+            os.remove(manifest_file)
+
+    def _read_manifest(self, file_path: str):
+        with open(file_path, 'rb') as f_in:
+            head = f_in.read(64)
+        if MANIFEST_FORMAT.encode() not in head:
+            return None
+        with open(file_path, 'r') as f_in:
+            return json.load(f_in)
+
+    def _fetch_chunk(self, chunk_hash: str):
+        cache_path = artifacts_tracker.get_chunk_cache(chunk_hash)
+        if os.path.exists(cache_path):
+            return False
+        temp_path = cache_path + '.' + os.path.basename(
+            util.get_temp_filename())
+        if not self.base_handler.download_file(
+                self._get_chunk_key(chunk_hash), temp_path):
+            self._report_fatal("FAILED to download chunk {0}"
+                               .format(chunk_hash))
+        if util.sha256_checksum(temp_path) != chunk_hash:
+            os.remove(temp_path)
+            self._report_fatal("Checksum mismatch for chunk {0}"
+                               .format(chunk_hash))
+        os.replace(temp_path, cache_path)
+        return True
+
+    def download_file(self, key, local_path):
+        manifest_file = util.get_temp_filename()
+        if not self.base_handler.download_file(key, manifest_file):
+            return False
+
+        manifest = self._read_manifest(manifest_file)
+        if manifest is None:
+            # Object was stored without chunking,
+            # so we already have its full content:
+            self.logger.debug("Key %s is not chunked, using it as is", key)
+            head, _ = os.path.split(local_path)
+            if head:
+                os.makedirs(head, exist_ok=True)
+            os.replace(manifest_file, local_path)
+            return True
+        os.remove(manifest_file)
+
+        chunk_hashes = [c[0] for c in manifest['chunks']]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            fetched = list(executor.map(self._fetch_chunk,
+                                        set(chunk_hashes)))
+        self.logger.debug(
+            "Chunked download of %s: %d chunks, %d fetched from store",
+            key, len(chunk_hashes), sum(fetched))
+
+        head, _ = os.path.split(local_path)
+        if head:
+            os.makedirs(head, exist_ok=True)
+        with open(local_path, 'wb') as f_out:
+            for chunk_hash in chunk_hashes:
+                with open(artifacts_tracker.get_chunk_cache(chunk_hash),
+                          'rb') as f_in:
+                    f_out.write(f_in.read())
+        return True
+
+    def download_remote_path(self, remote_path, local_path):
+        return self.base_handler.download_remote_path(remote_path, local_path)
+
+    def delete_file(self, key, shallow=True):
+        # Chunks can be shared with other artifacts,
+        # so only the manifest is removed here.
+        self.base_handler.delete_file(key, shallow=shallow)
+
+    def rename_file(self, from_key, to_key):
+        # Chunks are content-addressed already,
+        # so renaming the manifest is enough.
+        self.base_handler.rename_file(from_key, to_key)
+
+    def get_file_url(self, key, method='GET'):
+        if method == 'GET':
+            # There is no single object with file content to point to.
+            return None
+        return self.base_handler.get_file_url(key, method=method)
+
+    def get_file_timestamp(self, key):
+        return self.base_handler.get_file_timestamp(key)
+
+    def get_file_timestamps(self, keys):
+        return self.base_handler.get_file_timestamps(keys)
+
+    def get_qualified_location(self, key):
+        return self.base_handler.get_qualified_location(key)
+
+    def get_local_destination(self, remote_path: str):
+        return self.base_handler.get_local_destination(remote_path)
+
+    def get_timestamp_shift(self):
+        return self.base_handler.get_timestamp_shift()
+
+    def cleanup(self):
+        self.base_handler.cleanup()
+
+    def _report_fatal(self, msg: str):
+        util.report_fatal(msg, self.logger)
@@ -0,0 +1,99 @@
+"""
+    Content-defined chunking of artifact files.
+    Chunk boundaries are chosen by a gear rolling hash
+    over a 32-byte window, so inserting or removing data
+    in a file only changes the chunks around the edit,
+    and unchanged regions map to the same chunks
+    across checkpoints and experiments.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+WINDOW_SIZE = 32
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+
+def _build_gear_table():
+    # Gear table has to be identical on every machine,
+    # so derive it from a fixed hash instead of a random seed:
+    table = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], 'little')
+             for i in range(256)]
+    return np.array(table, dtype=np.uint32)
+
+
+_GEAR = _build_gear_table()
+
+
+def get_chunk_limits(avg_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Returns (min_size, avg_size, max_size, mask) for given
+    average chunk size, which is rounded down to a power of 2.
+    """
+    bits = max(int(avg_size).bit_length() - 1, 8)
+    avg_size = 1 << bits
+    mask = ((1 << bits) - 1) << (WINDOW_SIZE - bits)
+    return avg_size // 4, avg_size, avg_size * 4, np.uint32(mask)
+
+
+def _gear_hashes(data: np.ndarray) -> np.ndarray:
+    # h[i] = sum(GEAR[data[i-k]] << k) for k in [0, WINDOW_SIZE),
+    # which is exactly the value of rolling gear hash at position i,
+    # but computed by doubling the window at each step
+    # (log2(WINDOW_SIZE) vector operations)
+    # instead of a per-byte python loop.
+    hashes = _GEAR[data]
+    width = 1
+    while width < WINDOW_SIZE:
+        shifted = hashes[:len(hashes) - width] << np.uint32(width)
+        hashes[width:] += shifted
+        width *= 2
+    return hashes
+
+
+def iter_chunks(file_path: str, avg_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Generator of (offset, length) pairs covering file_path
+    with content-defined chunks.
+    """
+    total_size = os.path.getsize(file_path)
+    if total_size == 0:
+        return
+
+    min_size, _, max_size, mask = get_chunk_limits(avg_size)
+    segment_size = max(SEGMENT_SIZE, 2 * max_size)
+    data = np.memmap(file_path, dtype=np.uint8, mode='r')
+
+    start = 0
+    while start < total_size:
+        seg_end = min(total_size, start + segment_size)
+        context_start = max(0, start + min_size - WINDOW_SIZE)
+        if context_start >= seg_end:
+            yield start, total_size - start
+            return
+
+        hashes = _gear_hashes(np.asarray(data[context_start:seg_end]))
+        # Cut is placed right after byte with matching hash:
+        cuts = np.flatnonzero((hashes & mask) == 0) + context_start + 1
+
+        while start < total_size:
+            lower = start + min_size
+            upper = start + max_size
+            if upper > seg_end and seg_end < total_size:
+                # Need next data segment to decide on this chunk.
+                break
+
+            idx = np.searchsorted(cuts, lower)
+            if idx < len(cuts) and cuts[idx] <= upper:
+                cut = int(cuts[idx])
+            else:
+                cut = min(upper, total_size)
+            yield start, cut - start
+            start = cut
+
+
+def chunk_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
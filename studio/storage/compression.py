@@ -0,0 +1,359 @@
+"""
+    Compression codecs for artifact tarballs.
+    Each codec knows how to wrap a file object for streaming
+    compression/decompression and how to compress a standalone block.
+    All supported formats allow concatenation of independently
+    compressed frames, which is used by block-parallel compression.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from studio.storage.ignore_matcher import get_ignore_matcher, walk_files
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+PARALLEL_BLOCK_SIZE = 4 * 1024 * 1024
+# Enough for magic bytes of any codec,
+# and for header of the first member of plain tarball:
+MAGIC_SIZE = tarfile.BLOCKSIZE
+
+# File extensions of content which is already compressed,
+# so compressing it again only burns CPU:
+COMPRESSED_EXTENSIONS = {
+    '.gz', '.tgz', '.bz2', '.xz', '.lzma', '.zst', '.lz4', '.zip', '.7z',
+    '.rar', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4',
+    '.avi', '.mkv', '.h5', '.hdf5', '.npz'
+}
+
+
+class Codec:
+    """Compression codec for artifact tarballs."""
+
+    def __init__(self, name, extension, magic, available=True):
+        self.name = name
+        self.extension = extension
+        self.magic = magic
+        self.available = available
+
+    def open_writer(self, fileobj, level=None):
+        raise NotImplementedError("Not implemented: open_writer")
+
+    def open_reader(self, fileobj):
+        raise NotImplementedError("Not implemented: open_reader")
+
+    def compress_block(self, data: bytes, level=None) -> bytes:
+        raise NotImplementedError("Not implemented: compress_block")
+
+
+class _NoCompressionWriter:
+    """Pass-through writer which does not close underlying file."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def write(self, data):
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        self.flush()
+
+
+class NoneCodec(Codec):
+    def __init__(self):
+        super().__init__('none', '', None)
+
+    def open_writer(self, fileobj, level=None):
+        return _NoCompressionWriter(fileobj)
+
+    def open_reader(self, fileobj):
+        return fileobj
+
+    def compress_block(self, data: bytes, level=None) -> bytes:
+        return data
+
+
+class GzipCodec(Codec):
+    def __init__(self):
+        super().__init__('gzip', '.gz', b'\x1f\x8b')
+
+    def open_writer(self, fileobj, level=None):
+        # mtime=0 keeps output deterministic, so equal content
+        # produces equal blob hash.
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', mtime=0,
+                             compresslevel=level if level else 6)
+
+    def open_reader(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+    def compress_block(self, data: bytes, level=None) -> bytes:
+        return gzip.compress(data, compresslevel=level if level else 6,
+                             mtime=0)
+
+
+class Bzip2Codec(Codec):
+    def __init__(self):
+        super().__init__('bzip2', '.bz2', b'BZh')
+
+    def open_writer(self, fileobj, level=None):
+        return bz2.BZ2File(fileobj, mode='wb',
+                           compresslevel=level if level else 9)
+
+    def open_reader(self, fileobj):
+        return bz2.BZ2File(fileobj, mode='rb')
+
+    def compress_block(self, data: bytes, level=None) -> bytes:
+        return bz2.compress(data, compresslevel=level if level else 9)
+
+
+class XzCodec(Codec):
+    def __init__(self):
+        super().__init__('xz', '.xz', b'\xfd7zXZ\x00')
+        self.format = lzma.FORMAT_XZ
+
+    def open_writer(self, fileobj, level=None):
+        return lzma.LZMAFile(fileobj, mode='wb',
+                             format=self.format, preset=level)
+
+    def open_reader(self, fileobj):
+        return lzma.LZMAFile(fileobj, mode='rb')
+
+    def compress_block(self, data: bytes, level=None) -> bytes:
+        return lzma.compress(data, format=self.format, preset=level)
+
+
+class LzmaCodec(XzCodec):
+    def __init__(self):
+        super().__init__()
+        self.name = 'lzma'
+        self.extension = '.lzma'
+        self.magic = b'\x5d\x00\x00'
+        self.format = lzma.FORMAT_ALONE
+
+
+class ZstdCodec(Codec):
+    def __init__(self):
+        super().__init__('zstd', '.zst', b'\x28\xb5\x2f\xfd',
+                         available=zstandard is not None)
+
+    def open_writer(self, fileobj, level=None):
+        compressor = zstandard.ZstdCompressor(level=level if level else 3)
+        return compressor.stream_writer(fileobj, closefd=False)
+
+    def open_reader(self, fileobj):
+        return zstandard.ZstdDecompressor().stream_reader(
+            fileobj, read_across_frames=True, closefd=False)
+
+    def compress_block(self, data: bytes, level=None) -> bytes:
+        compressor = zstandard.ZstdCompressor(level=level if level else 3)
+        return compressor.compress(data)
+
+
+class Lz4Codec(Codec):
+    def __init__(self):
+        super().__init__('lz4', '.lz4', b'\x04\x22\x4d\x18',
+                         available=lz4frame is not None)
+
+    def open_writer(self, fileobj, level=None):
+        return lz4frame.LZ4FrameFile(fileobj, mode='wb',
+                                     compression_level=level if level else 0)
+
+    def open_reader(self, fileobj):
+        return lz4frame.LZ4FrameFile(fileobj, mode='rb')
+
+    def compress_block(self, data: bytes, level=None) -> bytes:
+        return lz4frame.compress(data,
+                                 compression_level=level if level else 0)
+
+
+_CODECS = {codec.name: codec for codec in [
+    NoneCodec(),
+    GzipCodec(),
+    Bzip2Codec(),
+    XzCodec(),
+    LzmaCodec(),
+    ZstdCodec(),
+    Lz4Codec()
+]}
+
+
+def get_codec(compression) -> Codec:
+    name = compression.lower() if compression else 'none'
+    codec = _CODECS.get(name, None)
+    if codec is None:
+        raise ValueError('Unknown compression method {0}'.format(compression))
+    if not codec.available:
+        raise ValueError('Compression method {0} is not available: '
+                         'python package for it is not installed'
+                         .format(compression))
+    return codec
+
+
+def get_available_codecs():
+    return [name for name, codec in _CODECS.items() if codec.available]
+
+
+def detect_codec(head: bytes, key: str = None) -> Codec:
+    """
+    Determine codec of stored tarball from its first bytes:
+    codec named by key extension is preferred, but it has to be
+    confirmed by magic bytes, since content may have been stored
+    uncompressed by compression policy.
+    Plain tarball starts with the name of its first member,
+    which may look like any magic, so content under key without
+    compressed extension (named artifacts are stored compressed
+    under .tar keys) is sniffed only if it is not a tar header.
+    """
+    compressed = False
+    if key:
+        for codec in _CODECS.values():
+            if codec.extension and key.endswith('.tar' + codec.extension):
+                if head.startswith(codec.magic):
+                    return get_codec(codec.name)
+                compressed = True
+
+    if not compressed and _is_tar_header(head):
+        return get_codec('none')
+    for codec in _CODECS.values():
+        if codec.magic and head.startswith(codec.magic):
+            return get_codec(codec.name)
+    return get_codec('none')
+
+
+def _is_tar_header(head: bytes) -> bool:
+    # Checksum of header block is the sum of its bytes,
+    # with checksum field itself counted as spaces:
+    if len(head) < tarfile.BLOCKSIZE:
+        return False
+    block = head[:tarfile.BLOCKSIZE]
+    try:
+        checksum = int(block[148:156].strip(b' \x00') or b'-1', 8)
+    except ValueError:
+        return False
+    return checksum == sum(block[:148]) + 8 * ord(' ') + sum(block[156:])
+
+
+def choose_compression(local_path: str, compression):
+    """
+    Per-artifact compression policy: skip compression
+    if most of artifact content (by size) is compressed already.
+    """
+    if compression is None or compression.lower() == 'none':
+        return 'none'
+
+    compressed_size = 0
+    total_size = 0
+    if os.path.isdir(local_path):
+        for _, entry in walk_files(local_path,
+                                   get_ignore_matcher(local_path)):
+            try:
+                size = entry.stat().st_size
+            except OSError:
+                continue
+            total_size += size
+            if _is_compressed_file(entry.name):
+                compressed_size += size
+    elif _is_compressed_file(local_path):
+        return 'none'
+
+    if total_size > 0 and compressed_size * 2 >= total_size:
+        return 'none'
+    return compression
+
+
+def _is_compressed_file(file_name: str) -> bool:
+    _, extension = os.path.splitext(file_name.lower())
+    return extension in COMPRESSED_EXTENSIONS
+
+
+class ParallelBlockWriter:
+    """
+    Writer which splits the stream into fixed size blocks,
+    compresses them independently in a thread pool
+    and writes resulting frames in order.
+    Number of blocks in flight is bounded to limit memory use.
+    """
+
+    def __init__(self, codec: Codec, fileobj, threads: int, level=None,
+                 block_size: int = PARALLEL_BLOCK_SIZE):
+        self.codec = codec
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self.max_pending = 2 * threads
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+
+    def _submit(self, data: bytes):
+        self.pending.append(
+            self.executor.submit(self.codec.compress_block, data, self.level))
+        while len(self.pending) > self.max_pending:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        try:
+            if self.buffer:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+            self.fileobj.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+def open_compressed_writer(fileobj, compression, threads: int = 1,
+                           level=None):
+    """
+    Wrap fileobj into compressing writer.
+    threads=0 means using all available cores.
+    Closing returned writer does not close fileobj.
+    """
+    codec = get_codec(compression)
+    if threads is None:
+        threads = 1
+    threads = int(threads)
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+    if codec.name != 'none' and threads > 1:
+        return ParallelBlockWriter(codec, fileobj, threads, level=level)
+    return codec.open_writer(fileobj, level=level)
+
+
+def open_decompressed_reader(fileobj, key: str = None):
+    """
+    Wrap readable fileobj with stored tarball
+    into reader of decompressed tar stream.
+    """
+    if not hasattr(fileobj, 'peek'):
+        fileobj = io.BufferedReader(fileobj)
+    head = fileobj.peek(MAGIC_SIZE)[:MAGIC_SIZE]
+    return detect_codec(head, key).open_reader(fileobj)
@@ -0,0 +1,70 @@
+"""
+    Benchmark of artifact compression codecs.
+    Usage: python -m studio.storage.compression_benchmark <path> [<path> ...]
+    For each path (directory or file) and each codec,
+    tars and compresses the artifact in memory and reports
+    throughput (MB/s of uncompressed tar) and compression ratio.
+"""
+
+import argparse
+import sys
+import time
+
+from terminaltables import AsciiTable
+
+from studio.storage import compression
+from studio.storage.storage_util import HashingWriter, tar_artifact_to_stream
+from studio.util import logs
+
+MB = 1024.0 * 1024.0
+
+
+def _measure(local_path: str, codec: str, threads: int, logger):
+    raw = HashingWriter()
+    tar_artifact_to_stream(local_path, None, None, raw, logger, cache=False)
+
+    sink = HashingWriter()
+    tic = time.time()
+    tar_artifact_to_stream(local_path, None, codec, sink, logger,
+                           cache=False, threads=threads)
+    elapsed = max(time.time() - tic, 1e-6)
+    return raw.size, sink.size, elapsed
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description='Benchmark artifact compression codecs.')
+    parser.add_argument('paths', nargs='+',
+                        help='artifact directories or files')
+    parser.add_argument('--codecs', default=None,
+                        help='comma-separated list of codecs ' +
+                        '(default: all available)')
+    parser.add_argument('--threads', default='1',
+                        help='comma-separated list of thread counts, ' +
+                        '0 means all cores (default: 1)')
+    parsed_args = parser.parse_args(args)
+
+    logger = logs.get_logger('compression_benchmark')
+    codecs = parsed_args.codecs.split(',') if parsed_args.codecs \
+        else compression.get_available_codecs()
+    threads_list = [int(t) for t in parsed_args.threads.split(',')]
+
+    table = [['Artifact', 'Codec', 'Threads', 'Size, MB',
+              'Compressed, MB', 'Ratio', 'MB/s']]
+    for local_path in parsed_args.paths:
+        for codec in codecs:
+            for threads in threads_list:
+                raw_size, size, elapsed = \
+                    _measure(local_path, codec, threads, logger)
+                table.append([
+                    local_path, codec, threads,
+                    '{0:.1f}'.format(raw_size / MB),
+                    '{0:.1f}'.format(size / MB),
+                    '{0:.2f}'.format(raw_size / max(size, 1)),
+                    '{0:.1f}'.format(raw_size / MB / elapsed)])
+
+    print(AsciiTable(table).table)
+
+
+if __name__ == '__main__':
+    main()
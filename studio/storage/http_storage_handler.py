@@ -7,11 +7,29 @@ from studio.storage.storage_setup import get_storage_verbose_level
 from studio.storage.storage_type import StorageType
 from studio.storage.storage_handler import StorageHandler
 from studio.storage import storage_util
+from studio.util import util
+
+# Defaults from "http" section of studio config:
+_http_config = dict()
+
+
+def setup_http_config(config: Dict):
+    """
+    Configure HTTP transfers from "http" section of studio config:
+        http:
+            pool_size: 16
+            download_retries: 5
+            buffer_size: 1m
+    """
+    global _http_config
+    _http_config = dict(config) if config else dict()
+
 
 class HTTPStorageHandler(StorageHandler):
     def __init__(self, remote_path, credentials_dict,
                  timestamp=None,
-                 compression=None):
+                 compression=None,
+                 config: Dict = None):
 
         self.logger = logs.get_logger(self.__class__.__name__)
         self.logger.setLevel(get_storage_verbose_level())
@@ -25,22 +43,55 @@ class HTTPStorageHandler(StorageHandler):
         self.path = parsed_url.path
         self.credentials = Credentials(credentials_dict)
 
+        settings = dict(_http_config)
+        settings.update(config if config else dict())
+        config = settings
+        # Keep-alive connections to the same host are pooled
+        # and shared by all HTTP handlers with the same pool size:
+        self.session = storage_util.get_http_session(
+            int(config.get('pool_size', storage_util.HTTP_POOL_SIZE)))
+        self.download_retries = int(config.get(
+            'download_retries', storage_util.HTTP_DOWNLOAD_RETRIES))
+        self.buffer_size = util.str2size(config.get(
+            'buffer_size', storage_util.HTTP_BUFFER_SIZE))
+        self.stats = storage_util.TransferStats()
+
         super().__init__(StorageType.storageHTTP,
             self.logger,
             False,
             compression=compression)
 
     def upload_file(self, key, local_path):
-        storage_util.upload_file(self.url, local_path, self.logger)
+        storage_util.upload_file(self.url, local_path, self.logger,
+                                 session=self.session, stats=self.stats)
 
     def download_file(self, key, local_path):
-        return storage_util.download_file(self.url, local_path, self.logger)
+        return self._download(self.url, local_path)
 
     def download_remote_path(self, remote_path, local_path):
         head, _ = os.path.split(local_path)
         if head is not None:
             os.makedirs(head, exist_ok=True)
-        return storage_util.download_file(remote_path, local_path, self.logger)
+        return self._download(remote_path, local_path)
+
+    def _download(self, url, local_path):
+        return storage_util.download_file(
+            url, local_path, self.logger,
+            session=self.session,
+            retries=self.download_retries,
+            buffer_size=self.buffer_size,
+            stats=self.stats)
+
+    def read_range(self, key, start: int, length: int = None):
+        return storage_util.download_range(self.url, start, length,
+                                           self.logger, session=self.session)
+
+    def get_transfer_stats(self) -> Dict:
+        """
+        Bytes, time, throughput (bytes/s) and number of transfers
+        done by this handler, with counts of resumed downloads and retries.
+        """
+        return self.stats.to_dict()
 
     @classmethod
     def get_id(cls, config: Dict) -> str:
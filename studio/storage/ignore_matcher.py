@@ -0,0 +1,199 @@
+"""
+    Matcher for gitignore-style patterns from .studioml_ignore file
+    in artifact directory. Patterns are compiled to regular expressions
+    once per ignore file (and its modification time) and shared by
+    everything that walks the artifact: tarring, hashing,
+    compression policy and incremental checkpoints.
+"""
+
+import os
+import re
+import threading
+
+IGNORE_FILE_NAME = '.studioml_ignore'
+
+_matchers_cache = dict()
+_matchers_lock = threading.Lock()
+
+
+def _translate(pattern: str) -> str:
+    """Translate gitignore glob (without flags) into regex body."""
+    result = []
+    i = 0
+    length = len(pattern)
+    while i < length:
+        char = pattern[i]
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            # Zero or more leading directories:
+            result.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i) and i + 2 == length and \
+                (i == 0 or pattern[i - 1] == '/'):
+            # Everything inside:
+            result.append('.*')
+            i += 2
+        elif char == '*':
+            result.append('[^/]*')
+            i += 1
+        elif char == '?':
+            result.append('[^/]')
+            i += 1
+        elif char == '[':
+            end = pattern.find(']', i + 2)
+            if end < 0:
+                result.append(re.escape(char))
+                i += 1
+                continue
+            chars = pattern[i + 1:end]
+            if chars[0] in '!^':
+                chars = '^' + chars[1:]
+            result.append('[' + chars.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif char == '\\' and i + 1 < length:
+            result.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            result.append(re.escape(char))
+            i += 1
+    return ''.join(result)
+
+
+class IgnoreMatcher:
+    """
+    Compiled list of gitignore-style rules.
+    Paths are relative to artifact directory, with '/' separators.
+    """
+
+    def __init__(self, lines):
+        # Each rule is (compiled regex, is negation, applies to dirs only):
+        self.rules = []
+        for line in lines:
+            rule = self._compile_rule(line)
+            if rule is not None:
+                self.rules.append(rule)
+
+        # Without negations, rules can be merged into single regex:
+        self._file_regex = None
+        self._dir_regex = None
+        if self.rules and not any(negate for _, negate, _ in self.rules):
+            self._file_regex = self._merge(
+                [regex for regex, _, dir_only in self.rules if not dir_only])
+            self._dir_regex = self._merge(
+                [regex for regex, _, _ in self.rules])
+
+    @classmethod
+    def from_file(cls, file_path: str):
+        with open(file_path, 'r') as f_in:
+            return cls(f_in.read().splitlines())
+
+    def _compile_rule(self, line: str):
+        if line.startswith('#'):
+            return None
+        # Trailing spaces are ignored unless escaped:
+        stripped = line.rstrip(' ')
+        if stripped.endswith('\\') and len(stripped) < len(line):
+            stripped += ' '
+        line = stripped
+        if not line:
+            return None
+
+        negate = False
+        if line.startswith('!'):
+            negate = True
+            line = line[1:]
+        elif line.startswith('\\!') or line.startswith('\\#'):
+            line = line[1:]
+
+        dir_only = False
+        if line.endswith('/'):
+            dir_only = True
+            line = line.rstrip('/')
+        if not line:
+            return None
+
+        if '/' in line:
+            # Pattern with a slash is relative to artifact root:
+            body = _translate(line.lstrip('/'))
+        else:
+            body = '(?:.*/)?' + _translate(line)
+        return re.compile('^' + body + '$'), negate, dir_only
+
+    def _merge(self, regexes):
+        if not regexes:
+            return None
+        return re.compile('|'.join(
+            '(?:' + regex.pattern + ')' for regex in regexes))
+
+    def is_ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        if not self.rules:
+            return False
+        if self._dir_regex is not None:
+            regex = self._dir_regex if is_dir else self._file_regex
+            return regex is not None and regex.match(rel_path) is not None
+
+        ignored = False
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                ignored = not negate
+        return ignored
+
+
+def find_ignore_file(local_path: str):
+    if os.path.isdir(local_path):
+        base_dir = local_path
+    else:
+        base_dir, _ = os.path.split(local_path)
+    ignore_filepath = os.path.join(base_dir, IGNORE_FILE_NAME)
+    if os.path.exists(ignore_filepath) and \
+       not os.path.isdir(ignore_filepath):
+        return ignore_filepath
+    return None
+
+
+def get_ignore_matcher(local_path: str):
+    """
+    Compiled matcher for ignore file of artifact directory
+    at local_path, or None if there is no ignore file.
+    """
+    if not os.path.isdir(local_path):
+        return None
+    ignore_filepath = find_ignore_file(local_path)
+    if ignore_filepath is None:
+        return None
+    mtime = os.path.getmtime(ignore_filepath)
+    with _matchers_lock:
+        cached = _matchers_cache.get(ignore_filepath, None)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    matcher = IgnoreMatcher.from_file(ignore_filepath)
+    with _matchers_lock:
+        _matchers_cache[ignore_filepath] = (mtime, matcher)
+    return matcher
+
+
+def walk_files(local_path: str, matcher: IgnoreMatcher = None,
+               dirs: bool = False):
+    """
+    Generator of (relative path, DirEntry) of all files
+    under local_path directory, which are not ignored by matcher.
+    Ignored subdirectories are pruned without being entered or stat'ed.
+    If dirs is set, entries of subdirectories are generated as well.
+    """
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = list(os.scandir(os.path.join(local_path, rel_dir)))
+        except OSError:
+            continue
+        for entry in entries:
+            rel_path = rel_dir + '/' + entry.name if rel_dir else entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if matcher is not None and matcher.is_ignored(rel_path, is_dir):
+                continue
+            if is_dir:
+                stack.append(rel_path)
+            if dirs or not is_dir:
+                yield rel_path, entry
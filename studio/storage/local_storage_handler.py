@@ -1,10 +1,12 @@
 import os
 import shutil
-from typing import Dict
+import uuid
+from typing import Dict, List
 
 from studio.storage.storage_setup import get_storage_verbose_level
 from studio.storage.storage_type import StorageType
-from studio.storage.storage_handler import StorageHandler
+from studio.storage.storage_handler import StorageHandler, STREAM_BUFFER_SIZE
+from studio.storage.storage_util import copy_file_fast
 from studio.util import logs
 from studio.util import util
 
@@ -27,6 +29,12 @@ class LocalStorageHandler(StorageHandler):
                 .format(self.endpoint)
             self._report_fatal(msg)
 
+        # Allow hardlinks between the store and local files
+        # (both then share one copy of the data):
+        self.link_files = config.get('link_files', False)
+        if isinstance(self.link_files, str):
+            self.link_files = self.link_files.lower() == 'true'
+
         self.bucket = config.get('bucket', 'storage')
         self.store_root = os.path.join(self.endpoint, self.bucket)
         self._ensure_path_dirs_exist(self.store_root)
@@ -34,7 +42,8 @@ class LocalStorageHandler(StorageHandler):
         super().__init__(StorageType.storageLocal,
             self.logger,
             measure_timestamp_diff,
-            compression=compression)
+            compression=compression,
+            compression_threads=config.get('compression_threads', 1))
 
     def _ensure_path_dirs_exist(self, path):
         dirs = os.path.dirname(path)
@@ -42,7 +51,10 @@ class LocalStorageHandler(StorageHandler):
 
     def _copy_file(self, from_path, to_path):
         try:
-            shutil.copyfile(from_path, to_path)
+            method = copy_file_fast(from_path, to_path,
+                                    hardlink=self.link_files)
+            self.logger.debug("Copied '%s' to '%s' using %s",
+                              from_path, to_path, method)
         except Exception as exc:
             msg: str = "FAILED to copy '{0}' to '{1}': {2}. Aborting."\
                 .format(from_path, to_path,exc)
@@ -55,10 +67,39 @@ class LocalStorageHandler(StorageHandler):
                 "Local path {0} does not exist. SKIPPING upload to {1}"
                     .format(local_path, target_path))
             return False
+        self._invalidate_metadata(key)
         self._ensure_path_dirs_exist(target_path)
         self._copy_file(local_path, target_path)
         return True
 
+    def upload_stream(self, key, fileobj):
+        target_path = os.path.join(self.store_root, key)
+        self._invalidate_metadata(key)
+        self._ensure_path_dirs_exist(target_path)
+        # Write next to the target and move it in place at the end,
+        # so nobody sees partially written file:
+        tmp_path = target_path + '.' + str(uuid.uuid4()) + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f_out:
+                shutil.copyfileobj(fileobj, f_out, STREAM_BUFFER_SIZE)
+            os.replace(tmp_path, target_path)
+        except Exception as exc:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            msg: str = "FAILED to write stream to '{0}': {1}. Aborting."\
+                .format(target_path, exc)
+            self._report_fatal(msg)
+        return True
+
+    def rename_file(self, from_key, to_key):
+        from_path = self._get_file_path_from_key(from_key)
+        to_path = self._get_file_path_from_key(to_key)
+        self._invalidate_metadata(from_key)
+        self._invalidate_metadata(to_key)
+        self._ensure_path_dirs_exist(to_path)
+        os.replace(from_path, to_path)
+        util.delete_local_folders(os.path.dirname(from_path), self.store_root)
+
     def download_file(self, key, local_path):
         source_path = os.path.join(self.store_root, key)
         if not os.path.exists(source_path):
@@ -70,12 +111,36 @@ class LocalStorageHandler(StorageHandler):
         self._copy_file(source_path, local_path)
         return True
 
+    def read_range(self, key, start: int, length: int = None):
+        source_path = self._get_file_path_from_key(key)
+        try:
+            with open(source_path, 'rb') as f_in:
+                f_in.seek(start)
+                return f_in.read() if length is None else f_in.read(length)
+        except FileNotFoundError:
+            return None
+
     def delete_file(self, key, shallow=True):
         key_path: str = self._get_file_path_from_key(key)
+        self._invalidate_metadata(key)
         if os.path.exists(key_path):
             self.logger.debug("Deleting local file {0}.".format(key_path))
             util.delete_local_path(key_path, self.store_root, False)
 
+    def list_files(self, prefix: str) -> List[str]:
+        prefix_path = self._get_file_path_from_key(prefix)
+        # Prefix may end in the middle of file or directory name:
+        top = prefix_path if prefix.endswith('/') \
+            else os.path.dirname(prefix_path)
+        result = []
+        for dir_path, _, file_names in os.walk(top):
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                if path.startswith(prefix_path):
+                    result.append(os.path.relpath(path, self.store_root)
+                                  .replace(os.sep, '/'))
+        return sorted(result)
+
     @classmethod
     def get_id(cls, config: Dict) -> str:
         endpoint = config.get('endpoint', None)
@@ -96,6 +161,10 @@ class LocalStorageHandler(StorageHandler):
         else:
             return None
 
+    def _fetch_file_timestamps(self, keys):
+        # Local lookups are cheap, no need for threads:
+        return {key: self.get_file_timestamp(key) for key in keys}
+
     def get_qualified_location(self, key):
         return 'file:/' + self.store_root + '/' + key
 
@@ -0,0 +1,48 @@
+import threading
+import time
+
+DEFAULT_METADATA_TTL = 10.0
+
+
+# MetadataCache keeps recently fetched metadata (timestamps)
+# of storage objects for a short time, so that repeated checks
+# of the same object by different artifacts and code paths
+# do not go to the storage endpoint each time.
+# One cache is shared by all handlers created by StorageHandlerFactory;
+# entries are keyed by handler namespace and object key.
+class MetadataCache:
+    def __init__(self, ttl: float = DEFAULT_METADATA_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, namespace, key):
+        """
+        Returns tuple (found, value). Value None is a valid
+        cached value meaning "object does not exist".
+        """
+        with self._lock:
+            entry = self._entries.get((namespace, key), None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, namespace, key, value):
+        with self._lock:
+            self._entries[(namespace, key)] = (time.time() + self.ttl, value)
+
+    def invalidate(self, namespace, key=None):
+        with self._lock:
+            if key is not None:
+                self._entries.pop((namespace, key), None)
+                return
+            for entry_key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[entry_key]
+
+    def clear(self):
+        with self._lock:
+            self._entries = dict()
@@ -1,15 +1,19 @@
 import calendar
-
+import hashlib
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from boto3.s3.transfer import TransferConfig
 from boto3.session import Session
 import botocore
 from botocore.client import Config
 from botocore.handlers import set_list_objects_encoding_type_url
-from typing import Dict
-import re
+from typing import Dict, List
 
+from studio.artifacts import artifacts_tracker
 from studio.util import logs
 from studio.util import util
 from studio.credentials.credentials import Credentials, AWS_TYPE
@@ -17,6 +21,21 @@ from studio.storage.storage_handler import StorageHandler
 from studio.storage.storage_type import StorageType
 from studio.storage.storage_setup import get_storage_verbose_level
 
+MB = 1024 * 1024
+DEFAULT_MULTIPART_THRESHOLD = 8 * MB
+DEFAULT_MULTIPART_CHUNKSIZE = 8 * MB
+MAX_MULTIPART_CHUNKSIZE = 512 * MB
+DEFAULT_MAX_CONCURRENCY = 10
+# S3 limit on number of parts in multipart upload:
+MAX_PARTS = 10000
+DEFAULT_DOWNLOAD_CONCURRENCY = 16
+DOWNLOAD_STATE_SAVE_PERIOD = 100
+PROGRESS_REPORT_PERIOD = 10
+# Batched metadata lookup lists a prefix
+# when it has at least this many requested keys:
+LIST_MIN_KEYS = 3
+LIST_MAX_KEYS = 1000
+
 class S3StorageHandler(StorageHandler):
     def __init__(self, config,
                  measure_timestamp_diff=False,
@@ -65,6 +84,8 @@ class S3StorageHandler(StorageHandler):
         if compression is None:
             compression = config.get('compression', None)
 
+        self._setup_transfer_settings(config)
+
         self.cleanup_bucket = config.get('cleanup_bucket', False)
         if isinstance(self.cleanup_bucket, str):
             self.cleanup_bucket = self.cleanup_bucket.lower() == 'true'
@@ -98,7 +119,55 @@ class S3StorageHandler(StorageHandler):
         super().__init__(StorageType.storageS3,
             self.logger,
             measure_timestamp_diff,
-            compression=compression)
+            compression=compression,
+            compression_threads=config.get('compression_threads', 1))
+
+    def _setup_transfer_settings(self, config: Dict):
+        self.multipart_threshold = util.str2size(
+            config.get('multipart_threshold', DEFAULT_MULTIPART_THRESHOLD))
+        # If chunk size is not set explicitly,
+        # it is tuned for each transfer based on object size.
+        self.multipart_chunksize = util.str2size(
+            config.get('multipart_chunksize', None))
+        self.max_concurrency = int(
+            config.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+        self.max_bandwidth = util.str2size(config.get('max_bandwidth', None))
+        self.use_threads = config.get('use_threads', True)
+        if isinstance(self.use_threads, str):
+            self.use_threads = self.use_threads.lower() == 'true'
+        # Number of files downloaded in parallel for directory downloads:
+        self.download_concurrency = int(
+            config.get('download_concurrency', DEFAULT_DOWNLOAD_CONCURRENCY))
+
+    def _get_chunksize(self, size):
+        if self.multipart_chunksize is not None:
+            chunksize = self.multipart_chunksize
+        elif size is None:
+            chunksize = DEFAULT_MULTIPART_CHUNKSIZE
+        else:
+            # Enough parts to keep all workers busy,
+            # but not so small that per-request overhead dominates:
+            chunksize = -(-size // self.max_concurrency)
+            chunksize = max(DEFAULT_MULTIPART_CHUNKSIZE,
+                            min(chunksize, MAX_MULTIPART_CHUNKSIZE))
+        if size is not None:
+            chunksize = max(chunksize, -(-size // MAX_PARTS))
+        return chunksize
+
+    def get_transfer_config(self, size=None) -> TransferConfig:
+        """
+        Build TransferConfig for transfer of object with given size
+        (None if size is unknown, like for streamed uploads).
+        """
+        settings = {
+            'multipart_threshold': self.multipart_threshold,
+            'multipart_chunksize': self._get_chunksize(size),
+            'max_concurrency': self.max_concurrency,
+            'use_threads': self.use_threads
+        }
+        if self.max_bandwidth is not None:
+            settings['max_bandwidth'] = self.max_bandwidth
+        return TransferConfig(**settings)
 
     def _get_region(self, config: Dict):
         result = config.get('region_name', None)
@@ -130,8 +199,9 @@ class S3StorageHandler(StorageHandler):
                 "Local path {0} does not exist. SKIPPING upload to {1}/{2}"
                     .format(local_path, self.bucket, key))
             return False
+        self._invalidate_metadata(key)
         try:
-            config = TransferConfig(multipart_threshold=2 * 1024 * 1024 * 1024)
+            config = self.get_transfer_config(os.path.getsize(local_path))
             with open(local_path, 'rb') as data:
                 self.client.upload_fileobj(data, self.bucket, key, Config=config)
             return True
@@ -140,13 +210,36 @@ class S3StorageHandler(StorageHandler):
                                .format(local_path, self.bucket, key, exc))
             return False
 
-    def download_file(self, key, local_path):
+    def upload_stream(self, key, fileobj):
+        self._invalidate_metadata(key)
         try:
-            head, _ = os.path.split(local_path)
-            if head is not None:
-                os.makedirs(head, exist_ok=True)
-            self.client.download_file(self.bucket, key, local_path)
+            # Stream is not seekable, so it is sent as multipart upload
+            # in chunks buffered in memory, no matter what is the size:
+            config = self.get_transfer_config(None)
+            self.client.upload_fileobj(fileobj, self.bucket, key, Config=config)
             return True
+        except Exception as exc:
+            self._report_fatal("FAILED to upload stream to {0}/{1}: {2}"
+                               .format(self.bucket, key, exc))
+            return False
+
+    def rename_file(self, from_key, to_key):
+        self._invalidate_metadata(from_key)
+        self._invalidate_metadata(to_key)
+        try:
+            self.client.copy({'Bucket': self.bucket, 'Key': from_key},
+                             self.bucket, to_key)
+            self.client.delete_object(Bucket=self.bucket, Key=from_key)
+        except Exception as exc:
+            self._report_fatal("FAILED to rename {0}/{1} to {2}: {3}"
+                               .format(self.bucket, from_key, to_key, exc))
+
+    def download_file(self, key, local_path):
+        try:
+            # Size is not known without extra HEAD request
+            # (transfer does its own one), so default part size is used;
+            # missing key is reported as 404 by the transfer itself:
+            return self._download_object(key, local_path, None)
         except botocore.exceptions.ClientError as exc:
             if self._not_found(exc.response):
                 self.logger.debug(
@@ -161,6 +254,36 @@ class S3StorageHandler(StorageHandler):
                                .format(local_path, self.bucket, key, exc))
             return False
 
+    def _download_object(self, key, local_path, size):
+        head, _ = os.path.split(local_path)
+        if head:
+            os.makedirs(head, exist_ok=True)
+        # Objects above multipart threshold are fetched
+        # with concurrent ranged GETs:
+        self.client.download_file(self.bucket, key, local_path,
+                                  Config=self.get_transfer_config(size))
+        return True
+
+    def read_range(self, key, start: int, length: int = None):
+        if length is not None and length <= 0:
+            return b''
+        byte_range = 'bytes={0}-{1}'.format(
+            start, '' if length is None else start + length - 1)
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=key, Range=byte_range)
+            return response['Body'].read()
+        except botocore.exceptions.ClientError as exc:
+            error_code = exc.response.get('Error', {}).get('Code', None)
+            if error_code == 'InvalidRange':
+                # Range starts past the end of object:
+                return b''
+            if error_code == 'NoSuchKey' or self._not_found(exc.response):
+                return None
+            self._report_fatal("FAILED to read range {0} of {1}/{2}: {3}"
+                               .format(byte_range, self.bucket, key, exc))
+            return None
+
     def download_remote_path(self, remote_path, local_path):
         # remote_path is full S3-formatted file reference
         if remote_path.endswith('/'):
@@ -170,41 +293,62 @@ class S3StorageHandler(StorageHandler):
             _, _, key = util.parse_s3_path(remote_path)
             return self.download_file(key, local_path)
 
+    def _list_prefix(self, prefix: str):
+        """
+        Generator of all objects under prefix (flat listing, no delimiter).
+        """
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item
+
+    def list_files(self, prefix: str) -> List[str]:
+        return [item['Key'] for item in self._list_prefix(prefix)]
+
     def _download_dir(self, key, local):
         self.logger.debug("s3 download dir.: bucket: {0} key: {1} to {2}"
                           .format(self.bucket, key, local))
 
-        success: bool = True
-        paginator = self.client.get_paginator('list_objects')
-        for result in paginator.paginate(
-                Bucket=self.bucket,
-                Delimiter='/',
-                Prefix=key):
-            if result.get('CommonPrefixes') is not None:
-                for subdir in result.get('CommonPrefixes'):
-                    prefix: str = subdir.get('Prefix')
-                    local_prefix: str = re.sub('^'+key, '', prefix)
-                    dir_success: bool = self._download_dir(
-                        prefix,
-                        os.path.join(local, local_prefix)
-                    )
-                    success = success and dir_success
-
-            if result.get('Contents') is not None:
-                for file in result.get('Contents'):
-                    file_key = file.get('Key')
-
-                    local_dir_path: str = local
-                    if not os.path.exists(local_dir_path):
-                        os.makedirs(local_dir_path)
-
-                    local_path = os.path.join(local, re.sub('^'+key, '', file_key))
-                    self.logger.debug(
-                            'Downloading {0}/{1} to {2}'
-                                .format(self.bucket, file_key, local_path))
-                    success = self.download_file(file_key, local_path)\
-                              and success
-        return success
+        os.makedirs(local, exist_ok=True)
+        state = _DownloadState(artifacts_tracker.get_download_state(
+            self.get_qualified_location(key), local))
+        items = [item for item in self._list_prefix(key)
+                 if not item['Key'].endswith('/')]
+        progress = _DownloadProgress(len(items),
+                                     sum(item.get('Size', 0) for item in items),
+                                     self.logger)
+
+        def _download_item(item) -> bool:
+            file_key: str = item['Key']
+            rel_path: str = file_key[len(key):]
+            local_path = os.path.join(local, rel_path)
+            size = item.get('Size', 0)
+            etag = item.get('ETag', '')
+            if state.is_current(rel_path, local_path, size, etag):
+                progress.skipped(size)
+                return True
+            self.logger.debug('Downloading {0}/{1} to {2}'
+                              .format(self.bucket, file_key, local_path))
+            try:
+                result = self._download_object(file_key, local_path, size)
+            except Exception as exc:
+                self.logger.error('FAILED to download {0}/{1} to {2}: {3}'
+                                  .format(self.bucket, file_key,
+                                          local_path, exc))
+                return False
+            if result:
+                state.update(rel_path, local_path, etag)
+                progress.downloaded(size)
+            return result
+
+        try:
+            with ThreadPoolExecutor(
+                    max_workers=self.download_concurrency) as executor:
+                results = list(executor.map(_download_item, items))
+        finally:
+            state.save()
+        progress.report(force=True)
+        return all(results)
 
     def get_local_destination(self, remote_path: str):
         if remote_path.endswith('/'):
@@ -217,6 +361,7 @@ class S3StorageHandler(StorageHandler):
             return parts[len(parts)-2], parts[len(parts)-1]
 
     def delete_file(self, key, shallow=True):
+        self._invalidate_metadata(key)
         self.client.delete_object(Bucket=self.bucket, Key=key)
 
     def cleanup(self):
@@ -324,6 +469,46 @@ class S3StorageHandler(StorageHandler):
         else:
             return None
 
+    def _fetch_file_timestamps(self, keys):
+        """
+        Keys sharing a prefix are resolved by a single listing request
+        covering their range; keys outside of listed range
+        are resolved with concurrent HEAD requests.
+        """
+        groups = dict()
+        for key in keys:
+            prefix = key[:key.rfind('/') + 1]
+            groups.setdefault(prefix, []).append(key)
+
+        result = dict()
+        for prefix, group in groups.items():
+            if len(group) < LIST_MIN_KEYS:
+                continue
+            group = sorted(group)
+            try:
+                listing = self.client.list_objects_v2(
+                    Bucket=self.bucket, Prefix=prefix,
+                    StartAfter=group[0][:-1], MaxKeys=LIST_MAX_KEYS)
+            except Exception as exc:
+                self.logger.debug("FAILED to list %s/%s: %s",
+                                  self.bucket, prefix, exc)
+                continue
+            listed = {item['Key']: item for item in listing.get('Contents', [])}
+            last_key = max(listed.keys()) if listed else None
+            for key in group:
+                if key in listed:
+                    result[key] = calendar.timegm(
+                        listed[key]['LastModified'].timetuple())
+                elif not listing.get('IsTruncated', False) or \
+                        (last_key is not None and key < last_key):
+                    # Listing covered this key, so there is no such object:
+                    result[key] = None
+
+        rest = [key for key in keys if key not in result]
+        if rest:
+            result.update(super()._fetch_file_timestamps(rest))
+        return result
+
     def get_qualified_location(self, key):
         url = urlparse(self.endpoint)
         location: str = 's3://' + url.netloc + '/' + self.bucket + '/' + key
@@ -338,3 +523,103 @@ class S3StorageHandler(StorageHandler):
 
     def _report_fatal(self, msg: str):
         util.report_fatal(msg, self.logger)
+
+
+class _DownloadState:
+    """
+    Record of S3 objects downloaded into local directory,
+    kept in a state file outside of it (in studio home),
+    so that interrupted directory download can be resumed
+    by skipping files which are already current.
+    """
+    def __init__(self, state_path: str):
+        self.path = state_path
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.entries = dict()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f_in:
+                    self.entries = json.load(f_in)
+            except Exception:
+                self.entries = dict()
+
+    def is_current(self, rel_path: str, local_path: str, size, etag) -> bool:
+        try:
+            stat = os.stat(local_path)
+        except OSError:
+            return False
+        if stat.st_size != size:
+            return False
+        entry = self.entries.get(rel_path, None)
+        if entry is not None and entry.get('etag') == etag and \
+                entry.get('mtime') == stat.st_mtime:
+            return True
+        # Single-part upload ETag is just MD5 of the content:
+        plain_etag = etag.strip('"')
+        if plain_etag and '-' not in plain_etag and \
+                util.filehash(local_path, hashobj=hashlib.md5()) == plain_etag:
+            self.update(rel_path, local_path, etag)
+            return True
+        return False
+
+    def update(self, rel_path: str, local_path: str, etag):
+        with self.lock:
+            self.entries[rel_path] = {
+                'etag': etag,
+                'mtime': os.path.getmtime(local_path)
+            }
+            self.updates += 1
+            if self.updates % DOWNLOAD_STATE_SAVE_PERIOD == 0:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f_out:
+            json.dump(self.entries, f_out)
+        os.replace(tmp_path, self.path)
+
+
+class _DownloadProgress:
+    """Counters and periodic progress report for directory download."""
+    def __init__(self, total_files: int, total_bytes: int, logger):
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files_done = 0
+        self.files_skipped = 0
+        self.bytes_done = 0
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+    def downloaded(self, size):
+        with self.lock:
+            self.files_done += 1
+            self.bytes_done += size
+        self.report()
+
+    def skipped(self, size):
+        with self.lock:
+            self.files_done += 1
+            self.files_skipped += 1
+            self.total_bytes -= size
+        self.report()
+
+    def report(self, force=False):
+        now = time.time()
+        with self.lock:
+            if not force and now - self.last_report < PROGRESS_REPORT_PERIOD:
+                return
+            self.last_report = now
+            elapsed = max(now - self.start_time, 1e-6)
+            self.logger.info(
+                "Downloaded %d of %d files (%d skipped as current), "
+                "%.1f of %.1f MB, %.1f MB/s",
+                self.files_done, self.total_files, self.files_skipped,
+                self.bytes_done / MB, self.total_bytes / MB,
+                self.bytes_done / MB / elapsed)
@@ -1,11 +1,18 @@
 import os
+import shutil
 import uuid
 import time
-from typing import Dict
+import threading
+from typing import Dict, List
 
+from studio.storage.async_storage_handler import AsyncStorageHandler, run_sync
+from studio.storage.async_storage_handler_factory import get_async_handler
 from studio.storage.storage_type import StorageType
 from studio.util.util import get_temp_filename, check_for_kb_interrupt
 
+STREAM_BUFFER_SIZE = 1024 * 1024
+METADATA_WORKERS = 16
+
 # StorageHandler encapsulates the logic of basic storage operations
 # for specific storage endpoint (S3, http, local etc.)
 # together with access credentials for this endpoint.
@@ -13,11 +20,17 @@ class StorageHandler:
     def __init__(self, storage_type: StorageType,
                  logger,
                  measure_timestamp_diff=False,
-                 compression=None):
+                 compression=None,
+                 compression_threads=1):
         self.type = storage_type
         self.logger = logger
         self.compression = compression
+        self.compression_threads = int(compression_threads)
+        self._metadata_cache = None
+        self._metadata_namespace = None
         self._timestamp_shift = 0
+        self._async_handler = None
+        self._async_handler_lock = threading.Lock()
         if measure_timestamp_diff:
             try:
                 self._timestamp_shift = self._measure_timestamp_diff()
@@ -32,21 +45,108 @@ class StorageHandler:
     def upload_file(self, key, local_path):
         raise NotImplementedError("Not implemented: upload_file")
 
+    def upload_stream(self, key, fileobj):
+        # Default implementation for handlers
+        # without native streaming upload:
+        # spool the stream into temporary file first.
+        tmp_filename = get_temp_filename()
+        try:
+            with open(tmp_filename, 'wb') as tmp_file:
+                shutil.copyfileobj(fileobj, tmp_file, STREAM_BUFFER_SIZE)
+            return self.upload_file(key, tmp_filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
     def download_file(self, key, local_path):
         raise NotImplementedError("Not implemented: download_file")
 
     def download_remote_path(self, remote_path, local_path):
         raise NotImplementedError("Not implemented: download_remote_path")
 
+    def read_range(self, key, start: int, length: int = None):
+        """
+        Read length bytes (or everything up to the end, if length is None)
+        of stored object, starting at start offset.
+        Returns None if there is no such object,
+        or if handler cannot read parts of objects.
+        """
+        return None
+
     def delete_file(self, key, shallow=True):
         raise NotImplementedError("Not implemented: delete_file")
 
+    def list_files(self, prefix: str) -> List[str]:
+        """Keys of all stored objects starting with prefix."""
+        raise NotImplementedError("Not implemented: list_files")
+
+    def rename_file(self, from_key, to_key):
+        raise NotImplementedError("Not implemented: rename_file")
+
     def get_file_url(self, key, method='GET'):
         raise NotImplementedError("Not implemented: get_file_url")
 
     def get_file_timestamp(self, key):
         raise NotImplementedError("Not implemented: get_file_timestamp")
 
+    def get_file_timestamps(self, keys: List[str]) -> Dict:
+        """
+        Batched version of get_file_timestamp():
+        returns dictionary key -> timestamp (None for missing objects).
+        Results are kept in metadata cache, if handler has one.
+        """
+        result = dict()
+        missing = []
+        for key in set(keys):
+            found, value = self._get_cached_metadata(key)
+            if found:
+                result[key] = value
+            else:
+                missing.append(key)
+        if missing:
+            fetched = self._fetch_file_timestamps(missing)
+            for key, value in fetched.items():
+                self._put_cached_metadata(key, value)
+            result.update(fetched)
+        return result
+
+    def get_cached_file_timestamp(self, key):
+        return self.get_file_timestamps([key]).get(key, None)
+
+    def _fetch_file_timestamps(self, keys: List[str]) -> Dict:
+        # Default implementation: concurrent single-key lookups.
+        if len(keys) == 1:
+            return {keys[0]: self.get_file_timestamp(keys[0])}
+        return run_sync(self.get_async_handler().get_file_timestamps(keys))
+
+    def get_async_handler(self) -> AsyncStorageHandler:
+        """
+        Async handler for the same endpoint, to be run
+        on shared storage event loop (see run_sync()).
+        """
+        with self._async_handler_lock:
+            if self._async_handler is None:
+                self._async_handler = get_async_handler(
+                    self, threads=METADATA_WORKERS)
+            return self._async_handler
+
+    def set_metadata_cache(self, metadata_cache, namespace):
+        self._metadata_cache = metadata_cache
+        self._metadata_namespace = namespace
+
+    def _get_cached_metadata(self, key):
+        if self._metadata_cache is None:
+            return False, None
+        return self._metadata_cache.get(self._metadata_namespace, key)
+
+    def _put_cached_metadata(self, key, value):
+        if self._metadata_cache is not None:
+            self._metadata_cache.put(self._metadata_namespace, key, value)
+
+    def _invalidate_metadata(self, key):
+        if self._metadata_cache is not None:
+            self._metadata_cache.invalidate(self._metadata_namespace, key)
+
     def get_qualified_location(self, key):
         raise NotImplementedError("Not implemented: get_qualified_location")
 
@@ -59,6 +159,9 @@ class StorageHandler:
     def get_compression(self):
         return self.compression
 
+    def get_compression_threads(self):
+        return self.compression_threads
+
     def cleanup(self):
         pass
 
@@ -1,8 +1,10 @@
 from studio.util import logs
 from typing import Dict
 
+from studio.storage.chunked_storage_handler import ChunkedStorageHandler
 from studio.storage.http_storage_handler import HTTPStorageHandler
 from studio.storage.local_storage_handler import LocalStorageHandler
+from studio.storage.metadata_cache import MetadataCache
 from studio.storage.storage_setup import get_storage_verbose_level
 from studio.storage.storage_handler import StorageHandler
 from studio.storage.storage_type import StorageType
@@ -15,6 +17,8 @@ class StorageHandlerFactory:
         self.logger = logs.get_logger(self.__class__.__name__)
         self.logger.setLevel(get_storage_verbose_level())
         self.handlers_cache = dict()
+        # Metadata cache shared by all handlers we create:
+        self.metadata_cache = MetadataCache()
         self.cleanup_at_exit: bool = True
 
     @classmethod
@@ -42,6 +46,7 @@ class StorageHandlerFactory:
             handler = self.handlers_cache.get(handler_id, None)
             if handler is None:
                 handler = S3StorageHandler(config)
+                self._setup_metadata_cache(handler, handler_id)
                 self.handlers_cache[handler_id] = handler
             return handler
         if handler_type == StorageType.storageHTTP:
@@ -50,7 +55,9 @@ class StorageHandlerFactory:
             if handler is None:
                 handler = HTTPStorageHandler(
                     config.get('endpoint', None),
-                    config.get('credentials', None))
+                    config.get('credentials', None),
+                    config=config)
+                self._setup_metadata_cache(handler, handler_id)
                 self.handlers_cache[handler_id] = handler
             return handler
         if handler_type == StorageType.storageLocal:
@@ -58,8 +65,23 @@ class StorageHandlerFactory:
             handler = self.handlers_cache.get(handler_id, None)
             if handler is None:
                 handler = LocalStorageHandler(config)
+                self._setup_metadata_cache(handler, handler_id)
                 self.handlers_cache[handler_id] = handler
             return handler
         self.logger("FAILED to get storage handler: unsupported type %s",
                     repr(handler_type))
-        return None
\ No newline at end of file
+        return None
+
+    def _setup_metadata_cache(self, handler: StorageHandler, handler_id: str):
+        namespace = handler_id if handler_id is not None else id(handler)
+        handler.set_metadata_cache(self.metadata_cache, namespace)
+
+    def get_chunked_handler(self, base_handler: StorageHandler,
+                            base_id: str, config: Dict) -> StorageHandler:
+        handler_id: str = ChunkedStorageHandler.get_wrapped_id(base_id)
+        handler = self.handlers_cache.get(handler_id, None)
+        if handler is None:
+            handler = ChunkedStorageHandler(base_handler, config)
+            if handler_id is not None:
+                self.handlers_cache[handler_id] = handler
+        return handler
\ No newline at end of file
@@ -1,37 +1,39 @@
+import errno
+import hashlib
+import json
+import mmap
 import os
 import requests
 import shutil
 import time
 import tarfile
 import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from studio.artifacts import artifacts_tracker
+from studio.storage.ignore_matcher import IGNORE_FILE_NAME, \
+    get_ignore_matcher
+from studio.storage.compression import open_compressed_writer, \
+    open_decompressed_reader, detect_codec, MAGIC_SIZE
 from studio.util import util
 
-def _find_ignore_list(local_path: str):
-    if os.path.isdir(local_path):
-        base_dir = local_path
-    else:
-        base_dir, last_name = os.path.split(local_path)
-    ignore_filepath = os.path.join(base_dir, ".studioml_ignore")
-    if os.path.exists(ignore_filepath) and \
-       not os.path.isdir(ignore_filepath):
-        return ignore_filepath
-    else:
-        return None
-
-def tar_artifact(local_path: str, key: str,
-                 compression: str, logger, cache: bool = True):
-    tar_filename: str = util.get_temp_filename() + ".tar"
+# Linux ioctl for copy-on-write clone of a file (reflink):
+FICLONE = 0x40049409
+COPY_METHOD_HARDLINK = 'hardlink'
+COPY_METHOD_REFLINK = 'reflink'
+COPY_METHOD_COPY_FILE_RANGE = 'copy_file_range'
+COPY_METHOD_COPY = 'copy'
 
+def _prepare_tar_artifact(local_path: str, key: str, logger, cache: bool):
     if local_path != '/' and local_path.endswith('/'):
-        local_path = local_path[0..len(local_path)-1]
+        local_path = local_path[:-1]
 
-    #TODO: ASD process ignore files list if present:
-    ignore_filepath = _find_ignore_list(local_path)
-    if ignore_filepath is not None:
-        logger.info("NOT PROCESSED: ignore files list %s for artifact %s.",
-                    ignore_filepath, local_path)
+    matcher = get_ignore_matcher(local_path)
 
     if cache and key:
         cache_path = artifacts_tracker.get_artifact_cache(key)
@@ -41,161 +43,831 @@ def tar_artifact(local_path: str, key: str,
                     .format(local_path, cache_path)
             logger.error(msg)
             raise NotImplementedError(msg)
+    return local_path, matcher
+
+def tar_artifact(local_path: str, key: str,
+                 compression: str, logger, cache: bool = True,
+                 threads: int = 1):
+    tar_filename: str = util.get_temp_filename() + ".tar" + \
+        util.compression_to_extension(compression)
+    with open(tar_filename, 'wb') as tar_file:
+        tar_artifact_to_stream(local_path, key, compression,
+                               tar_file, logger, cache=cache,
+                               threads=threads)
+    return tar_filename
+
+def tar_artifact_to_stream(local_path: str, key: str,
+                           compression: str, fileobj,
+                           logger, cache: bool = True,
+                           threads: int = 1, members=None,
+                           index=None):
+    """
+    Write tar archive of local_path, compressed with given
+    compression codec, into writable file-like object.
+    Only sequential writes are done, so fileobj can be a pipe.
+    If members list is given, only these files (paths relative
+    to local_path directory) are put into archive.
+    If index dictionary is given, it is filled with
+    member name -> [offset of data in uncompressed archive, size]
+    for all regular files in archive.
+    """
+    local_path, matcher = \
+        _prepare_tar_artifact(local_path, key, logger, cache)
 
     tic = time.time()
-    if os.path.isdir(local_path):
-        _tar_artifact_directory(local_path, tar_filename,
-                                key, ignore_filepath, logger)
-    else:
-        _tar_artifact_single_file(local_path, tar_filename,
-                                  key, logger)
+    writer = open_compressed_writer(fileobj, compression, threads=threads)
+    try:
+        if os.path.isdir(local_path):
+            _tar_artifact_directory(local_path, writer,
+                                    key, matcher, logger,
+                                    members=members, index=index)
+        else:
+            _tar_artifact_single_file(local_path, writer,
+                                      key, logger, index=index)
+    finally:
+        writer.close()
     toc = time.time()
 
-    logger.debug('tar finished in %f s', (toc - tic))
-    return tar_filename
+    logger.debug('tar (compression: %s) finished in %f s',
+                 compression, (toc - tic))
+
+class _IndexingTarFile(tarfile.TarFile):
+    """
+    TarFile which records where data of each regular file
+    it writes is placed in the archive.
+    """
+    index = None
+
+    def addfile(self, tarinfo, fileobj=None):
+        super().addfile(tarinfo, fileobj)
+        if self.index is not None and tarinfo.isreg():
+            blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+            data_size = (blocks + (1 if remainder else 0)) * tarfile.BLOCKSIZE
+            self.index[tarinfo.name] = [self.offset - data_size,
+                                        tarinfo.size]
+
+def _open_tar_writer(fileobj, index):
+    if index is None:
+        return tarfile.open(fileobj=fileobj, mode='w|')
+    tf = _IndexingTarFile.open(fileobj=fileobj, mode='w|')
+    tf.index = index
+    return tf
 
 def _tar_artifact_directory(local_path: str,
-                            tar_filename: str,
+                            fileobj,
                             key,
-                            ignore_filepath, logger):
+                            matcher, logger,
+                            members=None, index=None):
     tf = None
     try:
         debug_str: str = ("Tarring artifact directory. " +
-                     "tar_filename = {0}, " +
-                     "local_path = {1}, " +
-                     "key = {2}").format(tar_filename, local_path, key)
-        if ignore_filepath is not None:
-            debug_str += ", exclude = {0}".format(ignore_filepath)
+                     "local_path = {0}, " +
+                     "key = {1}").format(local_path, key)
+        if matcher is not None:
+            debug_str += ", exclude = {0}".format(
+                os.path.join(local_path, IGNORE_FILE_NAME))
         logger.debug(debug_str)
 
-        tf = tarfile.open(tar_filename, 'w')
-        files_list = os.listdir(local_path)
-        for file_name in files_list:
-            tf.add(os.path.join(local_path, file_name), arcname=file_name)
+        tf = _open_tar_writer(fileobj, index)
+        if members is not None:
+            for member in members:
+                tf.add(os.path.join(local_path, member), arcname=member,
+                       recursive=False)
+            return
+        _add_directory_entries(tf, local_path, '',
+                               os.scandir(local_path), matcher)
     except Exception as exc:
         msg: str =\
-            "FAILED to create tarfile: {0} for artifact {1} reason: {2}"\
-            .format(tar_filename, local_path, exc)
+            "FAILED to create tarfile for artifact {0} reason: {1}"\
+            .format(local_path, exc)
         util.report_fatal(msg, logger)
     finally:
         if tf is not None:
             tf.close()
 
+def _add_directory_entries(tf, local_path: str, rel_dir: str,
+                           entries, matcher):
+    # Same order as recursive TarFile.add() (sorted below top level),
+    # so that artifacts without ignore rules keep their hashes.
+    # Ignored subtrees are skipped without being entered.
+    for entry in entries:
+        rel_path = rel_dir + '/' + entry.name if rel_dir else entry.name
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if matcher is not None and matcher.is_ignored(rel_path, is_dir):
+            continue
+        tf.add(entry.path, arcname=rel_path, recursive=False)
+        if is_dir:
+            _add_directory_entries(
+                tf, local_path, rel_path,
+                sorted(os.scandir(entry.path), key=lambda e: e.name),
+                matcher)
+
 def _tar_artifact_single_file(local_path: str,
-                            tar_filename: str,
+                            fileobj,
                             key,
-                            logger):
+                            logger, index=None):
     tf = None
     try:
         debug_str: str = ("Tarring artifact single file. " +
-                     "tar_filename = {0}, " +
-                     "local_path = {1}, " +
-                     "key = {2}").format(tar_filename, local_path, key)
+                     "local_path = {0}, " +
+                     "key = {1}").format(local_path, key)
         logger.debug(debug_str)
 
-        tf = tarfile.open(tar_filename, 'w')
+        tf = _open_tar_writer(fileobj, index)
         _, last_name = os.path.split(local_path)
         tf.add(local_path, "./" + last_name)
     except Exception as exc:
         msg: str =\
-            "FAILED to create tarfile: {0} for artifact {1} reason: {2}"\
-            .format(tar_filename, local_path, exc)
+            "FAILED to create tarfile for artifact {0} reason: {1}"\
+            .format(local_path, exc)
         util.report_fatal(msg, logger)
     finally:
         if tf is not None:
             tf.close()
 
+class HashingWriter:
+    """
+    Write-only file-like object computing sha256 of all data
+    written through it and passing the data to optional target.
+    """
+    def __init__(self, target=None):
+        self.target = target
+        self.hashobj = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.hashobj.update(data)
+        self.size += len(data)
+        if self.target is not None:
+            self.target.write(data)
+        return len(data)
+
+    def flush(self):
+        if self.target is not None:
+            self.target.flush()
+
+    def hexdigest(self):
+        return self.hashobj.hexdigest()
+
+class _PipeReader:
+    """
+    Read end of the pipe fed by tar thread: if tar failed,
+    reading its end raises instead of returning clean EOF,
+    so the upload is aborted rather than committing
+    truncated tarball under the key.
+    """
+    def __init__(self, reader, errors):
+        self.reader = reader
+        self.errors = errors
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        if not data and self.errors:
+            raise IOError('tar failed: {0}'.format(self.errors[0]))
+        return data
+
+    def close(self):
+        self.reader.close()
+
+def stream_tar_artifact(local_path: str, key: str,
+                        compression: str, storage_handler,
+                        logger, cache: bool = True,
+                        threads: int = 1, members=None, index=None):
+    """
+    Tar artifact at local_path and upload it to storage_handler
+    under the key as a single stream: tar output goes through a pipe
+    and a hasher straight into the upload, without temporary file.
+    Returns sha256 hex digest of uploaded tarball.
+    """
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, 'rb')
+    writer = os.fdopen(write_fd, 'wb')
+    hasher = HashingWriter(writer)
+    tar_errors = []
+
+    def _tar_to_pipe():
+        try:
+            tar_artifact_to_stream(local_path, key, compression,
+                                   hasher, logger, cache=cache,
+                                   threads=threads, members=members,
+                                   index=index)
+        except BaseException as exc:
+            tar_errors.append(exc)
+        finally:
+            try:
+                writer.close()
+            except BaseException as exc:
+                tar_errors.append(exc)
+
+    tar_thread = threading.Thread(target=_tar_to_pipe, daemon=True)
+    tar_thread.start()
+    try:
+        storage_handler.upload_stream(key, _PipeReader(reader, tar_errors))
+    except BaseException:
+        if not tar_errors:
+            raise
+    finally:
+        # Let tar thread finish even if upload stopped reading:
+        reader.close()
+        tar_thread.join()
+
+    if tar_errors:
+        # Upload was aborted, what was stored under the key is intact:
+        msg: str = "FAILED to stream artifact {0} to {1}: {2}"\
+            .format(local_path, key, tar_errors[0])
+        util.report_fatal(msg, logger)
+
+    logger.debug("Streamed %d bytes of artifact %s to %s",
+                 hasher.size, local_path, key)
+    return hasher.hexdigest()
+
 def _get_single_file_name(items_list):
     if len(items_list) == 1 and items_list[0].startswith("./"):
         return items_list[0][2:]
     return None
 
-def untar_artifact(local_path: str, tar_filename: str, logger):
+def _reflink(src_path: str, dst_path: str):
+    with open(src_path, 'rb') as f_src, open(dst_path, 'wb') as f_dst:
+        fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+
+def _copy_file_range(src_path: str, dst_path: str):
+    with open(src_path, 'rb') as f_src, open(dst_path, 'wb') as f_dst:
+        remaining = os.fstat(f_src.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(f_src.fileno(), f_dst.fileno(),
+                                        remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+def copy_file_fast(src_path: str, dst_path: str,
+                   hardlink: bool = False) -> str:
+    """
+    Copy file with the cheapest method filesystem supports:
+    reflink (copy-on-write clone), hardlink (only if allowed,
+    since both paths then share the same data), in-kernel
+    copy_file_range, or regular copy (which uses sendfile on Linux).
+    Destination is written to temporary name and moved in place.
+    Returns name of method used.
+    """
+    tmp_path = dst_path + '.' + os.path.basename(util.get_temp_filename())
+    methods = []
+    if fcntl is not None:
+        methods.append((COPY_METHOD_REFLINK, _reflink))
+    if hardlink:
+        methods.append((COPY_METHOD_HARDLINK, os.link))
+    if hasattr(os, 'copy_file_range'):
+        methods.append((COPY_METHOD_COPY_FILE_RANGE, _copy_file_range))
+    methods.append((COPY_METHOD_COPY, shutil.copyfile))
+
+    try:
+        for method, copy_func in methods:
+            try:
+                copy_func(src_path, tmp_path)
+            except OSError as exc:
+                if method == COPY_METHOD_COPY or exc.errno == errno.ENOENT:
+                    raise
+                util.rm_rf(tmp_path)
+                continue
+            os.replace(tmp_path, dst_path)
+            return method
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return None
+
+def clone_tree(src_path: str, dst_path: str, hardlink: bool = False):
+    """
+    Populate dst_path with content of src_path (file or directory)
+    without copying data where possible (see copy_file_fast).
+    """
+    if not os.path.isdir(src_path):
+        head, _ = os.path.split(dst_path)
+        if head:
+            os.makedirs(head, exist_ok=True)
+        return copy_file_fast(src_path, dst_path, hardlink=hardlink)
+    for root, _, files in os.walk(src_path):
+        target_root = os.path.normpath(
+            os.path.join(dst_path, os.path.relpath(root, src_path)))
+        os.makedirs(target_root, exist_ok=True)
+        for file_name in files:
+            copy_file_fast(os.path.join(root, file_name),
+                           os.path.join(target_root, file_name),
+                           hardlink=hardlink)
+    return None
+
+class _FileOwningTarFile(tarfile.TarFile):
+    """
+    TarFile which closes the file (or memory map)
+    it reads from when it is closed itself.
+    """
+    owned_file = None
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self.owned_file is not None:
+                self.owned_file.close()
+
+def _open_owning_tar(fileobj, mode: str, owned_file):
+    tf = _FileOwningTarFile.open(fileobj=fileobj, mode=mode)
+    tf.owned_file = owned_file
+    return tf
+
+def open_tar_file(tar_filename: str, key: str = None):
+    """
+    Open stored tarball for reading. Uncompressed tarball
+    is memory-mapped and opened for random access, so members
+    can be read without going through the whole file;
+    compressed one is opened as a stream.
+    Returns tuple (TarFile, underlying file object);
+    closing TarFile closes underlying file object too.
+    """
+    # pylint: disable=consider-using-with
+    tar_file = open(tar_filename, 'rb')
+    try:
+        head = tar_file.read(MAGIC_SIZE)
+        tar_file.seek(0)
+        if detect_codec(head, key).name == 'none' and \
+                os.fstat(tar_file.fileno()).st_size > 0:
+            mapped = mmap.mmap(tar_file.fileno(), 0, access=mmap.ACCESS_READ)
+            tar_file.close()
+            try:
+                return _open_owning_tar(mapped, 'r:', mapped), mapped
+            except BaseException:
+                mapped.close()
+                raise
+        reader = open_decompressed_reader(tar_file, key)
+        return _open_owning_tar(reader, 'r|', tar_file), tar_file
+    except BaseException:
+        tar_file.close()
+        raise
+
+def _is_outside(path: str) -> bool:
+    # Whether relative path points out of the directory it is relative to:
+    path = os.path.normpath(path)
+    return os.path.isabs(path) or path == os.pardir or \
+        path.startswith(os.pardir + os.sep)
+
+
+def _checked_members(tf: tarfile.TarFile):
+    """
+    Members of tarball, checked not to write outside
+    the directory it is extracted to (tarball from untrusted source).
+    Raises ValueError on the first member which could.
+    """
+    for member in tf:
+        name = member.name
+        if os.path.isabs(name) or os.pardir in name.split('/'):
+            raise ValueError('unsafe path {0} in tarball'.format(name))
+        if member.issym():
+            target = os.path.join(os.path.dirname(name), member.linkname)
+            if os.path.isabs(member.linkname) or _is_outside(target):
+                raise ValueError('link {0} points outside of tarball'
+                                 .format(name))
+        elif member.islnk():
+            if os.path.isabs(member.linkname) or \
+                    _is_outside(member.linkname):
+                raise ValueError('link {0} points outside of tarball'
+                                 .format(name))
+        elif not (member.isfile() or member.isdir()):
+            raise ValueError('unsupported member {0} in tarball'
+                             .format(name))
+        yield member
+
 
+def untar_artifact(local_path: str, tar_filename: str, logger,
+                   key: str = None, untrusted: bool = False) -> bool:
+    """
+    Extract tarball into local_path, replacing what was there.
+    Returns False if extraction failed, local_path is then left as it was.
+    Tarball from untrusted source fails to extract if it has
+    absolute or parent paths, links pointing outside of it
+    or special files.
+    """
     if local_path != '/' and local_path.endswith('/'):
-        local_path = local_path[0..len(local_path)-1]
+        local_path = local_path[:-1]
 
     logger.debug("Untarring %s", tar_filename)
 
-    tf = None
+    # Extract in a single pass (compressed streams are not seekable)
+    # into temporary directory next to the target,
+    # and then move the result in place.
+    parent_dir = os.path.dirname(local_path)
+    os.makedirs(parent_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=parent_dir, prefix='.untar-')
     try:
-        tf = tarfile.open(tar_filename, 'r')
-        tar_items = tf.getnames()
+        tf, tar_file = open_tar_file(tar_filename, key)
+        with tar_file, tf:
+            tf.extractall(temp_dir, members=_checked_members(tf)
+                          if untrusted else None)
+            tar_items = tf.getnames()
         logger.debug('List of files in the tar: ' + str(tar_items))
 
         single_file_name = _get_single_file_name(tar_items)
+        util.rm_rf(local_path)
         if single_file_name is None:
-            util.rm_rf(local_path)
-            # Extract tar file into directory "local_path"
-            os.makedirs(local_path, exist_ok=True)
             logger.debug("Untarring %s to dir. %s", tar_filename, local_path)
-            tf.extractall(local_path)
+            os.replace(temp_dir, local_path)
         else:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                logger.debug("Untarring %s to temp. dir. %s", tar_filename, temp_dir)
-                tf.extractall(temp_dir)
-                util.rm_rf(local_path)
-                temp_path: str = os.path.join(temp_dir, single_file_name)
-                logger.debug("Copying single file %s to %s", temp_path, local_path)
-                shutil.copy2(temp_path, local_path)
+            temp_path: str = os.path.join(temp_dir, single_file_name)
+            logger.debug("Moving single file %s to %s", temp_path, local_path)
+            os.replace(temp_path, local_path)
 
     except Exception as exc:
         msg: str = \
             "FAILED to extract tarfile: {0} for artifact {1} reason: {2}" \
                 .format(tar_filename, local_path, exc)
         logger.error(msg)
+        return False
     finally:
-        if tf is not None:
-            tf.close()
+        util.rm_rf(temp_dir)
+    return True
+
+def untar_artifact_update(local_path: str, tar_filename: str, logger,
+                          key: str = None, deleted=None) -> bool:
+    """
+    Apply tarball with changed files of directory artifact
+    on top of its existing content at local_path,
+    removing files listed in deleted (paths relative to local_path).
+    Returns False if tarball could not be applied.
+    """
+    os.makedirs(local_path, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(local_path),
+                                prefix='.untar-')
+    try:
+        with open(tar_filename, 'rb') as tar_file:
+            reader = open_decompressed_reader(tar_file, key)
+            with tarfile.open(fileobj=reader, mode='r|') as tf:
+                tf.extractall(temp_dir)
+        for root, _, files in os.walk(temp_dir):
+            rel_root = os.path.relpath(root, temp_dir)
+            target_root = os.path.normpath(os.path.join(local_path, rel_root))
+            os.makedirs(target_root, exist_ok=True)
+            for file_name in files:
+                os.replace(os.path.join(root, file_name),
+                           os.path.join(target_root, file_name))
+        for rel_path in deleted if deleted else []:
+            util.rm_rf(os.path.join(local_path, rel_path))
+    except Exception as exc:
+        msg: str = \
+            "FAILED to apply tarfile: {0} to artifact {1} reason: {2}" \
+                .format(tar_filename, local_path, exc)
+        logger.error(msg)
+        return False
+    finally:
+        util.rm_rf(temp_dir)
+    return True
+
+HTTP_POOL_SIZE = 16
+HTTP_BUFFER_SIZE = 1024 * 1024
+HTTP_DOWNLOAD_RETRIES = 5
+HTTP_RETRY_SLEEP = 2
+HTTP_MAX_RETRY_SLEEP = 30
+# (connect, read) timeouts in seconds:
+HTTP_TIMEOUT = (10, 60)
+PARTIAL_DOWNLOAD_SUFFIX = '.studioml_part'
+PARTIAL_STATE_SUFFIX = '.studioml_part.json'
+
+_http_sessions = dict()
+_http_sessions_lock = threading.Lock()
+
+
+def get_http_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Shared keep-alive session with connection pool of pool_size
+    connections per host.
+    """
+    with _http_sessions_lock:
+        session = _http_sessions.get(pool_size, None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_sessions[pool_size] = session
+        return session
+
+
+class TransferStats:
+    """
+    Counters of HTTP transfers: bytes moved, time spent,
+    number of transfers, resumed downloads and failed attempts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.downloaded_bytes = 0
+        self.download_time = 0.0
+        self.downloads = 0
+        self.uploaded_bytes = 0
+        self.upload_time = 0.0
+        self.uploads = 0
+        self.resumes = 0
+        self.retries = 0
+
+    def add_download(self, nbytes: int, seconds: float):
+        with self._lock:
+            self.downloaded_bytes += nbytes
+            self.download_time += seconds
+            self.downloads += 1
+
+    def add_upload(self, nbytes: int, seconds: float):
+        with self._lock:
+            self.uploaded_bytes += nbytes
+            self.upload_time += seconds
+            self.uploads += 1
+
+    def add_resume(self):
+        with self._lock:
+            self.resumes += 1
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'downloaded_bytes': self.downloaded_bytes,
+                'download_time': self.download_time,
+                'downloads': self.downloads,
+                'download_throughput': self.downloaded_bytes /
+                    self.download_time if self.download_time > 0 else 0.0,
+                'uploaded_bytes': self.uploaded_bytes,
+                'upload_time': self.upload_time,
+                'uploads': self.uploads,
+                'upload_throughput': self.uploaded_bytes /
+                    self.upload_time if self.upload_time > 0 else 0.0,
+                'resumes': self.resumes,
+                'retries': self.retries
+            }
+
+
+def _get_md5_etag(etag):
+    # Only single-part ETags are MD5 of the content:
+    if etag is None:
+        return None
+    value = etag.strip()
+    if value.startswith('W/'):
+        return None
+    value = value.strip('"').lower()
+    if len(value) == 32 and all(c in '0123456789abcdef' for c in value):
+        return value
+    return None
+
+
+def _is_encoded(response) -> bool:
+    encoding = response.headers.get('Content-Encoding', '').strip().lower()
+    return encoding not in ('', 'identity')
+
+
+def _get_content_md5(response):
+    # ETag of object encrypted with KMS or customer key
+    # is not MD5 of its content, nor is ETag of encoded content
+    # MD5 of what we get after decoding:
+    headers = response.headers
+    encryption = headers.get('x-amz-server-side-encryption', '').lower()
+    if encryption.startswith('aws:kms') or \
+            headers.get('x-amz-server-side-encryption-customer-algorithm',
+                        None) is not None or \
+            _is_encoded(response):
+        return None
+    return _get_md5_etag(headers.get('ETag', None))
+
 
-def download_file(url, local_path, logger=None):
+def _load_partial_state(state_path: str, url: str):
+    try:
+        with open(state_path, 'r') as f_in:
+            state = json.load(f_in)
+    except (OSError, ValueError):
+        return None
+    return state if state.get('url', None) == url else None
+
+
+def _save_partial_state(state_path: str, state):
+    with open(state_path, 'w') as f_out:
+        json.dump(state, f_out)
+
+
+def _get_total_size(response):
+    # Content-Range: bytes start-end/total
+    content_range = response.headers.get('Content-Range', None)
+    if content_range is not None and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get('Content-Length', None)
+    return int(length) if length is not None and length.isdigit() else None
+
+
+def _get_range_start(response):
+    content_range = response.headers.get('Content-Range', '')
+    try:
+        return int(content_range.split()[1].split('-')[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def download_file(url, local_path, logger=None,
+                  session: requests.Session = None,
+                  retries: int = HTTP_DOWNLOAD_RETRIES,
+                  buffer_size: int = HTTP_BUFFER_SIZE,
+                  stats: TransferStats = None) -> bool:
+    """
+    Download resource at url to local_path.
+    Data goes to "<local_path>.studioml_part" first; when connection
+    breaks, download resumes from where it stopped with Range request,
+    also in later calls for the same url and local_path.
+    Downloaded size is checked against Content-Length,
+    and content against ETag, when ETag is MD5 of content
+    (single-part upload, not encrypted with KMS or customer key).
+    Content-Encoding is decoded, such content is neither checked
+    nor resumed, as its length and ETag refer to encoded data.
+    """
     if url.startswith('s3://'):
         raise NotImplementedError('util.download_file() NOT implemented for s3 endpoints.')
-
-    response = requests.get(
-        url,
-        stream=True)
+    if session is None:
+        session = get_http_session()
     if logger:
         logger.info(("Trying to download file at url {0} to " +
                      "local path {1}").format(url, local_path))
 
-    if response.status_code == 200:
+    part_path = local_path + PARTIAL_DOWNLOAD_SUFFIX
+    state_path = local_path + PARTIAL_STATE_SUFFIX
+    state = _load_partial_state(state_path, url)
+    if state is None and os.path.exists(part_path):
+        os.remove(part_path)
+
+    tic = time.time()
+    fetched = 0
+    for attempt in range(max(1, retries)):
+        if attempt > 0:
+            if stats:
+                stats.add_retry()
+            time.sleep(min(HTTP_RETRY_SLEEP * 2 ** (attempt - 1),
+                           HTTP_MAX_RETRY_SLEEP))
+        offset = os.path.getsize(part_path) \
+            if state is not None and not state.get('encoded', False) and \
+            os.path.exists(part_path) else 0
+        headers = {'Accept-Encoding': 'identity'}
+        if offset > 0:
+            headers['Range'] = 'bytes={0}-'.format(offset)
+            if state.get('etag', None):
+                # Get the whole resource instead, if it has changed:
+                headers['If-Range'] = state['etag']
         try:
-            with open(local_path, 'wb') as f:
-                for chunk in response:
-                    f.write(chunk)
-            return True
-        except Exception as exc:
-            msg: str = 'Download/write {0} from {1} FAILED: {2}.' \
-                .format(local_path, url, exc)
+            with session.get(url, stream=True, headers=headers,
+                             timeout=HTTP_TIMEOUT) as response:
+                if response.status_code == 416 and offset > 0 and \
+                        offset == state.get('size', None):
+                    # Everything was downloaded already:
+                    break
+                if response.status_code == 206 and offset > 0 and \
+                        _get_range_start(response) == offset and \
+                        response.headers.get('ETag', None) == \
+                        state.get('etag', None):
+                    mode = 'ab'
+                    if stats:
+                        stats.add_resume()
+                    if logger:
+                        logger.info('Resuming download of {0} at {1} bytes'
+                                    .format(url, offset))
+                elif response.status_code == 206 and offset > 0:
+                    # Resource has changed since partial download,
+                    # and server ignored If-Range: start over.
+                    state = None
+                    os.remove(part_path)
+                    continue
+                elif response.status_code == 200:
+                    mode = 'wb'
+                    offset = 0
+                    encoded = _is_encoded(response)
+                    state = {'url': url,
+                             'etag': response.headers.get('ETag', None),
+                             'md5': _get_content_md5(response),
+                             'encoded': encoded,
+                             'size': None if encoded
+                             else _get_total_size(response)}
+                    _save_partial_state(state_path, state)
+                else:
+                    msg: str = 'Download {0} from {1}: ' \
+                               'Response error with code {2}.' \
+                        .format(local_path, url, response.status_code)
+                    if logger:
+                        logger.error(msg)
+                    if response.status_code < 500:
+                        return False
+                    continue
+                with open(part_path, mode, buffering=buffer_size) as f_out:
+                    for chunk in response.iter_content(buffer_size):
+                        f_out.write(chunk)
+                        fetched += len(chunk)
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as exc:
+            if logger:
+                logger.info('Download of {0} interrupted at {1} bytes: {2}'
+                            .format(url, os.path.getsize(part_path)
+                                    if os.path.exists(part_path) else 0, exc))
+            continue
+        except OSError as exc:
             if logger:
-                logger.error(msg)
+                logger.error('Download/write {0} from {1} FAILED: {2}.'
+                             .format(local_path, url, exc))
             return False
 
-    elif logger:
-        msg: str = 'Download {0} from {1}: Response error with code {2}.' \
-            .format(local_path, url, response.status_code)
-        logger.error(msg)
+        size = os.path.getsize(part_path)
+        if state['size'] is not None and size != state['size']:
+            if logger:
+                logger.info('Download of {0} got {1} bytes of {2}'
+                            .format(url, size, state['size']))
+            if size > state['size']:
+                state = None
+            continue
+        break
+    else:
+        if logger:
+            logger.error('Download {0} from {1} FAILED after {2} attempts.'
+                         .format(local_path, url, retries))
+        return False
+
+    md5_etag = state.get('md5', None)
+    if md5_etag is not None and \
+            util.filehash(part_path, HTTP_BUFFER_SIZE,
+                          hashobj=hashlib.md5()) != md5_etag:
+        if logger:
+            logger.error('Download {0} from {1}: content does not match '
+                         'ETag {2}.'.format(local_path, url, state['etag']))
+        os.remove(part_path)
+        os.remove(state_path)
         return False
 
-def upload_file(url, local_path, logger=None):
+    os.replace(part_path, local_path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    elapsed = time.time() - tic
+    if stats:
+        stats.add_download(fetched, elapsed)
+    if logger:
+        logger.debug('File {0} download from {1} done in {2} s'
+                     .format(local_path, url, elapsed))
+    return True
+
+def download_range(url, start: int, length: int = None, logger=None,
+                   session: requests.Session = None):
+    """
+    Get length bytes (or everything up to the end, if length is None)
+    of resource at url, starting at start offset, with HTTP Range request.
+    Returns None if resource is not available.
+    """
+    if length is not None and length <= 0:
+        return b''
+    if session is None:
+        session = get_http_session()
+    byte_range = 'bytes={0}-{1}'.format(
+        start, '' if length is None else start + length - 1)
+    response = session.get(url, headers={'Range': byte_range},
+                           timeout=HTTP_TIMEOUT)
+    if response.status_code == 206:
+        return response.content
+    if response.status_code == 200:
+        # Server does not support ranges and sent everything:
+        end = None if length is None else start + length
+        return response.content[start:end]
+    if response.status_code == 416:
+        return b''
+    if logger:
+        logger.debug('Range {0} of {1}: Response error with code {2}.'
+                     .format(byte_range, url, response.status_code))
+    return None
+
+def upload_file(url, local_path, logger=None,
+                session: requests.Session = None,
+                stats: TransferStats = None):
+    if session is None:
+        session = get_http_session()
     if logger:
         logger.info(("Trying to upload file {0} to " +
                      "url {1}").format(local_path, url))
     tic = time.time()
     try:
         with open(local_path, 'rb') as f:
-            resp = requests.put(url, data=f)
+            resp = session.put(url, data=f, timeout=HTTP_TIMEOUT)
     except Exception as exc:
         msg: str = 'Upload {0} to {1} FAILED: {2}. Aborting.' \
             .format(local_path, url, exc)
-        report_fatal(msg, logger)
+        util.report_fatal(msg, logger)
 
-    if resp.status_code != 200 and logger:
+    if not 200 <= resp.status_code < 300:
         msg: str = 'Upload {0} to {1}: Response error {2}:{3}. Aborting.' \
             .format(local_path, url, resp.status_code, resp.reason)
-        report_fatal(msg, logger)
+        util.report_fatal(msg, logger)
 
+    elapsed = time.time() - tic
+    if stats:
+        stats.add_upload(os.path.getsize(local_path), elapsed)
     if logger:
         logger.debug('File {0} upload to {1} done in {2} s'
-                     .format(local_path, url, time.time() - tic))
+                     .format(local_path, url, elapsed))
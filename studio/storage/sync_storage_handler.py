@@ -0,0 +1,39 @@
+from typing import List
+
+from studio.storage.async_storage_handler import AsyncStorageHandler, \
+    run_sync
+from studio.storage.storage_handler import StorageHandler
+
+
+# SyncStorageHandler exposes AsyncStorageHandler as blocking
+# StorageHandler, so that existing callers can use it unchanged.
+# Calls are run on shared storage event loop,
+# batched lookups go through it as single concurrent batch.
+class SyncStorageHandler(StorageHandler):
+    def __init__(self, async_handler: AsyncStorageHandler,
+                 compression=None):
+        super().__init__(async_handler.type,
+                         async_handler.logger,
+                         False,
+                         compression=compression)
+        self._async_handler = async_handler
+
+    def upload_file(self, key, local_path):
+        self._invalidate_metadata(key)
+        return run_sync(self._async_handler.upload_file(key, local_path))
+
+    def download_file(self, key, local_path):
+        return run_sync(self._async_handler.download_file(key, local_path))
+
+    def get_file_timestamp(self, key):
+        return run_sync(self._async_handler.get_file_timestamp(key))
+
+    def delete_file(self, key, shallow=True):
+        self._invalidate_metadata(key)
+        return run_sync(self._async_handler.delete_file(key))
+
+    def list_files(self, prefix: str) -> List[str]:
+        return run_sync(self._async_handler.list_files(prefix))
+
+    def cleanup(self):
+        run_sync(self._async_handler.close())
@@ -135,6 +135,12 @@ def _compression_to_extension_taropt(compression):
     if compression == 'lzop':
         return '.lzop', '--lzop'
 
+    if compression == 'zstd':
+        return '.zst', '--zstd'
+
+    if compression == 'lz4':
+        return '.lz4', '--use-compress-program=lz4'
+
     if compression == 'none':
         return '', ''
 
@@ -222,6 +228,24 @@ def str2duration(sval):
     return parse_duration(sval.lower())
 
 
+size_regex = re.compile(r'\A\s*(?P<value>\d+(\.\d+)?)\s*(?P<unit>[kmgt]?)b?\s*\Z')
+size_units = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def str2size(sval):
+    """
+    Parse size values like 1048576, '512k', '64m' or '2g' into bytes.
+    """
+    if sval is None:
+        return None
+    if isinstance(sval, (int, float)):
+        return int(sval)
+    parts = size_regex.match(sval.lower())
+    if not parts:
+        raise ValueError('Invalid size value {0}'.format(sval))
+    return int(float(parts.group('value')) * size_units[parts.group('unit')])
+
+
 def get_temp_filename() -> str:
     return os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))
 
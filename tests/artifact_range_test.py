@@ -0,0 +1,84 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from studio.artifacts import artifacts_tracker
+from studio.artifacts.artifact import Artifact
+from studio.storage import storage_setup
+from studio.storage.local_storage_handler import LocalStorageHandler
+
+OUTPUT_KEY = 'experiments/range_test/output.tar'
+MODELDIR_KEY = 'experiments/range_test/modeldir.tar'
+
+
+class ArtifactRangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_home = os.environ.get(artifacts_tracker.STUDIOML_HOME)
+        os.environ[artifacts_tracker.STUDIOML_HOME] = \
+            os.path.join(self.tmp_dir, 'home')
+        self.log = b''.join(b'line %d\n' % i for i in range(10000))
+
+    def tearDown(self):
+        storage_setup.reset_storage()
+        if self.old_home is None:
+            del os.environ[artifacts_tracker.STUDIOML_HOME]
+        else:
+            os.environ[artifacts_tracker.STUDIOML_HOME] = self.old_home
+        shutil.rmtree(self.tmp_dir)
+
+    def _setup_store(self, compression=None):
+        store = LocalStorageHandler({'endpoint': self.tmp_dir,
+                                     'bucket': 'store',
+                                     'compression': compression})
+        storage_setup.setup_storage(None, store)
+
+    def _upload_output(self):
+        local_path = artifacts_tracker.get_artifact_cache(OUTPUT_KEY)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, 'wb') as f:
+            f.write(self.log)
+        Artifact('output', {'key': OUTPUT_KEY, 'local': local_path,
+                            'mutable': True}).upload()
+        return Artifact('output', {'key': OUTPUT_KEY, 'mutable': True})
+
+    def test_ranged_read(self):
+        self._setup_store()
+        art = self._upload_output()
+        with mock.patch.object(Artifact, '_read_streamed_member') as streamed:
+            self.assertEqual(art.read_tail(100), self.log[-100:])
+            self.assertEqual(art.read_range(10, 20), self.log[10:30])
+            self.assertEqual(art.read_tail(10 ** 6), self.log)
+            self.assertEqual(art.read_range(len(self.log) + 1), b'')
+            streamed.assert_not_called()
+
+    def test_compressed_fallback(self):
+        self._setup_store('gzip')
+        art = self._upload_output()
+        self.assertEqual(art.read_tail(100), self.log[-100:])
+        self.assertEqual(art.read_range(10, 20), self.log[10:30])
+
+    def test_directory_members(self):
+        self._setup_store()
+        local_path = artifacts_tracker.get_artifact_cache(MODELDIR_KEY)
+        os.makedirs(os.path.join(local_path, 'logs'))
+        with open(os.path.join(local_path, 'logs', 'a.log'), 'wb') as f:
+            f.write(os.urandom(100000))
+        with open(os.path.join(local_path, 'logs', 'b.log'), 'wb') as f:
+            f.write(self.log)
+        Artifact('modeldir', {'key': MODELDIR_KEY, 'local': local_path,
+                              'mutable': True}).upload()
+
+        art = Artifact('modeldir', {'key': MODELDIR_KEY, 'mutable': True})
+        with mock.patch.object(Artifact, '_read_streamed_member') as streamed:
+            self.assertEqual(art.read_tail(100, member='logs/b.log'),
+                             self.log[-100:])
+            streamed.assert_not_called()
+        self.assertIsNone(art.read_tail(100, member='logs/c.log'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import asyncio
+import os
+import shutil
+import tempfile
+
+from studio.storage.async_storage_handler import ThreadedAsyncStorageHandler, \
+    gather_limited, run_sync
+from studio.storage.async_storage_handler_factory import get_async_handler
+from studio.storage.local_storage_handler import LocalStorageHandler
+from studio.storage.sync_storage_handler import SyncStorageHandler
+
+
+class AsyncStorageHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.handler = LocalStorageHandler({'endpoint': self.tmp_dir,
+                                            'bucket': 'store'})
+        self.files = dict()
+        for i in range(50):
+            path = os.path.join(self.tmp_dir, 'file{0}.txt'.format(i))
+            with open(path, 'w') as f:
+                f.write('content {0}'.format(i))
+            self.files['objects/{0:03d}.txt'.format(i)] = path
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_threaded_handler(self):
+        async_handler = get_async_handler(self.handler, threads=4)
+        self.assertIsInstance(async_handler, ThreadedAsyncStorageHandler)
+        keys = sorted(self.files.keys())
+
+        async def _round_trip():
+            await async_handler.upload_files(self.files.items())
+            listed = await async_handler.list_files('objects/0')
+            timestamps = await async_handler.get_file_timestamps(
+                keys + ['objects/missing.txt'])
+            downloaded = await async_handler.download_files(
+                [(key, os.path.join(self.tmp_dir, 'out', key))
+                 for key in keys])
+            await async_handler.delete_files(keys[:10])
+            rest = await async_handler.list_files('objects/')
+            await async_handler.close()
+            return listed, timestamps, downloaded, rest
+
+        listed, timestamps, downloaded, rest = run_sync(_round_trip())
+        self.assertEqual(listed, keys[:50])
+        self.assertIsNone(timestamps['objects/missing.txt'])
+        self.assertTrue(all(timestamps[key] is not None for key in keys))
+        self.assertTrue(all(downloaded))
+        with open(os.path.join(self.tmp_dir, 'out', keys[7])) as f:
+            self.assertEqual(f.read(), 'content 7')
+        self.assertEqual(rest, keys[10:])
+
+    def test_sync_adapter(self):
+        handler = SyncStorageHandler(ThreadedAsyncStorageHandler(self.handler))
+        key, path = 'objects/000.txt', self.files['objects/000.txt']
+        self.assertIsNone(handler.get_cached_file_timestamp(key))
+        handler.upload_file(key, path)
+        self.assertEqual(handler.get_file_timestamps([key, 'other']),
+                         {key: os.path.getmtime(
+                             self.handler._get_file_path_from_key(key)),
+                          'other': None})
+        local_path = os.path.join(self.tmp_dir, 'copy.txt')
+        self.assertTrue(handler.download_file(key, local_path))
+        self.assertEqual(handler.list_files('objects/'), [key])
+        handler.delete_file(key)
+        self.assertEqual(handler.list_files('objects/'), [])
+        handler.cleanup()
+
+    def test_gather_limited(self):
+        running = [0, 0]
+
+        async def _task(i):
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+            await asyncio.sleep(0.001)
+            running[0] -= 1
+            return i
+
+        result = run_sync(gather_limited([_task(i) for i in range(100)], 7))
+        self.assertEqual(result, list(range(100)))
+        self.assertEqual(running[1], 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
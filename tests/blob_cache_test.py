@@ -0,0 +1,92 @@
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from studio.artifacts.blob_cache import BlobCache
+
+
+class BlobCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _put_blob(self, cache, name, size):
+        os.makedirs(cache.get_path(name))
+        with open(os.path.join(cache.get_path(name), 'data'), 'wb') as f:
+            f.write(b'x' * size)
+        cache.add(name)
+        # Keep access times distinct:
+        time.sleep(0.01)
+
+    def test_lru_eviction(self):
+        cache = BlobCache(root=self.root, max_size=2500)
+        self._put_blob(cache, 'a', 1000)
+        self._put_blob(cache, 'b', 1000)
+        self.assertTrue(cache.lookup('a'))
+        self._put_blob(cache, 'c', 1000)
+
+        self.assertFalse(os.path.exists(cache.get_path('b')))
+        self.assertFalse(cache.lookup('b'))
+        self.assertTrue(cache.lookup('a'))
+        self.assertTrue(cache.lookup('c'))
+
+        stats = cache.get_stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['evicted_bytes'], 1000)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['size'], 2000)
+
+    def test_lfu_eviction(self):
+        cache = BlobCache(root=self.root, max_size=2500, policy='lfu')
+        self._put_blob(cache, 'a', 1000)
+        self._put_blob(cache, 'b', 1000)
+        cache.lookup('a')
+        cache.lookup('a')
+        cache.lookup('b')
+        self._put_blob(cache, 'c', 1000)
+        self.assertTrue(os.path.exists(cache.get_path('a')))
+        self.assertFalse(os.path.exists(cache.get_path('b')))
+
+    def test_pinned_blob_is_kept(self):
+        cache = BlobCache(root=self.root, max_size=1500)
+        self._put_blob(cache, 'a', 1000)
+        cache.pin(os.path.join(cache.get_path('a'), 'data'))
+        self._put_blob(cache, 'b', 1000)
+        self.assertTrue(os.path.exists(cache.get_path('a')))
+        self.assertTrue(os.path.exists(cache.get_path('b')))
+
+        cache.unpin(cache.get_path('a'))
+        self.assertEqual(len(cache.evict()), 1)
+        self.assertFalse(os.path.exists(cache.get_path('a')))
+
+    def test_pin_of_dead_process_is_dropped(self):
+        cache = BlobCache(root=self.root, max_size=1500)
+        self._put_blob(cache, 'a', 1000)
+        proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+        proc.wait()
+        cache.pin(cache.get_path('a'), owner=proc.pid)
+        self._put_blob(cache, 'b', 1000)
+        self.assertFalse(os.path.exists(cache.get_path('a')))
+
+    def test_existing_blobs_are_indexed(self):
+        os.makedirs(os.path.join(self.root, 'old'))
+        with open(os.path.join(self.root, 'old', 'data'), 'wb') as f:
+            f.write(b'x' * 100)
+        os.makedirs(os.path.join(self.root, 'chunks'))
+        cache = BlobCache(root=self.root)
+        stats = cache.get_stats()
+        self.assertEqual(stats['blobs'], 1)
+        self.assertEqual(stats['size'], 100)
+        self.assertIsNone(cache.get_name(os.path.join(self.root, 'chunks')))
+
+
+if __name__ == "__main__":
+    unittest.main()
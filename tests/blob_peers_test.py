@@ -0,0 +1,164 @@
+import unittest
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from unittest import mock
+
+from studio.artifacts import artifacts_tracker, blob_peers
+from studio.artifacts.artifact import Artifact
+from studio.artifacts.blob_cache import BlobCache
+from studio.artifacts.blob_peers import BlobServer, fetch_from_peers, \
+    get_peer_urls, setup_blob_peers
+from studio.artifacts.workspace_hash import workspace_hash
+from studio.db_providers.local_db_provider import LocalDbProvider
+from studio.storage import storage_setup
+from studio.storage.local_storage_handler import LocalStorageHandler
+from studio.util import logs
+
+
+class BlobPeersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_home = os.environ.get(artifacts_tracker.STUDIOML_HOME)
+        os.environ[artifacts_tracker.STUDIOML_HOME] = \
+            os.path.join(self.tmp_dir, 'home')
+        self.logger = logs.get_logger('BlobPeersTest')
+
+        # Blob cache of the peer worker:
+        self.peer_cache = BlobCache(root=os.path.join(self.tmp_dir, 'peer'))
+        self._write('abc/main.py', 'print(1)')
+        self._write('abc/data/a.txt', 'a' * 10000)
+        self._write('single', 'single file blob')
+        # Blobs are named by their content hash:
+        self.dir_blob = self._rename_to_hash('abc')
+        self.file_blob = self._rename_to_hash('single')
+        self.patcher = mock.patch.object(blob_peers, 'get_blob_cache',
+                                         return_value=self.peer_cache)
+        self.patcher.start()
+        self.server = BlobServer(host='127.0.0.1', port=0,
+                                 advertise='127.0.0.1')
+        self.server.start()
+        setup_blob_peers({'peers': [self.server.url]})
+
+    def tearDown(self):
+        self.server.stop()
+        self.patcher.stop()
+        setup_blob_peers(None)
+        storage_setup.reset_storage()
+        if self.old_home is None:
+            del os.environ[artifacts_tracker.STUDIOML_HOME]
+        else:
+            os.environ[artifacts_tracker.STUDIOML_HOME] = self.old_home
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, rel_path, data):
+        path = self.peer_cache.get_path(rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def _rename_to_hash(self, name):
+        path = self.peer_cache.get_path(name)
+        blob_name = workspace_hash(path)
+        os.rename(path, self.peer_cache.get_path(blob_name))
+        return blob_name
+
+    def _read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_fetch(self):
+        local_path = os.path.join(self.tmp_dir, 'out', 'abc')
+        self.assertTrue(fetch_from_peers(self.dir_blob, local_path,
+                                         self.logger))
+        self.assertEqual(self._read(os.path.join(local_path, 'data', 'a.txt')),
+                         'a' * 10000)
+        self.assertEqual(self._read(os.path.join(local_path, 'main.py')),
+                         'print(1)')
+
+        local_path = os.path.join(self.tmp_dir, 'out', 'single')
+        self.assertTrue(fetch_from_peers(self.file_blob, local_path,
+                                         self.logger))
+        self.assertEqual(self._read(local_path), 'single file blob')
+
+        for name in ['missing', '.index.json', '..%2Fpeer']:
+            self.assertFalse(fetch_from_peers(
+                name, os.path.join(self.tmp_dir, 'out', 'x'), self.logger))
+        # Served blobs are unpinned after the transfer:
+        self.assertEqual(
+            self.peer_cache._load_index()['blobs'][self.dir_blob]['pins'], {})
+
+    def test_corrupt_blob_is_discarded(self):
+        # Peer has different content under the name:
+        with open(os.path.join(self.peer_cache.get_path(self.dir_blob),
+                               'main.py'), 'w') as f:
+            f.write('print(2)')
+        local_path = os.path.join(self.tmp_dir, 'out', self.dir_blob)
+        self.assertFalse(fetch_from_peers(self.dir_blob, local_path,
+                                          self.logger))
+        self.assertFalse(os.path.exists(local_path))
+
+    def test_unsafe_tarball_is_not_extracted(self):
+        escape_path = os.path.join(self.tmp_dir, 'escaped.txt')
+
+        def write_tarball(local_path, key, compression, fileobj, logger,
+                          **kwargs):
+            with tarfile.open(fileobj=fileobj, mode='w|') as tf:
+                for name, kind in [('ok.txt', tarfile.REGTYPE),
+                                   ('../../escaped.txt', tarfile.REGTYPE),
+                                   ('link', tarfile.SYMTYPE),
+                                   ('fifo', tarfile.FIFOTYPE)]:
+                    info = tarfile.TarInfo(name)
+                    info.type = kind
+                    if kind == tarfile.SYMTYPE:
+                        info.linkname = '/etc'
+                    tf.addfile(info, io.BytesIO(b''))
+
+        local_path = os.path.join(self.tmp_dir, 'out', self.dir_blob)
+        with mock.patch.object(blob_peers, 'tar_artifact_to_stream',
+                               side_effect=write_tarball):
+            self.assertFalse(fetch_from_peers(self.dir_blob, local_path,
+                                              self.logger))
+        self.assertFalse(os.path.exists(escape_path))
+        self.assertFalse(os.path.exists(local_path))
+        # Nothing is left next to the blob either:
+        self.assertEqual(os.listdir(os.path.dirname(local_path)), [])
+
+    def test_artifact_download(self):
+        store = LocalStorageHandler({'endpoint': self.tmp_dir,
+                                     'bucket': 'store'})
+        storage_setup.setup_storage(None, store)
+        art = Artifact('data', {'key': 'blobstore/' + self.dir_blob + '.tar',
+                                'mutable': False})
+        with mock.patch.object(store, 'download_file') as download_file:
+            local_path = art.download()
+            download_file.assert_not_called()
+        self.assertEqual(local_path,
+                         artifacts_tracker.get_blob_cache(self.dir_blob))
+        self.assertEqual(self._read(os.path.join(local_path, 'main.py')),
+                         'print(1)')
+
+    def test_db_discovery(self):
+        db = LocalDbProvider({'endpoint': self.tmp_dir, 'bucket': 'meta'})
+        db.register_blob_peer('fresh', 'http://10.0.0.1:7071')
+        db._set(db._get_blob_peers_keybase() + 'stale',
+                {'url': 'http://10.0.0.2:7071', 'time': time.time() - 3600})
+        self.assertEqual(db.get_blob_peers(max_age=300),
+                         ['http://10.0.0.1:7071'])
+
+        storage_setup.setup_storage(db, None)
+        setup_blob_peers({'discovery': 'db', 'peers': [self.server.url]})
+        self.assertEqual(get_peer_urls(),
+                         [self.server.url, 'http://10.0.0.1:7071'])
+        self.assertEqual(get_peer_urls(exclude=self.server.url),
+                         ['http://10.0.0.1:7071'])
+        db.unregister_blob_peer('fresh')
+        self.assertEqual(db.get_blob_peers(max_age=300), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from studio.checkpoint_uploader import CheckpointUploader, snapshot_artifact
+from studio.storage.ignore_matcher import IGNORE_FILE_NAME
+
+
+class CheckpointUploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'uploads')
+        self.model_dir = os.path.join(self.tmp_dir, 'modeldir')
+        self._write('weights.bin', 'w' * 1000)
+        self._write('logs/train.log', 'epoch 1\n')
+        self.experiment = SimpleNamespace(key='exp1', artifacts={
+            'modeldir': SimpleNamespace(is_mutable=True,
+                                        local_path=self.model_dir),
+            'workspace': SimpleNamespace(is_mutable=False,
+                                         local_path=self.tmp_dir)})
+        self.uploaded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, rel_path, data):
+        path = os.path.join(self.model_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(data)
+        os.utime(path, (1000000000, 1000000000))
+
+    def _record_upload(self, job):
+        staged_path = job['artifacts']['modeldir']
+        with open(os.path.join(staged_path, 'logs', 'train.log')) as f:
+            self.uploaded.append((job['final'], f.read()))
+
+    def test_snapshot(self):
+        self._write(IGNORE_FILE_NAME, '*.tmp\n')
+        self._write('scratch.tmp', 'x')
+        staged_path = os.path.join(self.tmp_dir, 'staged')
+        snapshot_artifact(self.model_dir, staged_path, hardlink=False)
+        self.assertEqual(sorted(os.listdir(staged_path)),
+                         [IGNORE_FILE_NAME, 'logs', 'weights.bin'])
+        staged_file = os.path.join(staged_path, 'weights.bin')
+        self.assertEqual(os.stat(staged_file).st_mtime, 1000000000)
+        self.assertFalse(os.path.samefile(
+            staged_file, os.path.join(self.model_dir, 'weights.bin')))
+
+    def test_upload_from_snapshot(self):
+        with mock.patch.object(CheckpointUploader, '_upload',
+                               side_effect=self._record_upload):
+            uploader = CheckpointUploader(root=self.root)
+            uploader.submit(self.experiment, {})
+            # Artifact keeps changing after the snapshot:
+            self._write('logs/train.log', 'epoch 2\n')
+            uploader.submit(self.experiment, {}, final=True)
+            uploader.wait()
+        self.assertEqual(self.uploaded[-1], (True, 'epoch 2\n'))
+        self.assertEqual(os.listdir(os.path.join(self.root, 'journal')), [])
+        self.assertEqual(os.listdir(os.path.join(self.root, 'staging')), [])
+
+    def test_unchanged_files_are_linked_from_previous_snapshot(self):
+        staged = []
+
+        def record_inodes(job):
+            staged_path = job['artifacts']['modeldir']
+            staged.append({name: os.stat(os.path.join(staged_path, name))
+                           for name in ('weights.bin', 'logs/train.log')})
+
+        with mock.patch.object(CheckpointUploader, '_upload',
+                               side_effect=record_inodes):
+            uploader = CheckpointUploader(root=self.root)
+            uploader.submit(self.experiment, {})
+            uploader.wait()
+            self._write('logs/train.log', 'epoch 2\n')
+            os.utime(os.path.join(self.model_dir, 'logs', 'train.log'),
+                     (1000000001, 1000000001))
+            uploader.submit(self.experiment, {})
+            uploader.wait()
+        first, second = staged
+        self.assertEqual(first['weights.bin'].st_ino,
+                         second['weights.bin'].st_ino)
+        self.assertNotEqual(first['logs/train.log'].st_ino,
+                            second['logs/train.log'].st_ino)
+        live = os.stat(os.path.join(self.model_dir, 'weights.bin'))
+        self.assertNotEqual(live.st_ino, second['weights.bin'].st_ino)
+
+    def test_failed_final_upload_is_kept(self):
+        with mock.patch.object(CheckpointUploader, '_upload',
+                               side_effect=IOError('connection reset')):
+            uploader = CheckpointUploader(root=self.root, retries=1,
+                                          retry_sleep=0)
+            job_id = uploader.submit(self.experiment, {}, final=True)
+            uploader.wait()
+        self.assertEqual(os.listdir(os.path.join(self.root, 'journal')),
+                         [job_id + '.json'])
+
+        with mock.patch.object(CheckpointUploader, '_upload',
+                               side_effect=self._record_upload):
+            CheckpointUploader(root=self.root).wait()
+        self.assertEqual(self.uploaded, [(True, 'epoch 1\n')])
+        self.assertEqual(os.listdir(os.path.join(self.root, 'journal')), [])
+
+    def test_journal_has_no_credentials(self):
+        storage = {'type': 's3', 'bucket': 'store',
+                   'credentials': {'aws': {'secret_access_key': 'secret'}}}
+        config = {'database': {'type': 'local', 'bucket': 'db'},
+                  'storage': storage,
+                  'env': {'AWS_SECRET_ACCESS_KEY': 'secret'}}
+        with mock.patch.object(CheckpointUploader, '_upload',
+                               side_effect=IOError('connection reset')):
+            uploader = CheckpointUploader(root=self.root, retries=1,
+                                          retry_sleep=0)
+            job_id = uploader.submit(self.experiment, config, final=True)
+            uploader.wait()
+        journal_path = os.path.join(self.root, 'journal', job_id + '.json')
+        self.assertEqual(os.stat(journal_path).st_mode & 0o777, 0o600)
+        with open(journal_path) as f:
+            self.assertNotIn('secret', f.read())
+
+        configs = []
+        with mock.patch.object(CheckpointUploader, '_upload',
+                               side_effect=lambda job: configs.append(
+                                   job['config'])):
+            CheckpointUploader(root=self.root, config=config).wait()
+        # Credentials are taken from config of the resuming worker:
+        self.assertEqual(configs, [{'database': config['database'],
+                                    'storage': storage}])
+
+    def test_retries(self):
+        calls = []
+
+        def flaky_upload(job):
+            calls.append(job['id'])
+            if len(calls) == 1:
+                raise IOError('connection reset')
+            self._record_upload(job)
+
+        with mock.patch.object(CheckpointUploader, '_upload',
+                               side_effect=flaky_upload):
+            uploader = CheckpointUploader(root=self.root, retry_sleep=0)
+            uploader.submit(self.experiment, {}, final=True)
+            uploader.wait()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.uploaded, [(True, 'epoch 1\n')])
+
+    def test_pending_uploads_are_resumed(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def stuck_upload(job):
+            started.set()
+            release.wait()
+
+        with mock.patch.object(CheckpointUploader, '_upload',
+                               side_effect=stuck_upload):
+            uploader = CheckpointUploader(root=self.root)
+            job_id = uploader.submit(self.experiment, {}, final=True)
+            started.wait()
+
+        # Simulate worker which died with upload in progress:
+        journal_path = os.path.join(self.root, 'journal', job_id + '.json')
+        with open(journal_path) as f:
+            job = json.load(f)
+        job['owner'] = None
+        with open(journal_path, 'w') as f:
+            json.dump(job, f)
+
+        with mock.patch.object(CheckpointUploader, '_upload',
+                               side_effect=self._record_upload):
+            CheckpointUploader(root=self.root).wait()
+        release.set()
+        self.assertEqual(self.uploaded, [(True, 'epoch 1\n')])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+import uuid
+
+from studio.artifacts import artifacts_tracker
+from studio.storage import chunker
+from studio.storage.chunked_storage_handler import ChunkedStorageHandler
+from studio.storage.local_storage_handler import LocalStorageHandler
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ChunkedStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_home = os.environ.get(artifacts_tracker.STUDIOML_HOME)
+        os.environ[artifacts_tracker.STUDIOML_HOME] = \
+            os.path.join(self.tmp_dir, 'home')
+        base_handler = LocalStorageHandler({'endpoint': self.tmp_dir,
+                                            'bucket': 'store'})
+        self.handler = ChunkedStorageHandler(base_handler,
+                                             {'chunk_size': CHUNK_SIZE})
+
+    def tearDown(self):
+        if self.old_home is None:
+            del os.environ[artifacts_tracker.STUDIOML_HOME]
+        else:
+            os.environ[artifacts_tracker.STUDIOML_HOME] = self.old_home
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_file(self, data):
+        path = os.path.join(self.tmp_dir, str(uuid.uuid4()))
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _stored_chunks(self):
+        chunks_dir = os.path.join(self.tmp_dir, 'store', 'chunks')
+        return set(os.listdir(chunks_dir))
+
+    def test_chunks_survive_insertion(self):
+        data = random.Random(0).randbytes(2 * 1024 * 1024)
+        path1 = self._write_file(data)
+        path2 = self._write_file(data[:1000] + b'inserted' + data[1000:])
+
+        chunks1 = [length for _, length in
+                   chunker.iter_chunks(path1, CHUNK_SIZE)]
+        chunks2 = [length for _, length in
+                   chunker.iter_chunks(path2, CHUNK_SIZE)]
+
+        self.assertEqual(sum(chunks1), len(data))
+        self.assertGreater(len(chunks1), 4)
+        # Only the first chunk is affected by insertion:
+        self.assertEqual(chunks1[1:], chunks2[1:])
+
+    def test_upload_download_dedup(self):
+        data = os.urandom(1024 * 1024)
+        path = self._write_file(data)
+        self.handler.upload_file('experiments/test/modeldir.tar', path)
+        stored_before = self._stored_chunks()
+
+        changed_path = self._write_file(data + b'appended')
+        self.handler.upload_file('experiments/test2/modeldir.tar',
+                                 changed_path)
+        stored_after = self._stored_chunks()
+        self.assertLessEqual(len(stored_after - stored_before), 1)
+
+        local_path = os.path.join(self.tmp_dir, 'downloaded')
+        self.assertTrue(self.handler.download_file(
+            'experiments/test2/modeldir.tar', local_path))
+        with open(local_path, 'rb') as f:
+            self.assertEqual(f.read(), data + b'appended')
+
+
+if __name__ == "__main__":
+    unittest.main()
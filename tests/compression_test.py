@@ -0,0 +1,85 @@
+import unittest
+import filecmp
+import gzip
+import os
+import shutil
+import tarfile
+import tempfile
+
+from studio.storage import compression, storage_util
+from studio.util import logs
+
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.logger = logs.get_logger('CompressionTest')
+        self.art_dir = os.path.join(self.tmp_dir, 'art')
+        os.makedirs(os.path.join(self.art_dir, 'sub'))
+        with open(os.path.join(self.art_dir, 'log.txt'), 'w') as f:
+            f.write('epoch 1 loss 0.5\n' * 100000)
+        with open(os.path.join(self.art_dir, 'sub', 'data.bin'), 'wb') as f:
+            f.write(os.urandom(100000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _assert_same_dirs(self, dir1, dir2):
+        cmp = filecmp.dircmp(dir1, dir2)
+        self.assertEqual(cmp.left_only + cmp.right_only + cmp.diff_files, [])
+        self.assertEqual(cmp.subdirs['sub'].diff_files, [])
+
+    def test_roundtrip_all_codecs(self):
+        for codec in compression.get_available_codecs():
+            for threads in [1, 2]:
+                tar_filename = storage_util.tar_artifact(
+                    self.art_dir, None, codec, self.logger,
+                    cache=False, threads=threads)
+                key = 'blobstore/test.tar' + \
+                    compression.get_codec(codec).extension
+                out_dir = os.path.join(self.tmp_dir, codec + str(threads))
+                storage_util.untar_artifact(out_dir, tar_filename,
+                                            self.logger, key=key)
+                os.remove(tar_filename)
+                self._assert_same_dirs(self.art_dir, out_dir)
+
+    def test_codec_detected_without_key(self):
+        tar_filename = storage_util.tar_artifact(
+            self.art_dir, None, 'gzip', self.logger, cache=False)
+        out_dir = os.path.join(self.tmp_dir, 'out')
+        storage_util.untar_artifact(out_dir, tar_filename, self.logger)
+        os.remove(tar_filename)
+        self._assert_same_dirs(self.art_dir, out_dir)
+
+    def test_detect_codec(self):
+        head = b'BZh91AY&SY'
+        self.assertEqual(compression.detect_codec(head).name, 'bzip2')
+        # Stored uncompressed by policy, or with other codec:
+        self.assertEqual(
+            compression.detect_codec(head, 'a.tar.gz').name, 'bzip2')
+        # Plain tarball starts with name of its first member:
+        for name in ['BZh_weights.bin', ']']:
+            info = tarfile.TarInfo(name)
+            head = info.tobuf(format=tarfile.GNU_FORMAT)
+            self.assertEqual(
+                compression.detect_codec(head, 'a.tar').name, 'none')
+            self.assertEqual(compression.detect_codec(head).name, 'none')
+        # Named artifacts are stored compressed under .tar keys:
+        head = gzip.compress(b'x' * 1000)
+        self.assertEqual(
+            compression.detect_codec(head, 'a.tar').name, 'gzip')
+
+    def test_skip_compressed_content(self):
+        self.assertEqual(
+            compression.choose_compression(self.art_dir, 'gzip'), 'gzip')
+        os.rename(os.path.join(self.art_dir, 'log.txt'),
+                  os.path.join(self.art_dir, 'weights.h5'))
+        self.assertEqual(
+            compression.choose_compression(self.art_dir, 'gzip'), 'none')
+        self.assertEqual(
+            compression.choose_compression(self.art_dir, None), 'none')
+
+
+if __name__ == "__main__":
+    unittest.main()
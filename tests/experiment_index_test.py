@@ -0,0 +1,95 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from studio.db_providers.local_db_provider import LocalDbProvider
+from studio.dependencies_policies.studio_dependencies_policy import \
+    StudioDependencyPolicy
+from studio.experiments.experiment import create_experiment
+from studio.storage import storage_setup
+
+
+class ExperimentIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        storage_setup.reset_storage()
+        self.db = LocalDbProvider({'endpoint': self.tmp_dir, 'bucket': 'db',
+                                   'guest': True})
+        self.experiments = []
+        policy = StudioDependencyPolicy()
+        for i in range(7):
+            experiment = create_experiment(
+                'train.py', [], project='sweep' if i % 2 == 0 else 'other',
+                dependency_policy=policy)
+            self.experiments.append(experiment)
+        self.db.add_experiments(self.experiments)
+        # Make time order deterministic, newest last:
+        for i, experiment in enumerate(self.experiments):
+            experiment_dict = experiment.to_dict()
+            self.db._delete_many(self.db._get_index_entries(experiment_dict))
+            experiment.time_added = 1000.0 + i
+            experiment_dict['time_added'] = experiment.time_added
+            self.db._set_many(self.db._get_index_entries(experiment_dict))
+            self.db._set(self.db._get_experiments_keybase() + experiment.key,
+                         experiment_dict)
+
+    def tearDown(self):
+        storage_setup.reset_storage()
+        shutil.rmtree(self.tmp_dir)
+
+    def _keys(self, **query):
+        return [summary['key'] for page in self.db.iter_experiments(**query)
+                for summary in page]
+
+    def test_query(self):
+        newest_first = [e.key for e in reversed(self.experiments)]
+        summaries, token = self.db.query_experiments(page_size=3)
+        self.assertEqual([s['key'] for s in summaries], newest_first[:3])
+        self.assertEqual(summaries[0]['status'], 'waiting')
+        summaries, token = self.db.query_experiments(page_size=3,
+                                                     page_token=token)
+        self.assertEqual([s['key'] for s in summaries], newest_first[3:6])
+        summaries, token = self.db.query_experiments(page_size=3,
+                                                     page_token=token)
+        self.assertEqual([s['key'] for s in summaries], newest_first[6:])
+        self.assertIsNone(token)
+
+        self.assertEqual(self._keys(project='sweep', page_size=2),
+                         newest_first[0::2])
+        self.assertEqual(self._keys(owner='guest'), newest_first)
+        self.assertEqual(self._keys(owner='other'), [])
+
+    def test_status_changes(self):
+        first, second, third = self.experiments[:3]
+        self.db.start_experiment(first)
+        self.db.start_experiment(second)
+        self.db.finish_experiment(second)
+        self.db.stop_experiment(third.key)
+
+        self.assertEqual(self._keys(status='running'), [first.key])
+        self.assertEqual(self._keys(status='finished'), [second.key])
+        self.assertEqual(self._keys(status='stopped'), [third.key])
+        self.assertEqual(len(self._keys(status='waiting')), 4)
+        self.assertEqual(self._keys(status='running', project='sweep'),
+                         [first.key])
+        self.assertEqual(self._keys(status='running', project='other'), [])
+
+        self.db.delete_experiment(first.key)
+        self.assertEqual(self._keys(status='running'), [])
+        self.assertNotIn(first.key, self._keys())
+
+    def test_rebuild(self):
+        self.assertTrue(self.db.has_indexes())
+        shutil.rmtree(os.path.join(self.tmp_dir, 'db', 'indexes'))
+        self.assertEqual(self._keys(), [])
+        self.assertFalse(self.db.has_indexes())
+        self.assertEqual(self.db.rebuild_indexes(), len(self.experiments))
+        self.assertTrue(self.db.has_indexes())
+        self.assertEqual(self._keys(),
+                         [e.key for e in reversed(self.experiments)])
+
+
+if __name__ == "__main__":
+    unittest.main()
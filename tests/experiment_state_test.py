@@ -0,0 +1,315 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+from studio.db_providers.local_db_provider import LocalDbProvider
+from studio.db_providers import s3_provider
+from studio.db_providers.s3_provider import S3Provider
+from studio.db_providers.sqlite_provider import SQLiteProvider
+from studio.dependencies_policies.studio_dependencies_policy import \
+    StudioDependencyPolicy
+from studio.experiments.experiment import create_experiment, \
+    experiment_from_dict
+from studio.storage import storage_setup
+
+
+class ExperimentStateTests:
+
+    def _add(self, key, time_added=1000.0, with_state=True):
+        record = {'key': key, 'filename': 'train.py', 'pythonenv': [],
+                  'project': 'sweep', 'owner': 'guest', 'status': 'waiting',
+                  'time_added': time_added, 'artifacts': {}}
+        records = {self.db._get_experiments_keybase() + key: record}
+        if with_state:
+            records[self.db._get_states_keybase() + key] = \
+                {'status': 'waiting'}
+        records.update(self.db._get_index_entries(record))
+        self.db._set_many(records)
+        return experiment_from_dict(record)
+
+    def _keys(self, status):
+        summaries, _ = self.db.query_experiments(status=status)
+        return [summary['key'] for summary in summaries]
+
+    def test_set_if(self):
+        self.assertTrue(self.db._set_if('states/a', {'n': 1}, None))
+        self.assertFalse(self.db._set_if('states/a', {'n': 2}, None))
+        value, version = self.db._get_versioned('states/a')
+        self.assertEqual(value, {'n': 1})
+        self.assertTrue(self.db._set_if('states/a', {'n': 3}, version))
+        self.assertFalse(self.db._set_if('states/a', {'n': 4}, version))
+        self.assertEqual(self.db._get('states/a'), {'n': 3})
+        self.assertEqual(self.db._get_versioned('states/b'), (None, None))
+
+    def test_lifecycle(self):
+        experiment = self._add('exp1')
+        record_key = self.db._get_experiments_keybase() + 'exp1'
+        record = self.db._get(record_key)
+
+        self.db.start_experiment(experiment)
+        self.db.checkpoint_experiment(experiment)
+        stored = self.db.get_experiment('exp1', getinfo=False)
+        self.assertEqual(stored.status, 'running')
+        self.assertEqual(stored.time_last_checkpoint,
+                         experiment.time_last_checkpoint)
+        self.assertEqual(self._keys('running'), ['exp1'])
+        # Experiment record itself is written once:
+        self.assertEqual(self.db._get(record_key), record)
+
+        self.db.stop_experiment('exp1')
+        self.assertEqual(self._keys('running'), [])
+        self.assertEqual(self._keys('stopped'), ['exp1'])
+        self.db.finish_experiment(experiment)
+        stored = self.db.get_experiment('exp1', getinfo=False)
+        self.assertEqual(stored.status, 'finished')
+        self.assertEqual(self._keys('finished'), ['exp1'])
+
+        self.db.delete_experiment(experiment)
+        self.assertIsNone(self.db.get_experiment('exp1'))
+        self.assertIsNone(self.db._get('states/exp1'))
+        self.assertEqual(self._keys('finished'), [])
+
+    def test_spec_and_state(self):
+        experiment = create_experiment(
+            'train.py', [], project='sweep',
+            dependency_policy=StudioDependencyPolicy())
+        self.db.add_experiments([experiment])
+        spec = self.db._get(self.db._get_experiments_keybase() +
+                            experiment.key)
+        self.assertEqual(spec['pythonenv'], experiment.pythonenv)
+        self.assertNotIn('status', spec)
+        self.assertNotIn('time_last_checkpoint', spec)
+
+        self.db.checkpoint_experiment(experiment)
+        with mock.patch.object(self.db, '_get',
+                               side_effect=self.db._get) as get:
+            state = self.db.get_experiment_state(experiment.key)
+            get.assert_called_once_with(
+                self.db._get_states_keybase() + experiment.key)
+        self.assertEqual(state['status'], 'waiting')
+        self.assertEqual(state['time_last_checkpoint'],
+                         experiment.time_last_checkpoint)
+        with mock.patch.object(self.db, '_get_many',
+                               side_effect=self.db._get_many) as get_many:
+            stored = self.db.get_experiment(experiment.key, getinfo=False)
+            get_many.assert_called_once()
+        self.assertEqual(stored.time_last_checkpoint,
+                         experiment.time_last_checkpoint)
+        self.assertEqual(stored.pythonenv, experiment.pythonenv)
+
+        self.db.delete_experiment(experiment.key)
+        self.assertIsNone(self.db.get_experiment_state(experiment.key))
+        self.assertIsNone(self.db.get_experiment(experiment.key))
+
+    def test_listed_status(self):
+        self._add('exp1')
+        # Index entries have not been moved yet:
+        self.db._set(self.db._get_states_keybase() + 'exp1',
+                     {'status': 'running'})
+        summaries, _ = self.db.query_experiments()
+        self.assertEqual(summaries[0]['status'], 'running')
+        self.assertEqual(self._keys('waiting'), [])
+
+    def test_stopped_before_start(self):
+        experiment = self._add('exp1')
+        self.db.stop_experiment('exp1')
+        self.db.start_experiment(experiment)
+        self.assertEqual(experiment.status, 'stopped')
+        self.assertEqual(
+            self.db.get_experiment('exp1', getinfo=False).status, 'stopped')
+
+    def test_legacy_experiment(self):
+        # Experiment added before states were kept separately:
+        self._add('exp1', with_state=False)
+        self.assertEqual(
+            self.db.get_experiment('exp1', getinfo=False).status, 'waiting')
+        self.db.stop_experiment('exp1')
+        self.assertEqual(
+            self.db.get_experiment('exp1', getinfo=False).status, 'stopped')
+        self.assertEqual(self._keys('stopped'), ['exp1'])
+        self.assertEqual(self._keys('waiting'), [])
+
+    def test_conflicting_updates(self):
+        experiment = self._add('exp1')
+        self.db.start_experiment(experiment)
+        updates = []
+        real_set_if = self.db._set_if
+
+        def set_if(key, value, version):
+            # Stop arrives between read and write of every checkpoint:
+            if not updates:
+                updates.append(key)
+                self.db.stop_experiment('exp1')
+            return real_set_if(key, value, version)
+
+        with mock.patch.object(self.db, '_set_if', side_effect=set_if):
+            self.db.checkpoint_experiment(experiment)
+        stored = self.db.get_experiment('exp1', getinfo=False)
+        self.assertEqual(stored.status, 'stopped')
+        self.assertEqual(stored.time_last_checkpoint,
+                         experiment.time_last_checkpoint)
+
+    def test_concurrent_updates(self):
+        experiment = self._add('exp1')
+        self.db.start_experiment(experiment)
+        threads = [threading.Thread(
+            target=self.db.checkpoint_experiment, args=(experiment,))
+            for _ in range(8)]
+        threads.append(threading.Thread(
+            target=self.db.stop_experiment, args=('exp1',)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            self.db.get_experiment('exp1', getinfo=False).status, 'stopped')
+
+    def test_watch(self):
+        self._add('exp1')
+        self._add('exp2')
+        cursor = self.db.get_change_cursor()
+        self.db.start_experiment(self.db.get_experiment('exp1'))
+        self.db.stop_experiment('exp2')
+        self.db._set('users/guest/email', 'guest@studio.ml')
+
+        events = list(self.db.watch('states/', since=cursor, timeout=0))
+        self.assertEqual(sorted(event.key for event in events),
+                         ['states/exp1', 'states/exp2'])
+        events = list(self.db.watch('states/exp2', since=cursor, timeout=0))
+        self.assertEqual([event.key for event in events], ['states/exp2'])
+        # Watching from the last change:
+        self.assertEqual(list(self.db.watch(
+            'states/exp2', since=events[-1].cursor, timeout=0)), [])
+        with self.assertRaises(ValueError):
+            list(self.db.watch('users/', timeout=0))
+
+    def test_wait_for_experiments(self):
+        self._add('exp1')
+        self._add('exp2')
+        self.db.watch_interval = 0.05
+        cursor = self.db.get_change_cursor()
+        self.assertEqual(self.db.wait_for_experiments(
+            ['exp1', 'exp2'], cursor, 0.1), (set(), cursor))
+
+        timer = threading.Timer(0.2, self.db.stop_experiment, ('exp2',))
+        timer.start()
+        tic = time.time()
+        changed, cursor = self.db.wait_for_experiments(
+            ['exp1', 'exp2'], cursor, 30)
+        timer.join()
+        self.assertEqual(changed, {'exp2'})
+        self.assertLess(time.time() - tic, 10)
+
+        self.db.stop_experiment('exp1')
+        self.db.stop_experiment('exp2')
+        changed, _ = self.db.wait_for_experiments(['exp1'], cursor, 1)
+        self.assertEqual(changed, {'exp1'})
+
+
+class LocalStateTest(ExperimentStateTests, unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        storage_setup.reset_storage()
+        self.db = LocalDbProvider({'endpoint': self.tmp_dir, 'bucket': 'db',
+                                   'guest': True})
+
+    def tearDown(self):
+        storage_setup.reset_storage()
+        shutil.rmtree(self.tmp_dir)
+
+
+class SQLiteStateTest(ExperimentStateTests, unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        storage_setup.reset_storage()
+        self.db = SQLiteProvider({'endpoint': self.tmp_dir, 'bucket': 'db',
+                                  'guest': True})
+
+    def tearDown(self):
+        storage_setup.reset_storage()
+        shutil.rmtree(self.tmp_dir)
+
+
+@unittest.skipIf(mock_aws is None, 'moto is not installed')
+class S3StateTest(ExperimentStateTests, unittest.TestCase):
+
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ, {
+            'AWS_DEFAULT_REGION': 'us-east-1',
+            'AWS_ACCESS_KEY_ID': 'testing',
+            'AWS_SECRET_ACCESS_KEY': 'testing'})
+        self.env.start()
+        self.mock = mock_aws()
+        self.mock.start()
+        storage_setup.reset_storage()
+        self.config = {
+            'type': 's3',
+            'endpoint': 'https://s3.amazonaws.com',
+            'bucket': 'studioml-meta-' + str(uuid.uuid4())[:8],
+            'guest': True,
+            'credentials': {'aws': {'access_key': 'testing',
+                                    'secret_access_key': 'testing'}}}
+        self.db = S3Provider(self.config)
+
+    def tearDown(self):
+        storage_setup.reset_storage()
+        self.mock.stop()
+        self.env.stop()
+
+    def _list_changes(self):
+        response = self.db.meta_store.client.list_objects_v2(
+            Bucket=self.db.bucket, Prefix=self.db._get_changes_keybase())
+        return [item['Key'] for item in response.get('Contents', [])]
+
+    def test_watch_interval(self):
+        self.assertEqual(self.db.watch_interval, s3_provider.WATCH_INTERVAL)
+
+    def test_wait_for_one_experiment(self):
+        self._add('exp1')
+        self._add('exp2')
+        cursor = self.db.get_change_cursor()
+        self.db.stop_experiment('exp1')
+        self.db.stop_experiment('exp2')
+        client = self.db.meta_store.client
+        with mock.patch.object(client, 'get_paginator',
+                               side_effect=client.get_paginator) as paginator:
+            changed, _ = self.db.wait_for_experiments(['exp2'], cursor, 1)
+        self.assertEqual(changed, {'exp2'})
+        paginator.assert_called_once_with('list_objects_v2')
+        # Only changes of the experiment waited for are listed:
+        events, _ = self.db._read_changes(cursor, 'states/exp2')
+        self.assertEqual([event.key for event in events], ['states/exp2'])
+
+    def test_trim_changes(self):
+        self._add('exp1')
+        self.assertEqual(len(self._list_changes()), 2)
+        with mock.patch.object(s3_provider.random, 'random',
+                               return_value=0.4), \
+                mock.patch.object(s3_provider, 'CHANGE_LOG_TTL', 0):
+            self.db.stop_experiment('exp1')
+            self.assertEqual(len(self._list_changes()), 4)
+            time.sleep(0.01)
+            # Change logged by another client trims the ones before it:
+            db = S3Provider(self.config)
+            with mock.patch.object(s3_provider, 'CHANGE_LOG_TRIM_PERIOD', 2):
+                db._set('states/exp2', {'status': 'waiting'})
+        changes = self._list_changes()
+        self.assertEqual(len(changes), 2)
+        self.assertTrue(all(key.endswith('states/exp2') or
+                            '/states/exp2/' in key for key in changes))
+
+
+if __name__ == "__main__":
+    unittest.main()
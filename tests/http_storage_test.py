@@ -0,0 +1,154 @@
+import unittest
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from studio.storage import storage_util
+from studio.storage.http_storage_handler import HTTPStorageHandler
+
+DATA = os.urandom(3 * 1024 * 1024 + 17)
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    # Test server state, set up by tests:
+    drops = 0
+    etag = '"{0}"'.format(hashlib.md5(DATA).hexdigest())
+    extra_headers = dict()
+    gzip = False
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = self.__class__
+        cls.requests.append(self.headers.get('Range', None))
+        if self.path != '/data.bin':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = gzip.compress(DATA) if cls.gzip else DATA
+        start, end = 0, len(data)
+        byte_range = self.headers.get('Range', None)
+        if byte_range is not None and \
+                self.headers.get('If-Range', cls.etag) == cls.etag:
+            first, last = byte_range.split('=')[1].split('-')
+            start = int(first)
+            end = int(last) + 1 if last else len(data)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, end - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('ETag', cls.etag)
+        if cls.gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in cls.extra_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if cls.drops > 0:
+            # Send part of the data and drop connection:
+            cls.drops -= 1
+            self.wfile.write(data[start:start + 1024 * 1024])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(data[start:end])
+
+
+class HTTPStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        _RangeHandler.drops = 0
+        _RangeHandler.requests = []
+        _RangeHandler.extra_headers = dict()
+        _RangeHandler.gzip = False
+        _RangeHandler.etag = '"{0}"'.format(hashlib.md5(DATA).hexdigest())
+        self.server = HTTPServer(('127.0.0.1', 0), _RangeHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}/data.bin'.format(
+            self.server.server_address[1])
+        self.handler = HTTPStorageHandler(self.url, None,
+                                          config={'pool_size': 4})
+        self.local_path = os.path.join(self.tmp_dir, 'data.bin')
+        self.old_sleep = storage_util.HTTP_RETRY_SLEEP
+        storage_util.HTTP_RETRY_SLEEP = 0
+
+    def tearDown(self):
+        storage_util.HTTP_RETRY_SLEEP = self.old_sleep
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _read_local(self):
+        with open(self.local_path, 'rb') as f:
+            return f.read()
+
+    def test_resume(self):
+        _RangeHandler.drops = 2
+        self.assertTrue(self.handler.download_file(None, self.local_path))
+        self.assertEqual(self._read_local(), DATA)
+        self.assertEqual(_RangeHandler.requests,
+                         [None, 'bytes=1048576-', 'bytes=2097152-'])
+        stats = self.handler.get_transfer_stats()
+        self.assertEqual(stats['resumes'], 2)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['downloaded_bytes'], len(DATA))
+        self.assertGreater(stats['download_throughput'], 0)
+        self.assertFalse(os.path.exists(
+            self.local_path + storage_util.PARTIAL_DOWNLOAD_SUFFIX))
+
+    def test_resume_in_later_call(self):
+        _RangeHandler.drops = 1
+        handler = HTTPStorageHandler(self.url, None,
+                                     config={'download_retries': 1})
+        self.assertFalse(handler.download_file(None, self.local_path))
+        self.assertEqual(os.path.getsize(
+            self.local_path + storage_util.PARTIAL_DOWNLOAD_SUFFIX),
+            1024 * 1024)
+        self.assertTrue(handler.download_file(None, self.local_path))
+        self.assertEqual(self._read_local(), DATA)
+        self.assertEqual(_RangeHandler.requests[-1], 'bytes=1048576-')
+
+        # Resource has changed since partial download, start over:
+        _RangeHandler.drops = 1
+        os.remove(self.local_path)
+        self.assertFalse(handler.download_file(None, self.local_path))
+        _RangeHandler.etag = '"other"'
+        self.assertTrue(handler.download_file(None, self.local_path))
+        self.assertEqual(self._read_local(), DATA)
+
+    def test_checks(self):
+        _RangeHandler.etag = '"{0}"'.format(hashlib.md5(b'other').hexdigest())
+        self.assertFalse(self.handler.download_file(None, self.local_path))
+        self.assertFalse(os.path.exists(self.local_path))
+
+        self.assertFalse(self.handler.download_remote_path(
+            self.url.replace('data.bin', 'missing'), self.local_path))
+        self.assertEqual(self.handler.read_range(None, 10, 5), DATA[10:15])
+
+    def test_etag_is_not_md5(self):
+        # Object encrypted with KMS key:
+        _RangeHandler.etag = '"{0}"'.format(hashlib.md5(b'other').hexdigest())
+        _RangeHandler.extra_headers = {
+            'x-amz-server-side-encryption': 'aws:kms'}
+        self.assertTrue(self.handler.download_file(None, self.local_path))
+        self.assertEqual(self._read_local(), DATA)
+
+    def test_encoded_content(self):
+        _RangeHandler.gzip = True
+        self.assertTrue(self.handler.download_file(None, self.local_path))
+        self.assertEqual(self._read_local(), DATA)
+
+
+if __name__ == "__main__":
+    unittest.main()
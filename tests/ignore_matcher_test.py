@@ -0,0 +1,74 @@
+import unittest
+import os
+import shutil
+import tarfile
+import tempfile
+
+from studio.storage import storage_util
+from studio.storage.ignore_matcher import IgnoreMatcher, IGNORE_FILE_NAME
+from studio.util import logs
+
+
+class IgnoreMatcherTest(unittest.TestCase):
+
+    def test_patterns(self):
+        matcher = IgnoreMatcher([
+            '# comment',
+            '',
+            '*.pyc',
+            '__pycache__/',
+            '/build',
+            'data/**/*.npy',
+            'logs/*.log',
+            '!logs/keep.log',
+            r'\#hash',
+        ])
+        self.assertTrue(matcher.is_ignored('a.pyc'))
+        self.assertTrue(matcher.is_ignored('src/deep/a.pyc'))
+        self.assertTrue(matcher.is_ignored('src/__pycache__', is_dir=True))
+        self.assertFalse(matcher.is_ignored('src/__pycache__'))
+        self.assertTrue(matcher.is_ignored('build', is_dir=True))
+        self.assertFalse(matcher.is_ignored('src/build', is_dir=True))
+        self.assertTrue(matcher.is_ignored('data/x.npy'))
+        self.assertTrue(matcher.is_ignored('data/a/b/x.npy'))
+        self.assertFalse(matcher.is_ignored('other/x.npy'))
+        self.assertTrue(matcher.is_ignored('logs/train.log'))
+        self.assertFalse(matcher.is_ignored('logs/keep.log'))
+        self.assertFalse(matcher.is_ignored('logs/sub/train.log'))
+        self.assertTrue(matcher.is_ignored('#hash'))
+        self.assertFalse(matcher.is_ignored('main.py'))
+
+    def test_merged_rules(self):
+        matcher = IgnoreMatcher(['.git', 'venv/', '*.tmp'])
+        self.assertTrue(matcher.is_ignored('.git', is_dir=True))
+        self.assertTrue(matcher.is_ignored('venv', is_dir=True))
+        self.assertFalse(matcher.is_ignored('venv'))
+        self.assertTrue(matcher.is_ignored('a/b.tmp'))
+        self.assertFalse(matcher.is_ignored('b.py'))
+
+    def test_tar_skips_ignored(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for rel_path in ['main.py', '.git/HEAD', 'venv/lib/x.py',
+                             'src/a.py', 'src/a.pyc']:
+                path = os.path.join(tmp_dir, rel_path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(rel_path)
+            with open(os.path.join(tmp_dir, IGNORE_FILE_NAME), 'w') as f:
+                f.write('.git\nvenv/\n*.pyc\n')
+
+            logger = logs.get_logger('IgnoreMatcherTest')
+            tar_filename = storage_util.tar_artifact(
+                tmp_dir, None, None, logger, cache=False)
+            with tarfile.open(tar_filename) as tf:
+                names = sorted(tf.getnames())
+            os.remove(tar_filename)
+            self.assertEqual(names, [IGNORE_FILE_NAME, 'main.py',
+                                     'src', 'src/a.py'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
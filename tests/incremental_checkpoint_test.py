@@ -0,0 +1,113 @@
+import unittest
+import filecmp
+import os
+import shutil
+import tempfile
+
+from studio.artifacts import artifacts_tracker
+from studio.artifacts import incremental_checkpoint
+from studio.artifacts.artifact import Artifact
+from studio.storage import storage_setup
+from studio.storage.local_storage_handler import LocalStorageHandler
+
+KEY = 'experiments/incremental_test/modeldir.tar'
+MEMBERS_KEY = KEY + incremental_checkpoint.MEMBERS_SUFFIX
+
+
+class IncrementalCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_home = os.environ.get(artifacts_tracker.STUDIOML_HOME)
+        os.environ[artifacts_tracker.STUDIOML_HOME] = \
+            os.path.join(self.tmp_dir, 'home')
+        self.store_root = os.path.join(self.tmp_dir, 'store')
+        store = LocalStorageHandler(
+            {'endpoint': self.tmp_dir, 'bucket': 'store'})
+        storage_setup.setup_storage(None, store)
+
+        self.local_path = artifacts_tracker.get_artifact_cache(KEY)
+        os.makedirs(os.path.join(self.local_path, 'logs'))
+        self._write('weights.bin', os.urandom(100000))
+        self._write('logs/train.log', b'epoch 1\n')
+        self.art = Artifact('modeldir',
+                            {'key': KEY, 'local': self.local_path,
+                             'mutable': True})
+
+    def tearDown(self):
+        storage_setup.reset_storage()
+        if self.old_home is None:
+            del os.environ[artifacts_tracker.STUDIOML_HOME]
+        else:
+            os.environ[artifacts_tracker.STUDIOML_HOME] = self.old_home
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, rel_path, data, mode='wb'):
+        with open(os.path.join(self.local_path, rel_path), mode) as f:
+            f.write(data)
+
+    def _stored_keys(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.store_root)
+            for root, _, files in os.walk(self.store_root) for name in files)
+
+    def _assert_download_matches(self):
+        out_dir = os.path.join(self.tmp_dir, 'out')
+        shutil.rmtree(out_dir, ignore_errors=True)
+        art = Artifact('modeldir', {'key': KEY, 'mutable': True})
+        self.assertEqual(art.download(out_dir, only_newer=False), out_dir)
+        cmp = filecmp.dircmp(self.local_path, out_dir)
+        self.assertEqual(cmp.left_only + cmp.right_only + cmp.diff_files, [])
+        logs_cmp = cmp.subdirs['logs']
+        self.assertEqual(logs_cmp.left_only + logs_cmp.right_only +
+                         logs_cmp.diff_files, [])
+
+    def test_unchanged_artifact_is_skipped(self):
+        self.art.upload()
+        stored = os.stat(os.path.join(self.store_root, KEY))
+        self.art.upload()
+        self.assertEqual(
+            os.stat(os.path.join(self.store_root, KEY)).st_ino, stored.st_ino)
+        self.assertEqual(self._stored_keys(), [KEY, MEMBERS_KEY])
+
+    def test_delta_upload_and_download(self):
+        self.art.upload()
+        self._write('logs/train.log', b'epoch 2\n', mode='ab')
+        self._write('logs/eval.log', b'eval 1\n')
+        self.art.upload()
+        delta_prefix = KEY + incremental_checkpoint.DELTA_SUFFIX
+        self.assertEqual(self._stored_keys(), [
+            KEY, delta_prefix + '000001.tar',
+            delta_prefix + incremental_checkpoint.INDEX_NAME, MEMBERS_KEY])
+        self._assert_download_matches()
+
+        os.remove(os.path.join(self.local_path, 'logs', 'eval.log'))
+        self.art.upload()
+        self._assert_download_matches()
+
+        tar = self.art.stream()
+        self.assertIn('logs/train.log', tar.getnames())
+        self.assertNotIn('logs/eval.log', tar.getnames())
+
+    def test_reverted_file_is_uploaded(self):
+        self.art.upload()
+        log_path = os.path.join(self.local_path, 'logs', 'train.log')
+        # Each version gets its own mtime:
+        versions = [b'epoch 1\n', b'epoch 12\n', b'epoch 2\n', b'epoch 1\n']
+        for mtime, data in enumerate(versions, start=1000):
+            self._write('logs/train.log', data)
+            os.utime(log_path, (mtime, mtime))
+            self.art.upload()
+            self._assert_download_matches()
+
+    def test_deltas_are_compacted(self):
+        self.art.upload()
+        self._write('weights.bin', os.urandom(150000))
+        self.art.upload()
+        # Delta bigger than the base is replaced with full upload:
+        self.assertEqual(self._stored_keys(), [KEY, MEMBERS_KEY])
+        self._assert_download_matches()
+
+
+if __name__ == "__main__":
+    unittest.main()
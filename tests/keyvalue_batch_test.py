@@ -0,0 +1,95 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from studio import model
+from studio.artifacts import artifacts_tracker
+from studio.artifacts.artifact import Artifact
+from studio.db_providers.local_db_provider import LocalDbProvider
+from studio.dependencies_policies.studio_dependencies_policy import \
+    StudioDependencyPolicy
+from studio.experiments.experiment import create_experiment
+from studio.storage import storage_setup
+
+
+class KeyValueBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_home = os.environ.get(artifacts_tracker.STUDIOML_HOME)
+        os.environ[artifacts_tracker.STUDIOML_HOME] = \
+            os.path.join(self.tmp_dir, 'home')
+        storage_setup.reset_storage()
+        self.config = {
+            'database': {'type': 'local', 'endpoint': self.tmp_dir,
+                         'bucket': 'db', 'guest': True},
+            'storage': {'type': 'local', 'endpoint': self.tmp_dir,
+                        'bucket': 'store'}}
+        self.db = model.get_db_provider(self.config)
+        self.workspace = os.path.join(self.tmp_dir, 'workspace')
+        os.makedirs(self.workspace)
+        with open(os.path.join(self.workspace, 'train.py'), 'w') as f:
+            f.write('print(1)')
+
+    def tearDown(self):
+        storage_setup.reset_storage()
+        if self.old_home is None:
+            del os.environ[artifacts_tracker.STUDIOML_HOME]
+        else:
+            os.environ[artifacts_tracker.STUDIOML_HOME] = self.old_home
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_experiment(self):
+        return create_experiment(
+            'train.py', [],
+            artifacts={'workspace': {'local': self.workspace,
+                                     'mutable': False}},
+            project='sweep',
+            dependency_policy=StudioDependencyPolicy())
+
+    def test_add_experiments(self):
+        experiments = [self._create_experiment() for _ in range(5)]
+        with mock.patch.object(Artifact, 'upload', autospec=True,
+                               side_effect=Artifact.upload) as upload, \
+                mock.patch.object(LocalDbProvider, '_set') as set_one:
+            self.db.add_experiments(experiments)
+            set_one.assert_not_called()
+        # Shared workspace is uploaded once:
+        workspace_uploads = [call for call in upload.call_args_list
+                             if call[0][0].name == 'workspace']
+        self.assertEqual(len(workspace_uploads), 1)
+
+        keys = set(exp.artifacts['workspace'].key for exp in experiments)
+        self.assertEqual(len(keys), 1)
+        self.assertTrue(keys.pop().startswith('blobstore/'))
+        for experiment in experiments:
+            stored = self.db.get_experiment(experiment.key, getinfo=False)
+            self.assertEqual(stored.status, 'waiting')
+            self.assertIsNotNone(stored.time_last_checkpoint)
+        self.assertEqual(
+            self.db._list_keys('users/guest/experiments/'),
+            sorted('users/guest/experiments/' + exp.key
+                   for exp in experiments))
+        self.assertEqual(
+            self.db._list_keys('projects/sweep/'),
+            sorted('projects/sweep/' + exp.key + '/owner'
+                   for exp in experiments))
+
+        self.db.delete_experiment(experiments[0])
+        self.assertIsNone(self.db.get_experiment(experiments[0].key))
+        self.assertEqual(len(self.db._list_keys('users/guest/experiments/')),
+                         4)
+        self.assertEqual(len(self.db._list_keys('projects/sweep/')), 4)
+
+    def test_many(self):
+        self.db._set_many({'a/b/1': 1, 'a/b/2': {'x': 2}, 'a/c': 'c'})
+        self.assertEqual(self.db._get_many(['a/b/1', 'a/b/2', 'a/d']),
+                         {'a/b/1': 1, 'a/b/2': {'x': 2}, 'a/d': None})
+        self.db._delete_many(['a/b/1', 'a/c'])
+        self.assertEqual(self.db._list_keys('a/'), ['a/b/2'])
+
+
+if __name__ == "__main__":
+    unittest.main()
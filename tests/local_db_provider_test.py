@@ -0,0 +1,139 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from studio.db_providers import local_db_provider, record_serializer
+from studio.db_providers.local_db_provider import LocalDbProvider, \
+    TEMP_SUFFIX
+
+
+class LocalDbProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_db(self, **config):
+        config.update({'endpoint': self.tmp_dir, 'bucket': 'db'})
+        return LocalDbProvider(config)
+
+    def _files(self):
+        return [name for _, _, names in
+                os.walk(os.path.join(self.tmp_dir, 'db')) for name in names]
+
+    def test_interrupted_write(self):
+        db = self._get_db()
+        db._set('experiments/abc', {'status': 'running'})
+        with mock.patch.object(local_db_provider.os, 'replace',
+                               side_effect=OSError('No space left')):
+            with self.assertRaises(OSError):
+                db._set('experiments/abc', {'status': 'finished'})
+        self.assertEqual(self._get_db()._get('experiments/abc'),
+                         {'status': 'running'})
+        self.assertEqual(self._files(), ['abc'])
+
+    def test_write_racing_with_other_writer(self):
+        db = self._get_db()
+        other = self._get_db(cache=False)
+        real_replace = os.replace
+
+        def replace(src, dst):
+            real_replace(src, dst)
+            if not src.endswith(TEMP_SUFFIX):
+                return
+            # Other process writes the record right after our rename:
+            with mock.patch.object(local_db_provider.os, 'replace',
+                                   side_effect=real_replace):
+                other._set('experiments/abc', {'status': 'finished!'})
+
+        with mock.patch.object(local_db_provider.os, 'replace',
+                               side_effect=replace):
+            db._set('experiments/abc', {'status': 'running'})
+        self.assertEqual(db._get('experiments/abc'), {'status': 'finished!'})
+
+    def test_concurrent_reads(self):
+        writer = self._get_db()
+        reader = self._get_db(cache=False)
+        record = {'status': 'running', 'data': 'x' * 100000}
+        writer._set('experiments/abc', record)
+        stopped = threading.Event()
+
+        def write():
+            while not stopped.is_set():
+                writer._set('experiments/abc', record)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            with mock.patch.object(reader.logger, 'error') as error:
+                for _ in range(200):
+                    self.assertEqual(reader._get('experiments/abc'), record)
+                error.assert_not_called()
+        finally:
+            stopped.set()
+            thread.join()
+        self.assertEqual(reader._get('experiments/', shallow=True), ['abc'])
+        self.assertFalse([name for name in self._files()
+                          if name.endswith(TEMP_SUFFIX)])
+
+    def test_serializers(self):
+        record = {'status': 'running', 'metric': 0.5, 'args': ['a', 1]}
+        for serializer in record_serializer.get_available_serializers():
+            db = self._get_db(serializer=serializer)
+            db._set('experiments/' + serializer, record)
+            # Readable regardless of configured serializer:
+            self.assertEqual(self._get_db(cache=False)._get(
+                'experiments/' + serializer), record)
+        if record_serializer.msgpack is None:
+            self.assertEqual(self._get_db(serializer='msgpack').serializer,
+                             'json')
+        with self.assertRaises(ValueError):
+            self._get_db(serializer='xml')
+
+    def test_group_commit(self):
+        db = self._get_db(fsync='batch', group_commit_interval=60,
+                          group_commit_size=20)
+        with mock.patch.object(local_db_provider, '_fsync_path') as fsync:
+            db._set_many({'experiments/{0}'.format(i): i for i in range(10)})
+            fsync.assert_not_called()
+            self.assertEqual(db.flush(), 10)
+            # Ten records and their directory:
+            self.assertEqual(fsync.call_count, 11)
+
+            fsync.reset_mock()
+            db._set_many({'users/{0}'.format(i): i for i in range(25)})
+            # Flushed once group is full:
+            self.assertEqual(fsync.call_count, 21)
+            db.cleanup()
+            self.assertEqual(fsync.call_count, 21 + 6)
+
+        db = self._get_db(fsync='always')
+        with mock.patch.object(local_db_provider, '_fsync_path') as fsync:
+            db._set('experiments/abc', 1)
+            self.assertEqual(fsync.call_count, 1)
+
+    def test_change_log_rotation(self):
+        db = self._get_db()
+        cursor = db.get_change_cursor()
+        with mock.patch.object(local_db_provider, 'CHANGE_LOG_SIZE', 200):
+            for i in range(10):
+                db._set('states/exp{0}'.format(i), {'status': 'running'})
+        self.assertTrue(os.path.exists(
+            db.changes_path + local_db_provider.ROTATED_SUFFIX))
+        # Changes still in rotated log are read first:
+        events, _ = db._read_changes(cursor)
+        keys = [event.key for event in events]
+        self.assertEqual(keys[-1], 'states/exp9')
+        self.assertEqual(keys, sorted(keys))
+        self.assertLess(len(keys), 10)
+        self.assertEqual(list(db.watch('states/', since=events[-1].cursor,
+                                       timeout=0)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
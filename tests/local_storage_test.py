@@ -0,0 +1,100 @@
+import unittest
+import errno
+import mmap
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from studio.storage import storage_util
+from studio.storage.local_storage_handler import LocalStorageHandler
+from studio.util import logs
+
+
+class LocalStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.logger = logs.get_logger('LocalStorageTest')
+        self.src_file = os.path.join(self.tmp_dir, 'src.bin')
+        with open(self.src_file, 'wb') as f:
+            f.write(os.urandom(10000))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_copy_file_fast(self):
+        dst_file = os.path.join(self.tmp_dir, 'copy.bin')
+        method = storage_util.copy_file_fast(self.src_file, dst_file)
+        self.assertNotEqual(method, storage_util.COPY_METHOD_HARDLINK)
+        self.assertEqual(self._read(dst_file), self._read(self.src_file))
+        self.assertEqual(os.stat(self.src_file).st_nlink, 1)
+
+    def _stored_file(self, link_files):
+        handler = LocalStorageHandler({'endpoint': self.tmp_dir,
+                                       'bucket': 'store',
+                                       'link_files': link_files})
+        # Without reflinks, hardlink is the cheapest allowed method:
+        with mock.patch.object(storage_util, '_reflink',
+                               side_effect=OSError(errno.EOPNOTSUPP, '')):
+            handler.upload_file('k', self.src_file)
+        return handler.get_file_url('k')
+
+    def test_link_files(self):
+        stored = self._stored_file(True)
+        self.assertEqual(os.stat(stored).st_ino, os.stat(self.src_file).st_ino)
+
+    def test_files_are_not_linked_by_default(self):
+        stored = self._stored_file(False)
+        self.assertNotEqual(os.stat(stored).st_ino,
+                            os.stat(self.src_file).st_ino)
+        data = self._read(self.src_file)
+        with open(self.src_file, 'r+b') as f:
+            f.write(b'changed')
+        self.assertEqual(self._read(stored), data)
+
+    def test_clone_tree(self):
+        src_dir = os.path.join(self.tmp_dir, 'tree')
+        os.makedirs(os.path.join(src_dir, 'sub'))
+        shutil.copy(self.src_file, os.path.join(src_dir, 'sub', 'a.bin'))
+        dst_dir = os.path.join(self.tmp_dir, 'clone')
+        storage_util.clone_tree(src_dir, dst_dir)
+        self.assertEqual(self._read(os.path.join(dst_dir, 'sub', 'a.bin')),
+                         self._read(self.src_file))
+        self.assertEqual(
+            os.stat(os.path.join(src_dir, 'sub', 'a.bin')).st_nlink, 1)
+
+    def test_uncompressed_tar_is_mapped(self):
+        tar_filename = storage_util.tar_artifact(
+            self.src_file, None, None, self.logger, cache=False)
+        tar, fileobj = storage_util.open_tar_file(tar_filename)
+        self.assertIsInstance(fileobj, mmap.mmap)
+        self.assertEqual(tar.extractfile('./src.bin').read(),
+                         self._read(self.src_file))
+        tar.close()
+        self.assertTrue(fileobj.closed)
+        os.remove(tar_filename)
+
+    def test_failed_stream_keeps_stored_artifact(self):
+        handler = LocalStorageHandler({'endpoint': self.tmp_dir,
+                                       'bucket': 'store'})
+        src_dir = os.path.join(self.tmp_dir, 'tree')
+        os.makedirs(src_dir)
+        shutil.copy(self.src_file, os.path.join(src_dir, 'a.bin'))
+        storage_util.stream_tar_artifact(
+            src_dir, 'k', None, handler, self.logger, cache=False)
+        stored = self._read(handler.get_file_url('k'))
+
+        with self.assertRaises(ValueError):
+            storage_util.stream_tar_artifact(
+                src_dir, 'k', None, handler, self.logger, cache=False,
+                members=['a.bin', 'missing.bin'])
+        self.assertEqual(self._read(handler.get_file_url('k')), stored)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from studio.storage.local_storage_handler import LocalStorageHandler
+from studio.storage.metadata_cache import MetadataCache
+
+
+class MetadataCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.handler = LocalStorageHandler(
+            {'endpoint': self.tmp_dir, 'bucket': 'store'})
+        self.cache = MetadataCache(ttl=60)
+        self.handler.set_metadata_cache(self.cache, 'local')
+        self.local_file = os.path.join(self.tmp_dir, 'file.txt')
+        with open(self.local_file, 'w') as f:
+            f.write('content')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_batch_timestamps(self):
+        self.handler.upload_file('a/1', self.local_file)
+        self.handler.upload_file('a/2', self.local_file)
+        timestamps = self.handler.get_file_timestamps(['a/1', 'a/2', 'a/3'])
+        self.assertIsNotNone(timestamps['a/1'])
+        self.assertIsNotNone(timestamps['a/2'])
+        self.assertIsNone(timestamps['a/3'])
+        self.assertEqual(self.cache.misses, 3)
+
+        self.handler.get_file_timestamps(['a/1', 'a/3'])
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_writes_invalidate_cache(self):
+        self.assertIsNone(self.handler.get_cached_file_timestamp('k'))
+        self.handler.upload_file('k', self.local_file)
+        self.assertIsNotNone(self.handler.get_cached_file_timestamp('k'))
+
+        self.handler.rename_file('k', 'k2')
+        self.assertIsNone(self.handler.get_cached_file_timestamp('k'))
+        self.assertIsNotNone(self.handler.get_cached_file_timestamp('k2'))
+
+        self.handler.delete_file('k2')
+        self.assertIsNone(self.handler.get_cached_file_timestamp('k2'))
+
+    def test_expired_entries(self):
+        cache = MetadataCache(ttl=-1)
+        cache.put('ns', 'k', 1)
+        self.assertEqual(cache.get('ns', 'k'), (False, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
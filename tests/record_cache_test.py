@@ -0,0 +1,66 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from studio.db_providers.local_db_provider import LocalDbProvider
+from studio.db_providers.record_cache import RecordCache
+
+
+class RecordCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_db(self, **config):
+        config.update({'endpoint': self.tmp_dir, 'bucket': 'db'})
+        return LocalDbProvider(config)
+
+    def test_ttl(self):
+        cache = RecordCache(ttl=60, max_records=2,
+                            prefix_ttl={'experiments/': 0})
+        cache.put('users/a', 1, '"a"')
+        cache.put('experiments/b', 2, '"b"')
+        self.assertEqual(cache.get('users/a'), (True, 1, '"a"'))
+        self.assertEqual(cache.get('experiments/b'), (False, 2, '"b"'))
+        cache.put('users/c', 3, '"c"')
+        # Least recently used record is evicted:
+        self.assertIsNone(cache.get('users/a'))
+        cache.invalidate('users/', prefix=True)
+        self.assertIsNone(cache.get('users/c'))
+        self.assertEqual(cache.get_stats()['hits'], 1)
+
+    def test_local_revalidation(self):
+        db = self._get_db()
+        db._set('experiments/abc', {'status': 'running'})
+        for _ in range(3):
+            self.assertEqual(db._get('experiments/abc'),
+                             {'status': 'running'})
+        self.assertEqual(db.get_cache_stats()['revalidations'], 3)
+
+        # File changed by another process is read again:
+        file_name = os.path.join(self.tmp_dir, 'db', 'experiments', 'abc')
+        with open(file_name, 'w') as f:
+            json.dump({'status': 'stopped'}, f)
+        os.utime(file_name, (time.time() + 10, time.time() + 10))
+        self.assertEqual(db._get('experiments/abc'), {'status': 'stopped'})
+        self.assertEqual(db.get_cache_stats()['misses'], 1)
+
+        db._delete('experiments/abc')
+        self.assertIsNone(db._get('experiments/abc'))
+
+    def test_disabled(self):
+        db = self._get_db(cache=False)
+        db._set('experiments/abc', {'status': 'running'})
+        self.assertEqual(db._get('experiments/abc'), {'status': 'running'})
+        self.assertEqual(db.get_cache_stats()['records'], 0)
+        self.assertEqual(db.get_cache_stats()['misses'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
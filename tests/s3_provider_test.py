@@ -0,0 +1,172 @@
+import unittest
+import json
+import os
+import time
+import uuid
+from unittest import mock
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+from studio.db_providers.s3_provider import S3Provider
+from studio.storage import storage_setup
+
+# Number of experiments for the latency benchmark,
+# which runs only if STUDIOML_BENCHMARK is set:
+BENCHMARK_EXPERIMENTS = 10000
+BENCHMARK_LOOKUPS = 200
+
+
+@unittest.skipIf(mock_aws is None, 'moto is not installed')
+class S3ProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.env = mock.patch.dict(os.environ, {
+            'AWS_DEFAULT_REGION': 'us-east-1',
+            'AWS_ACCESS_KEY_ID': 'testing',
+            'AWS_SECRET_ACCESS_KEY': 'testing'})
+        self.env.start()
+        self.mock = mock_aws()
+        self.mock.start()
+        storage_setup.reset_storage()
+        self.db = S3Provider({
+            'type': 's3',
+            'endpoint': 'https://s3.amazonaws.com',
+            'bucket': 'studioml-meta-' + str(uuid.uuid4())[:8],
+            'guest': True,
+            'credentials': {'aws': {'access_key': 'testing',
+                                    'secret_access_key': 'testing'}}})
+        self.client = self.db.meta_store.client
+
+    def tearDown(self):
+        storage_setup.reset_storage()
+        self.mock.stop()
+        self.env.stop()
+
+    def test_get(self):
+        self.db._set('experiments/abc', {'key': 'abc'})
+        self.db._set('experiments/abcd', {'key': 'abcd'})
+        with mock.patch.object(self.client, 'list_objects',
+                               side_effect=AssertionError) as list_objects:
+            self.assertEqual(self.db._get('experiments/abc'), {'key': 'abc'})
+            self.assertIsNone(self.db._get('experiments/ab'))
+            self.assertIsNone(self.db._get('missing'))
+            list_objects.assert_not_called()
+
+    def test_shallow(self):
+        keys = ['exp{0:04d}'.format(i) for i in range(1100)]
+        self.db._set_many({'users/guest/experiments/' + key: 1.0
+                           for key in keys})
+        self.db._set_many({'projects/sweep/' + key + '/owner': 'guest'
+                           for key in keys[:3]})
+        self.db._set('users/guest/email', 'guest@studio.ml')
+        self.db._set('users/other/email', 'other@studio.ml')
+
+        # More keys than one page of list_objects_v2:
+        self.assertEqual(self.db.get_user_experiments(), keys)
+        self.assertEqual(sorted(self.db.get_users().keys()),
+                         ['guest', 'other'])
+        self.assertEqual(self.db.get_projects(), ['sweep'])
+        self.assertEqual(self.db.get_project_experiments('sweep'), keys[:3])
+        self.assertEqual(self.db.get_project_experiments('other'), [])
+        self.assertIsNone(self.db._get('users/guest/experiments/'))
+
+    def test_cache(self):
+        self.db._set('experiments/abc', {'status': 'running'})
+        # Written record is revalidated by conditional GET:
+        for _ in range(3):
+            self.assertEqual(self.db._get('experiments/abc'),
+                             {'status': 'running'})
+        stats = self.db.get_cache_stats()
+        self.assertEqual(stats['revalidations'], 3)
+        self.assertEqual(stats['misses'], 0)
+
+        # Record changed by another client is read again:
+        self.client.put_object(Bucket=self.db.bucket, Key='experiments/abc',
+                               Body=json.dumps({'status': 'stopped'}))
+        self.assertEqual(self.db._get('experiments/abc'),
+                         {'status': 'stopped'})
+        self.assertEqual(self.db.get_cache_stats()['misses'], 1)
+
+        self.db._delete('experiments/abc')
+        self.assertIsNone(self.db._get('experiments/abc'))
+
+    def test_query_pages(self):
+        entries = dict()
+        for i in range(1100):
+            entries.update(self.db._get_index_entries({
+                'key': 'exp{0:04d}'.format(i), 'status': 'waiting',
+                'time_added': 1000.0 + i}))
+        self.db._set_many(entries)
+        keys = ['exp{0:04d}'.format(i) for i in reversed(range(1100))]
+
+        pages = list(self.db.iter_experiments(status='waiting',
+                                              page_size=400))
+        self.assertEqual([len(page) for page in pages], [400, 400, 300])
+        self.assertEqual([summary['key'] for page in pages
+                          for summary in page], keys)
+        summaries, _ = self.db.query_experiments(page_size=1050)
+        self.assertEqual([summary['key'] for summary in summaries],
+                         keys[:1050])
+
+    @unittest.skipIf(not os.environ.get('STUDIOML_BENCHMARK'),
+                     'STUDIOML_BENCHMARK is not set')
+    def test_benchmark(self):
+        keys = [str(uuid.uuid4()) for _ in range(BENCHMARK_EXPERIMENTS)]
+        record = {'status': 'waiting', 'artifacts': {}, 'args': [],
+                  'filename': 'train.py', 'project': 'sweep'}
+        items = dict()
+        for i, key in enumerate(keys):
+            items['experiments/' + key] = dict(record, key=key)
+            items['users/guest/experiments/' + key] = 1.0
+            items.update(self.db._get_index_entries(dict(
+                record, key=key, owner='guest', time_added=1000.0 + i)))
+        self.db._set_many(items)
+        lookups = keys[:BENCHMARK_LOOKUPS]
+
+        def list_then_get(key):
+            # Point lookup as it was done before: LIST, then GET.
+            response = self.client.list_objects(
+                Bucket=self.db.bucket, Prefix=key, Delimiter='/',
+                MaxKeys=1024 * 16)
+            for item in response.get('Contents', []):
+                if item['Key'] == key:
+                    body = self.client.get_object(
+                        Bucket=self.db.bucket, Key=key)['Body']
+                    return json.loads(body.read().decode('utf-8'))
+            return None
+
+        def measure(name, func, args):
+            tic = time.time()
+            for arg in args:
+                func(arg)
+            toc = time.time()
+            print('{0}: {1:.2f} ms per call'.format(
+                name, 1000 * (toc - tic) / len(args)))
+
+        print('\n{0} experiments in bucket'.format(len(keys)))
+        measure('list+get (experiments/<key>)', list_then_get,
+                ['experiments/' + key for key in lookups])
+        measure('list+get (experiments/missing)', list_then_get,
+                ['experiments/missing'] * 20)
+        measure('get (experiments/<key>)', self.db._get,
+                ['experiments/' + key for key in lookups])
+        measure('get (experiments/missing)', self.db._get,
+                ['experiments/missing'] * 20)
+        measure('query_experiments (first page of 50)',
+                lambda _: self.db.query_experiments(page_size=50),
+                [None] * 3)
+        measure('query_experiments (first page of 50, by status)',
+                lambda _: self.db.query_experiments(status='waiting',
+                                                    page_size=50),
+                [None] * 3)
+        measure('get_user_experiments',
+                lambda _: self.assertEqual(
+                    len(self.db.get_user_experiments()), len(keys)),
+                [None] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import multiprocessing
+import shutil
+import tempfile
+
+from studio.db_providers.db_provider_setup import create_key_value_provider
+from studio.db_providers.local_db_provider import LocalDbProvider
+from studio.db_providers.sqlite_provider import SQLiteProvider
+from studio.dependencies_policies.studio_dependencies_policy import \
+    StudioDependencyPolicy
+from studio.experiments.experiment import create_experiment
+from studio.storage import storage_setup
+
+
+def _write_records(config, worker):
+    db = SQLiteProvider(config)
+    for i in range(50):
+        db._set_many({'workers/{0}/{1}'.format(worker, i): i,
+                      'counters/{0}'.format(worker): i})
+
+
+class SQLiteProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        storage_setup.reset_storage()
+        self.config = {'type': 'sqlite', 'endpoint': self.tmp_dir,
+                       'bucket': 'db', 'guest': True}
+        self.db = create_key_value_provider(self.config)
+
+    def tearDown(self):
+        storage_setup.reset_storage()
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_experiments(self, count):
+        policy = StudioDependencyPolicy()
+        return [create_experiment('train.py', [], project='sweep',
+                                  dependency_policy=policy)
+                for _ in range(count)]
+
+    def test_records(self):
+        self.db._set_many({'a/b/1': 1, 'a/b/2': {'x': 2}, 'a/c': 'c'})
+        self.assertEqual(self.db._get('a/b/2'), {'x': 2})
+        self.assertIsNone(self.db._get('a/b'))
+        self.assertEqual(self.db._get('a/', shallow=True), ['b', 'c'])
+        self.assertEqual(self.db._get_many(['a/b/1', 'a/d']),
+                         {'a/b/1': 1, 'a/d': None})
+        self.db._delete_many(['a/b/1', 'a/c'])
+        self.assertEqual(self.db._list_keys('a/'), ['a/b/2'])
+
+    def test_experiments(self):
+        experiments = self._create_experiments(5)
+        self.db.add_experiments(experiments)
+        self.assertEqual(sorted(self.db.get_user_experiments()),
+                         sorted(e.key for e in experiments))
+        self.assertEqual(sorted(self.db.get_project_experiments('sweep')),
+                         sorted(e.key for e in experiments))
+
+        self.db.start_experiment(experiments[0])
+        self.db.finish_experiment(experiments[1])
+        self.db.stop_experiment(experiments[2].key)
+        statuses = {summary['key']: summary['status']
+                    for page in self.db.iter_experiments(page_size=2)
+                    for summary in page}
+        self.assertEqual([statuses[e.key] for e in experiments],
+                         ['running', 'finished', 'stopped',
+                          'waiting', 'waiting'])
+        summaries, _ = self.db.query_experiments(status='running')
+        self.assertEqual([s['key'] for s in summaries], [experiments[0].key])
+
+        self.db.delete_experiment(experiments[0].key)
+        self.assertIsNone(self.db.get_experiment(experiments[0].key))
+        self.assertEqual(self.db.query_experiments(status='running'),
+                         ([], None))
+        self.assertEqual(len(self.db.get_user_experiments()), 4)
+
+    def test_processes(self):
+        workers = [multiprocessing.Process(target=_write_records,
+                                           args=(self.config, worker))
+                   for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        self.assertEqual(len(self.db._list_keys('workers/')), 200)
+        self.assertEqual(self.db._get_many(
+            ['counters/{0}'.format(worker) for worker in range(4)]),
+            {'counters/{0}'.format(worker): 49 for worker in range(4)})
+
+    def test_import(self):
+        source = LocalDbProvider({'endpoint': self.tmp_dir,
+                                  'bucket': 'json', 'guest': True})
+        experiments = self._create_experiments(3)
+        source.add_experiments(experiments)
+        source.start_experiment(experiments[0])
+
+        self.assertEqual(self.db.import_records(source),
+                         len(source._list_keys('')) -
+                         len(source._list_keys('indexes/')))
+        self.assertEqual(self.db.get_experiment(experiments[0].key).status,
+                         'running')
+        self.assertEqual(
+            sorted(s['key'] for page in self.db.iter_experiments(
+                owner='guest') for s in page),
+            sorted(e.key for e in experiments))
+        self.assertEqual(self.db._list_keys('indexes/'), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from studio.artifacts import workspace_hash
+from studio.artifacts.workspace_hash import HashCache
+from studio.storage.ignore_matcher import IGNORE_FILE_NAME
+
+
+class WorkspaceHashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = HashCache(os.path.join(self.tmp_dir, 'hash_cache.db'))
+        self.workspace = os.path.join(self.tmp_dir, 'workspace')
+        self._write(self.workspace, 'main.py', 'print(1)')
+        self._write(self.workspace, 'lib/util.py', 'x = 1')
+        self._write(self.workspace, 'lib/data/a.txt', 'a')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, root, rel_path, data, mtime=1000000000):
+        path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(data)
+        os.utime(path, (mtime, mtime))
+
+    def _hash(self, path):
+        return workspace_hash.workspace_hash(path, cache=self.cache)
+
+    def test_content_only(self):
+        copy = os.path.join(self.tmp_dir, 'copy')
+        shutil.copytree(self.workspace, copy)
+        os.utime(os.path.join(copy, 'main.py'), (2000000000, 2000000000))
+        os.chmod(os.path.join(copy, 'lib', 'util.py'), 0o600)
+        self.assertEqual(self._hash(self.workspace), self._hash(copy))
+
+        self._write(copy, 'lib/data/a.txt', 'b', mtime=1000000001)
+        self.assertNotEqual(self._hash(self.workspace), self._hash(copy))
+
+        # Moving file to another directory changes the hash:
+        os.rename(os.path.join(copy, 'lib', 'util.py'),
+                  os.path.join(copy, 'util.py'))
+        self._write(copy, 'lib/data/a.txt', 'a', mtime=1000000002)
+        self.assertNotEqual(self._hash(self.workspace), self._hash(copy))
+
+    def test_ignored_files(self):
+        expected = self._hash(self.workspace)
+        self._write(self.workspace, IGNORE_FILE_NAME, 'venv/\n')
+        self._write(self.workspace, 'venv/lib/big.bin', 'x' * 1000)
+        with_ignore = self._hash(self.workspace)
+        self.assertNotEqual(with_ignore, expected)
+        os.remove(os.path.join(self.workspace, IGNORE_FILE_NAME))
+        self.assertNotEqual(self._hash(self.workspace), with_ignore)
+
+    def test_cached_hashes(self):
+        expected = self._hash(self.workspace)
+        with mock.patch.object(workspace_hash, '_hash_file') as hash_file:
+            self.assertEqual(self._hash(self.workspace), expected)
+            hash_file.assert_not_called()
+
+        self._write(self.workspace, 'main.py', 'print(2)', mtime=1000000001)
+        changed = self._hash(self.workspace)
+        self.assertNotEqual(changed, expected)
+        self._write(self.workspace, 'main.py', 'print(1)')
+        self.assertEqual(self._hash(self.workspace), expected)
+
+        os.remove(os.path.join(self.workspace, 'lib', 'data', 'a.txt'))
+        self._hash(self.workspace)
+        self.assertEqual(len(self.cache.load(self.workspace)), 2)
+
+    def test_single_file(self):
+        path = os.path.join(self.workspace, 'main.py')
+        other = os.path.join(self.tmp_dir, 'main.py')
+        shutil.copy(path, other)
+        self.assertEqual(self._hash(path), self._hash(other))
+
+        # File is not the same as directory containing it:
+        other_dir = os.path.join(self.tmp_dir, 'dir')
+        os.makedirs(other_dir)
+        shutil.copy(path, other_dir)
+        self.assertNotEqual(self._hash(other_dir), self._hash(path))
+
+    def test_modes_and_empty_directories(self):
+        expected = self._hash(self.workspace)
+        main_path = os.path.join(self.workspace, 'main.py')
+        os.chmod(main_path, 0o755)
+        self.assertNotEqual(self._hash(self.workspace), expected)
+        os.chmod(main_path, 0o644)
+        self.assertEqual(self._hash(self.workspace), expected)
+
+        os.makedirs(os.path.join(self.workspace, 'lib', 'empty'))
+        self.assertNotEqual(self._hash(self.workspace), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()